@@ -45,6 +45,37 @@ def SWAP(argv):
         in in its entirety, because a classifier can reappear any time
         to  have their agent update its confusion matrix.
 
+        With "daemon: True", SWAP does not stop at the end of the
+        batch: it keeps the bureau and sample in memory, interprets
+        classifications as they arrive (from the database, or from the
+        append-only file named by "stream"), and checkpoints every
+        "checkpoint_every" classifications or "checkpoint_interval"
+        seconds, until it is stopped with SIGINT or SIGTERM. See
+        swap/stream.py.
+
+        With "dbspecies: Digested", classifications are read not from
+        the Mongo but from a cache made by make_digested_cache.py, named
+        by "dbfile" - which is much faster when the same classifications
+        are to be replayed many times. See swap/digested.py. With
+        "dbspecies: BSON", they are read straight from the .bson files
+        of a database dump (in the directory named by "dbfile"), with no
+        need for mongod or mongorestore. See swap/bsondump.py. With
+        "dbspecies: SQLite", they are read from a local SQLite file
+        exported by make_sqlite_db.py. See swap/sqlitedb.py.
+
+        At the end of a batch, the exact update time and _id of the
+        last classification interpreted are written to update.config, as
+        "resume" - so that the next batch starts straight after it,
+        rather than at the start time, which is only good to the second.
+
+        With "offline: True" and "offline_incremental: True", the
+        offline analysis picks up where the last batch's left off: the
+        offline pickle named by "offlinefile" is read back in, this
+        batch's votes are added to it, and the EM resumes from the old
+        taus and confusion matrices, settling the agents and subjects
+        with new votes before one sweep over everything. See
+        swap/votes.py.
+
     FLAGS
         -h            Print this message
 
@@ -118,8 +149,17 @@ def SWAP(argv):
 
 
     practise = (tonights.parameters['dbspecies'] == 'Toy')
+    digested = (tonights.parameters['dbspecies'] == 'Digested')
+    dumped = (tonights.parameters['dbspecies'] == 'BSON')
+    stored = (tonights.parameters['dbspecies'] == 'SQLite')
     if practise:
         print "SWAP: doing a dry run using a Toy database"
+    elif digested:
+        print "SWAP: data will be read from the digested cache "+tonights.parameters['dbfile']
+    elif dumped:
+        print "SWAP: data will be read from the database dump in "+tonights.parameters['dbfile']
+    elif stored:
+        print "SWAP: data will be read from the SQLite store "+tonights.parameters['dbfile']
     else:
         print "SWAP: data will be read from the current live Mongo database"
 
@@ -210,12 +250,44 @@ def SWAP(argv):
         try: offline_initial_prior = tonights.parameters['offline_initial_prior']
         except: offline_initial_prior = 2e-4
         print "SWAP: set initial prior for offline analysis to ",offline_initial_prior
+        try: offline_engine = tonights.parameters['offline_engine']
+        except: offline_engine = 'dict'
+        print "SWAP: offline EM engine is ",offline_engine
+        try: offline_accelerate = tonights.parameters['offline_accelerate']
+        except: offline_accelerate = None
+        if offline_accelerate is not None:
+            print "SWAP: accelerating the offline EM with ",offline_accelerate
+        try: offline_processes = tonights.parameters['offline_processes']
+        except: offline_processes = 1
+        if offline_processes is not None:
+            offline_processes = int(offline_processes)
+        if offline_processes is None:
+            print "SWAP: sharing the offline EM out among one process per core"
+        elif offline_processes != 1:
+            print "SWAP: sharing the offline EM out among",offline_processes,"processes"
         # PJM bug: offline_initial_prior should just be the same p0 as online
         # code uses. (I think this means updating subject.py)
         # now initialize some parameters
         offline_probabilities = {}
         offline_bureau = {}
         offline_training_IDs = {}
+        offline_prior = offline_initial_prior
+
+        # Pick up from the last batch's offline analysis? If so, keep
+        # track of the agents and subjects with new votes:
+        offline_updated = None
+        try: offline_incremental = tonights.parameters['offline_incremental']
+        except: offline_incremental = False
+        if offline_incremental:
+            try: offlinefile = tonights.parameters['offlinefile']
+            except: offlinefile = None
+            state = swap.read_pickle(offlinefile,'offline')
+            if state is not None and len(state) == 5:
+                offline_bureau, offline_prior, offline_probabilities, information, offline_training_IDs = state
+                offline_updated = (set(),set())
+                print "SWAP: resuming offline analysis of",len(offline_probabilities),"subjects by",len(offline_bureau),"agents"
+            else:
+                print "SWAP: no offline analysis to resume, starting afresh"
 
         # some settings that I guess you could configure but these work fine enough
         offline_initialPL = tonights.parameters['initialPL']
@@ -235,16 +307,101 @@ def SWAP(argv):
     # samples each time we update a subject)?
     Nrealizations = tonights.parameters['Nrealizations']
 
+    # Shall we keep the agents' and subjects' numbers in columnar tables?
+    try: columnar = tonights.parameters['columnar']
+    except: columnar = False
+
+    # Shall we apply classifications a chunk at a time, with numpy? This
+    # needs columnar storage.
+    try: chunksize = int(tonights.parameters['chunksize'])
+    except: chunksize = 0
+    if chunksize > 0:
+        columnar = True
+        print "SWAP: classifications will be replayed in chunks of ",chunksize
+
+    if columnar:
+        print "SWAP: agents and subjects will be stored in columnar tables"
+
+    # Shall new subjects keep log odds, rather than probabilities?
+    try: logodds = tonights.parameters['logodds']
+    except: logodds = False
+    if logodds:
+        print "SWAP: new subjects will store their log odds"
+
+    # Shall the trajectories be kept in single precision, to save memory?
+    try: precision = tonights.parameters['trajectory_precision']
+    except: precision = 'double'
+    if precision == 'single':
+        trajectory_dtype = np.float32
+        print "SWAP: subject trajectories will be stored in single precision"
+    else:
+        trajectory_dtype = np.float64
+
+    # Shall the agents' histories be downsampled, to save memory?
+    try: history_keep = int(tonights.parameters['history_keep'])
+    except: history_keep = 0
+    if history_keep > 0:
+        print "SWAP: agents will keep at most",history_keep,"records in their histories"
+
+    # Shall we checkpoint the bureau and sample as a snapshot plus a journal
+    # of the agents and subjects that changed, rather than re-pickling
+    # everything every time?
+    try: journal = tonights.parameters['journal']
+    except: journal = False
+    try: journal_fraction = float(tonights.parameters['journal_fraction'])
+    except: journal_fraction = 0.5
+    if journal:
+        print "SWAP: only changed agents and subjects will be saved, in a journal"
+
+    # Shall we read and digest the classifications in background threads,
+    # while this one interprets them?
+    try: prefetch_threads = int(tonights.parameters['prefetch_threads'])
+    except: prefetch_threads = 0
+    try: prefetch_depth = int(tonights.parameters['prefetch_depth'])
+    except: prefetch_depth = 16
+    if prefetch_threads > 0:
+        print "SWAP: classifications will be read and digested by",prefetch_threads,"background threads"
+
+    # Shall we keep running, interpreting classifications as they arrive,
+    # and checkpointing every so often?
+    try: daemon = tonights.parameters['daemon']
+    except: daemon = False
+    if daemon:
+        try: stream = tonights.parameters['stream']
+        except: stream = 'database'
+        try: checkpoint_every = int(tonights.parameters['checkpoint_every'])
+        except: checkpoint_every = 10000
+        try: checkpoint_interval = float(tonights.parameters['checkpoint_interval'])
+        except: checkpoint_interval = 600.0
+        print "SWAP: running as a daemon, reading classifications from the",stream
+        print "SWAP: and checkpointing every",checkpoint_every,"classifications or",checkpoint_interval,"seconds"
+        if offline:
+            print "SWAP: offline analysis is not done in daemon mode"
+            offline = False
+
+    # Where exactly did the last batch stop? Its resume token (see
+    # swap/mongodb.py) only counts if the start time has not been
+    # changed since:
+    try: resume = tonights.parameters.pop('resume')
+    except: resume = None
+    if daemon or practise:
+        resume = None
+    elif resume is not None and not str(resume).startswith(tonights.parameters['start']):
+        print "SWAP: ignoring the resume token "+str(resume)+", which does not match the start time"
+        resume = None
+    elif resume is not None:
+        print "SWAP: resuming straight after "+resume
+
     # ------------------------------------------------------------------
     # Read in, or create, a bureau of agents who will represent the
     # volunteers:
 
-    bureau = swap.read_pickle(tonights.parameters['bureaufile'],'bureau')
+    bureau = swap.read_pickle(tonights.parameters['bureaufile'],'bureau',columnar=columnar,history_keep=history_keep)
 
     # ------------------------------------------------------------------
     # Read in, or create, an object representing the candidate list:
 
-    sample = swap.read_pickle(tonights.parameters['samplefile'],'collection')
+    sample = swap.read_pickle(tonights.parameters['samplefile'],'collection',columnar=columnar,logodds=logodds,trajectory_dtype=trajectory_dtype)
 
     # ------------------------------------------------------------------
     # Open up database:
@@ -262,14 +419,128 @@ def SWAP(argv):
         print "SWAP: made by ",db.population," Toy classifiers"
         print "SWAP: where each classifier makes ",db.enthusiasm," classifications, on average"
 
+    elif digested:
+
+        db = swap.DigestedDB(tonights.parameters['dbfile'])
+        print "SWAP: cache has ",db.size()," digested classifications"
+
+    elif dumped:
+
+        db = swap.BSONDB(tonights.parameters['dbfile'])
+        print "SWAP: dump has ",db.size()," classifications"
+
+    elif stored:
+
+        db = swap.SQLiteDB(tonights.parameters['dbfile'])
+        print "SWAP: store has ",db.size()," classifications"
+
     else:
 
         db = swap.MongoDB()
 
+    # Set up the interpretation of classifications, in tonight's
+    # learning mode:
+
+    replay = swap.Replay(bureau,sample,tonights.parameters,thresholds,Nrealizations,
+                         supervised=supervised,
+                         supervised_and_unsupervised=supervised_and_unsupervised,
+                         agents_willing_to_learn=agents_willing_to_learn,
+                         a_few_at_the_start=a_few_at_the_start,
+                         hasty=waste)
+    chunk = []
+
+    # Pickle the bureau or sample, in full or (after the first time) by
+    # journalling the changes. After offline analysis, members may have
+    # been removed, which needs a full snapshot:
+
+    def save(contents,filename):
+        if journal:
+            swap.write_checkpoint(contents,filename,fraction=journal_fraction,snapshot=offline)
+        else:
+            swap.write_pickle(contents,filename)
+        return
+
+    # In daemon mode, keep interpreting classifications as they arrive,
+    # until the stream finishes or we are stopped (see swap/stream.py).
+    # Each checkpoint saves the pickles, the retirement list and
+    # update.config, just as the end of a batch run would:
+
+    if daemon:
+
+        if stream == 'database' and (practise or digested or dumped or stored):
+            source = swap.BatchStream(db,t1,survey,method=use_marker_positions)
+        elif stream == 'database':
+            source = swap.MongoStream(db,t1,survey,method=use_marker_positions,stage=stage)
+        else:
+            source = swap.FileStream(stream,since=t1)
+
+        def checkpoint(watcher):
+
+            # Name the outputs after the first classification, as below:
+            tonights.parameters['finish'] = watcher.first
+            tonights.parameters['start'] = watcher.last
+            tonights.parameters['trunk'] = \
+                tonights.parameters['survey']+'_'+tonights.parameters['finish']
+            tonights.parameters['dir'] = os.getcwd()+'/'+tonights.parameters['trunk']
+            subprocess.call(["mkdir","-p",tonights.parameters['dir']])
+
+            if tonights.parameters['repickle']:
+                new_bureaufile = swap.get_new_filename(tonights.parameters,'bureau')
+                save(bureau,new_bureaufile)
+                tonights.parameters['bureaufile'] = new_bureaufile
+
+                new_samplefile = swap.get_new_filename(tonights.parameters,'collection')
+                save(sample,new_samplefile)
+                tonights.parameters['samplefile'] = new_samplefile
+
+            new_retirementfile = swap.get_new_filename(tonights.parameters,'retire_these')
+            N = swap.write_list(sample,new_retirementfile,item='retired_subject')
+
+            random_file = open(tonights.parameters['random_file'],"w");
+            cPickle.dump(np.random.get_state(),random_file);
+            random_file.close();
+
+            swap.write_config('update.config', tonights.parameters)
+
+            print "SWAP: checkpoint after",watcher.count,"classifications, up to "+watcher.last+":",N,"subjects retired"
+            sys.stdout.flush()
+
+            return
+
+        watcher = swap.Daemon(replay,source,stage,checkpoint,
+                              every=checkpoint_every,
+                              interval=checkpoint_interval,
+                              chunksize=chunksize,
+                              end=t2,
+                              vb=vb)
+        count = watcher.run()
+
+        if count > 0:
+            t1 = datetime.datetime.strptime(watcher.first, '%Y-%m-%d_%H:%M:%S')
+            tstring = watcher.last
+            t = datetime.datetime.strptime(tstring, '%Y-%m-%d_%H:%M:%S')
+        else:
+            tstring = tonights.parameters['start']
+
+        # Nothing left to read in:
+        batch = []
+
     # Read in a batch of classifications, made since the aforementioned
-    # start time:
+    # start time. The database is asked to leave out other projects' and
+    # stages' classifications, and any made after the end time:
+
+    elif practise:
+        batch = db.find('since',t1)
 
-    batch = db.find('since',t1)
+    else:
+        batch = db.find('since',t1,survey=survey,stage=stage,end=t2,after=resume)
+
+    # Maybe have them digested in the background (see swap/pipeline.py):
+    pipeline = None
+    if prefetch_threads > 0 and not daemon:
+        pipeline = swap.Pipeline(db,batch,survey,method=use_marker_positions,
+                                 readers=prefetch_threads,depth=prefetch_depth)
+        batch = pipeline
 
     # Actually, batch is a cursor, now set to the first classification
     # after time t1. Maybe this could be a Kafka cursor instead? And then
@@ -280,16 +551,24 @@ def SWAP(argv):
     # ------------------------------------------------------------------
 
     count_max = N_per_batch
-    print "SWAP: interpreting up to",count_max," classifications..."
-    if one_by_one: print "SWAP: ...one by one - hit return for the next one..."
+    if not daemon:
+        print "SWAP: interpreting up to",count_max," classifications..."
+        if one_by_one: print "SWAP: ...one by one - hit return for the next one..."
+        count = 0
+    last = None
+    stopped_early = False
 
-    count = 0
     for classification in batch:
 
         if one_by_one: next = raw_input()
 
-        # Get the vitals for this classification:
-        items = db.digest(classification,survey,method=use_marker_positions)
+        # Get the vitals for this classification (unless a reader thread
+        # already has):
+        if pipeline is None:
+            items = db.digest(classification,survey,method=use_marker_positions)
+        else:
+            items = classification
+            classification = pipeline.current
         if vb: print "#"+str(count+1)+". items = ",items
         if items is None:
             continue # Tutorial subjects fail, as do stage/project mismatches!
@@ -299,9 +578,9 @@ def SWAP(argv):
         # PJM 20014-08-21: added "flavor" of subject, 'lensing cluster', len
         tstring,Name,ID,ZooID,category,kind,flavor,X,Y,location,classification_stage,at_x,at_y = items
 
-        # this is probably bad form:
-        at_x = eval(at_x)
-        at_y = eval(at_y)
+        # this is probably bad form (but a digested cache serves up lists):
+        if isinstance(at_x,str): at_x = eval(at_x)
+        if isinstance(at_y,str): at_y = eval(at_y)
 
         t = datetime.datetime.strptime(tstring, '%Y-%m-%d_%H:%M:%S')
 
@@ -319,45 +598,28 @@ def SWAP(argv):
 
         # Break out if we've reached the time limit:
         if t > t2:
+            stopped_early = True
             break
 
-        # Register new volunteers, and create an agent for each one:
-        # Old, slow code: if Name not in bureau.list():
-        try: test = bureau.member[Name]
-        except: bureau.member[Name] = swap.Agent(Name,tonights.parameters)
-
-        # Register newly-classified subjects:
-        # Old, slow code: if ID not in sample.list():
-        try: test = sample.member[ID]
-        except: sample.member[ID] = swap.Subject(ID,ZooID,category,kind,flavor,Y,thresholds,location,Nrealizations)
-
-        # Update the subject's lens probability using input from the
-        # classifier. We send that classifier's agent to the subject
-        # to do this.
-        sample.member[ID].was_described(by=bureau.member[Name],as_being=X,at_time=tstring,while_ignoring=a_few_at_the_start,haste=waste,at_x=at_x,at_y=at_y)
-
-        # Update the agent's confusion matrix, based on what it heard:
-
-        P = sample.member[ID].mean_probability
-
-        if supervised_and_unsupervised:
-            # use both training and test images
-            if agents_willing_to_learn * ((category == 'test') + (category == 'training')):
-                bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=False)
-            elif ((category == 'test') + (category == 'training')):
-                bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=True)
-        elif supervised:
-            # Only use training images!
-            if category == 'training' and agents_willing_to_learn:
-                bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=False)
-            elif category == 'training':
-                bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=True)
+        # Only now is this classification sure to be interpreted, so
+        # the next batch can resume straight after it:
+        last = classification
+
+        # Register new volunteers and newly-classified subjects, send
+        # the classifier's agent to the subject to update its lens
+        # probability, and then update the agent's confusion matrix,
+        # based on what it heard (see swap/replay.py).
+        # In chunked mode, this happens for a whole chunk at once.
+
+        items = tstring,Name,ID,ZooID,category,kind,flavor,X,Y,location,classification_stage,at_x,at_y
+        if chunksize > 0:
+            chunk.append(items)
+            if len(chunk) == chunksize:
+                replay.chunk(chunk)
+                chunk = []
+            P = None
         else:
-            # Unsupervised: ignore all the training images...
-            if category == 'test' and agents_willing_to_learn:
-                bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=False)
-            elif category == 'test':
-                bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=True)
+            P = replay.classify(items)
 
         # Update offline system
         if offline:
@@ -393,9 +655,13 @@ def SWAP(argv):
             else:
                 offline_bureau[Name]['Subjects'].update({ID: offline_conversion[X]})
 
+            if offline_updated is not None:
+                offline_updated[0].add(Name)
+                offline_updated[1].add(ID)
+
         # Brag about it:
         count += 1
-        if vb:
+        if vb and chunksize == 0:
             print swap.dashedline
             print "SWAP: Subject "+ID+" was classified by "+Name+" during Stage ",stage
             print "SWAP: he/she said "+X+" when it was actually "+Y+", with Pr(LENS) = "+str(P)
@@ -417,11 +683,28 @@ def SWAP(argv):
             swap.set_cookie(True)
         # Have we done enough for this run?
         elif count == count_max:
+            stopped_early = True
             break
 
+    # Finish off the last chunk:
+    replay.chunk(chunk)
+
     sys.stdout.write('\n')
     if vb: print swap.dashedline
     print "SWAP: total no. of classifications processed: ",count
+    if pipeline is not None:
+        pipeline.stop()
+        print "SWAP: "+str(pipeline)
+    # The database can only say what it left out once the whole batch
+    # has been read (and the readers have stopped):
+    if not practise and not daemon and not stopped_early:
+        print "SWAP: the database left out",db.skipped,"classifications from other projects or stages"
+    if not practise and not digested:
+        print "SWAP: subject "+str(db.cache)
+
+    # Next time, start straight after the last classification interpreted:
+    if not practise and not daemon and last is not None:
+        resume = db.token(last)
 
     #-------------------------------------------------------------------------
 
@@ -429,10 +712,12 @@ def SWAP(argv):
     if offline:
         # run EM_algorithm
         offline_bureau, offline_prior, offline_probabilities, offline_information_dict \
-            = swap.EM_algorithm(offline_bureau, offline_initial_prior,
+            = swap.EM_algorithm(offline_bureau, offline_prior,
                     offline_probabilities, offline_training_IDs,
                     offline_N_min, offline_N_max, offline_epsilon_min,
-                    return_information=True)
+                    return_information=True, engine=offline_engine,
+                    accelerate=offline_accelerate, updated=offline_updated,
+                    processes=offline_processes)
         # now replace probabilities in the main bureau and such
         for ID in sample.list():
             # just in case any IDs didn't get into offline somehow?!
@@ -505,7 +790,7 @@ def SWAP(argv):
         t = t1
         more_to_do = False
         # return
-    elif count < count_max: # ie we didn't make it through the whole batch  this time!
+    elif count < count_max or daemon: # ie we didn't make it through the whole batch  this time!
         more_to_do = False
     else:
         more_to_do = True
@@ -519,7 +804,11 @@ def SWAP(argv):
     # classification timestamp!
     tonights.parameters['finish'] = t1.strftime('%Y-%m-%d_%H:%M:%S')
 
-    # Let's also update the start parameter, ready for next time:
+    # Let's also update the start parameter, ready for next time - to
+    # agree with the resume token, if there is one:
+    if resume is not None:
+        tstring = resume.split('.')[0]
+        tonights.parameters['resume'] = resume
     tonights.parameters['start'] = tstring
 
     # Use the following directory for output lists and plots:
@@ -535,17 +824,18 @@ def SWAP(argv):
     # (ie with SWAPSHOP) - so save the pickles in the $cwd. This is
     # taken care of in io.py. Note that we update the parameters as
     # we go - this will be useful later when we write update.config.
+    # In daemon mode, this was done at the last checkpoint.
 
-    if tonights.parameters['repickle'] and count > 0:
+    if tonights.parameters['repickle'] and count > 0 and not daemon:
 
         new_bureaufile = swap.get_new_filename(tonights.parameters,'bureau')
         print "SWAP: saving agents to "+new_bureaufile
-        swap.write_pickle(bureau,new_bureaufile)
+        save(bureau,new_bureaufile)
         tonights.parameters['bureaufile'] = new_bureaufile
 
         new_samplefile = swap.get_new_filename(tonights.parameters,'collection')
         print "SWAP: saving subjects to "+new_samplefile
-        swap.write_pickle(sample,new_samplefile)
+        save(sample,new_samplefile)
         tonights.parameters['samplefile'] = new_samplefile
 
         if practise:
@@ -557,8 +847,9 @@ def SWAP(argv):
         if offline:
             new_offlinefile = swap.get_new_filename(tonights.parameters,'offline')
             print "SWAP: saving offline pickle to "+new_offlinefile
-            tup = (offline_bureau, offline_prior, offline_probabilities, offline_information_dict)
+            tup = (offline_bureau, offline_prior, offline_probabilities, offline_information_dict, offline_training_IDs)
             swap.write_pickle(tup, new_offlinefile)
+            tonights.parameters['offlinefile'] = new_offlinefile
 
     # ------------------------------------------------------------------
 
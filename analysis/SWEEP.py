@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# ======================================================================
+
+import swap
+
+import sys,os,getopt,datetime
+
+# ======================================================================
+
+def SWEEP(argv):
+    """
+    NAME
+        SWEEP.py
+
+    PURPOSE
+        Space Warps parameter sweep: replay the same classifications
+        under many SWAP configurations at once, on all the cores of
+        this machine, and tabulate the results.
+
+    COMMENTS
+        The classifications are read (or digested) only once, into a
+        digested cache that all the configurations replay from in
+        parallel - rather than running SWAP.py, and reading the whole
+        database, once per configuration. If the first config file has
+        "dbspecies: Digested", its cache is used; otherwise the
+        classifications are digested from the Mongo (or a dump, with
+        "dbspecies: BSON", a store, with "dbspecies: SQLite", or a file
+        of digested classifications) into the output directory first.
+
+        Each configuration's outputs go in a directory of their own,
+        and a summary of all of them goes in sweep_summary.txt.
+        See swap/sweep.py.
+
+    FLAGS
+        -h                Print this message
+
+    INPUTS
+        configfiles       One or more SWAP config files
+
+    OPTIONAL INPUTS
+        -v key=a,b,c      Vary a parameter over these values (may be
+                          given more than once: every combination is
+                          run). The key "mode" varies over supervised,
+                          unsupervised and supervised_and_unsupervised.
+        -n N              Number of processes [one per core]
+        -o directory      Output directory [sweep]
+        -c cache          Digested cache to replay
+        -f digested.txt   Digest this file, rather than the Mongo
+
+    OUTPUTS
+        stdout
+        sweep/sweep_summary.txt
+        sweep/<name>/*
+
+    EXAMPLE
+
+        SWEEP.py -v mode=supervised,unsupervised -v skepticism=1,2,4 CFHTLS_stage1.config
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+    # ------------------------------------------------------------------
+
+    try:
+       opts, args = getopt.getopt(argv,"hv:n:o:c:f:",["help"])
+    except getopt.GetoptError, err:
+       print str(err) # will print something like "option -a not recognized"
+       print SWEEP.__doc__  # will print the big comment above.
+       return
+
+    vary = {}
+    varied = []
+    processes = None
+    outdir = 'sweep'
+    cache = None
+    digestedfile = None
+
+    for o,a in opts:
+       if o in ("-h", "--help"):
+          print SWEEP.__doc__
+          return
+       elif o in ("-v"):
+          key,values = a.split('=')
+          vary[key] = values.split(',')
+          varied.append(key)
+       elif o in ("-n"):
+          processes = int(a)
+       elif o in ("-o"):
+          outdir = a
+       elif o in ("-c"):
+          cache = a
+       elif o in ("-f"):
+          digestedfile = a
+       else:
+          assert False, "unhandled option"
+
+    # Check for setup files in array args:
+    if len(args) > 0:
+        configfiles = args
+    else:
+        print SWEEP.__doc__
+        return
+
+    print swap.doubledashedline
+    print swap.hello
+    print swap.doubledashedline
+    print "SWEEP: taking instructions from",', '.join(configfiles)
+
+    configurations = swap.sweep_configurations(configfiles,vary=vary)
+    print "SWEEP: that makes",len(configurations),"configurations to replay"
+
+    if not os.path.exists(outdir): os.makedirs(outdir)
+
+    # ------------------------------------------------------------------
+    # Read in the classifications, once:
+
+    first = configurations[0]
+    if cache is None and first['dbspecies'] == 'Digested':
+        cache = first['dbfile']
+
+    if cache is None:
+        cache = outdir+'/classifications.digested'
+        survey = first['survey']
+        try: method = first['use_marker_positions']
+        except: method = False
+
+        if digestedfile is None and first['dbspecies'] in ('BSON','SQLite'):
+            print "SWEEP: digesting "+survey+" classifications from "+first['dbfile']
+            if first['dbspecies'] == 'BSON':
+                db = swap.BSONDB(first['dbfile'])
+            else:
+                db = swap.SQLiteDB(first['dbfile'])
+            batch = db.find('since',datetime.datetime(1978, 2, 28, 12, 0, 0, 0),survey=survey)
+            classifications = (db.digest(classification,survey,method=method) for classification in batch)
+        elif digestedfile is None:
+            print "SWEEP: digesting "+survey+" classifications from the Mongo"
+            db = swap.MongoDB()
+            batch = db.find('since',datetime.datetime(1978, 2, 28, 12, 0, 0, 0),survey=survey)
+            classifications = db.digest_stream(batch,survey,method=method,processes=processes)
+        else:
+            print "SWEEP: reading digested classifications from "+digestedfile
+            stream = swap.FileStream(digestedfile,follow=False)
+
+            def everything():
+                while not stream.finished:
+                    for items in stream.poll():
+                        yield items
+
+            classifications = everything()
+
+        count = swap.write_digested_cache(cache,classifications,survey=survey,method=method)
+        if digestedfile is None and first['dbspecies'] not in ('BSON','SQLite'):
+            db.close()
+        print "SWEEP: digested",count,"classifications into "+cache
+
+    print "SWEEP: replaying the classifications in "+cache
+
+    # ------------------------------------------------------------------
+    # Replay them under every configuration, and tabulate the results:
+
+    summaries = swap.run_sweep(cache,configurations,outdir,processes=processes)
+
+    summaryfile = outdir+'/sweep_summary.txt'
+    swap.write_sweep_summary(summaries,summaryfile,varied=varied)
+    print "SWEEP: summary of all",len(summaries),"configurations written to "+summaryfile
+
+    print swap.doubledashedline
+
+    return
+
+# ======================================================================
+
+if __name__ == '__main__':
+    SWEEP(sys.argv[1:])
+
+# ======================================================================
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# ======================================================================
+
+import sys,getopt,datetime
+
+import swap
+
+# ======================================================================
+
+def make_digested_cache(argv):
+    """
+    NAME
+        make_digested_cache
+
+    PURPOSE
+        Digest the Space Warps classifications, once, into a compact
+        columnar cache that SWAP can replay (with "dbspecies: Digested"
+        and "dbfile" set to the cache) without the Mongo.
+
+    COMMENTS
+        Classifications are read from the live Mongo database, from the
+        .bson files of a database dump, or from a file of digested
+        classifications (one per line, 13 items
+        separated by tabs, as written by swap.write_digested). Those
+        from other projects are left out, as SWAP would; all stages
+        are kept. See swap/digested.py for the format of the cache.
+
+    FLAGS
+        -h                        Print this message
+        -m --markers              Use the marker positions, as SWAP
+                                  does with "use_marker_positions: True"
+
+    INPUTS
+        cache                     Name of the cache directory to write
+
+    OPTIONAL INPUTS
+        -s survey                 Survey project name [CFHTLS]
+        -t start                  Only digest classifications made since
+                                  this time, eg 2013-05-06_00:00:00
+        -f digested.txt           Read digested classifications from this
+                                  file instead of the Mongo
+        -b dump                   Read classifications from the .bson
+                                  files in this dump directory instead
+                                  of the Mongo
+        -n N                      Digest in N processes [one per core]
+
+    OUTPUTS
+        cache/                    Directory of numpy arrays, and an index
+
+    EXAMPLE
+
+        make_digested_cache.py -s CFHTLS -m CFHTLS_stage1.digested
+
+    BUGS
+
+    AUTHORS
+        This file is part of the Space Warps project, and is distributed
+        under the GPL v2 by the Space Warps Science Team.
+        http://spacewarps.org/
+
+    """
+
+    # ------------------------------------------------------------------
+
+    try:
+       opts, args = getopt.getopt(argv,"hms:t:f:b:n:",["help","markers"])
+    except getopt.GetoptError, err:
+       print str(err) # will print something like "option -a not recognized"
+       print make_digested_cache.__doc__  # will print the big comment above.
+       return
+
+    survey = 'CFHTLS'
+    method = False
+    since = datetime.datetime(1978, 2, 28, 12, 0, 0, 0)
+    digestedfile = None
+    dumpdir = None
+    processes = None
+
+    for o,a in opts:
+       if o in ("-h", "--help"):
+          print make_digested_cache.__doc__
+          return
+       elif o in ("-m", "--markers"):
+          method = True
+       elif o in ("-s"):
+          survey = a
+       elif o in ("-t"):
+          since = datetime.datetime.strptime(a, '%Y-%m-%d_%H:%M:%S')
+       elif o in ("-f"):
+          digestedfile = a
+       elif o in ("-b"):
+          dumpdir = a
+       elif o in ("-n"):
+          processes = int(a)
+       else:
+          assert False, "unhandled option"
+
+    if len(args) == 1:
+        cache = args[0]
+    else:
+        print make_digested_cache.__doc__
+        return
+
+    # ------------------------------------------------------------------
+    # Digest the classifications, one way or the other:
+
+    if dumpdir is not None:
+        print "make_digested_cache: digesting "+survey+" classifications from the dump in "+dumpdir
+        db = swap.BSONDB(dumpdir)
+        batch = db.find('since',since,survey=survey)
+        classifications = (db.digest(classification,survey,method=method) for classification in batch)
+
+    elif digestedfile is None:
+        print "make_digested_cache: digesting "+survey+" classifications from the Mongo"
+        db = swap.MongoDB()
+        batch = db.find('since',since,survey=survey)
+        classifications = db.digest_stream(batch,survey,method=method,processes=processes)
+
+    else:
+        print "make_digested_cache: reading digested classifications from "+digestedfile
+        stream = swap.FileStream(digestedfile,since=since,follow=False)
+
+        def everything():
+            while not stream.finished:
+                for items in stream.poll():
+                    yield items
+
+        classifications = everything()
+
+    count = swap.write_digested_cache(cache,classifications,survey=survey,method=method)
+    if digestedfile is None:
+        print "make_digested_cache: subject "+str(db.cache)
+    if dumpdir is None and digestedfile is None:
+        db.close()
+
+    # ------------------------------------------------------------------
+
+    print "make_digested_cache: wrote",count,"classifications to "+cache
+    print "make_digested_cache: all done!"
+
+    return
+
+# ======================================================================
+
+if __name__ == '__main__':
+    make_digested_cache(sys.argv[1:])
+
+# ======================================================================
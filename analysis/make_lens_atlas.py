@@ -334,12 +334,9 @@ def make_lens_atlas(args):
                 + (flags['heatmap'])
                 + (flags['points'] != 0)):
 
-                itwas = annotationhistory['ItWas']
-                x_all = annotationhistory['At_X']
-                y_all = annotationhistory['At_Y']
-
-                x_markers_all = np.array([xi for xj in x_all for xi in xj])
-                y_markers_all = np.array([yi for yj in y_all for yi in yj])
+                markers = annotationhistory.markers()
+                x_markers_all = markers['x']
+                y_markers_all = markers['y']
 
                 agents_numbers = np.arange(
                         x_markers_all.size)
@@ -379,20 +376,9 @@ def make_lens_atlas(args):
                 y_markers_filtered = y_markers_all[agents_points]
 
                 if (flags['skill']) * (len(agents) > 0):
-                    PL_all = annotationhistory['PL']
-                    PD_all = annotationhistory['PD']
-
-                    # filter out the empty clicks
-                    PL_list = []
-                    for i, xj in enumerate(x_all):
-                        PL_list.append([PL_all[i]] * len(xj))
-                    PL = np.array([PLi for PLj in PL_list for PLi in PLj])
-
-                    # filter out the empty clicks
-                    PD_list = []
-                    for i, xj in enumerate(x_all):
-                        PD_list.append([PD_all[i]] * len(xj))
-                    PD = np.array([PDi for PDj in PD_list for PDi in PDj])
+                    # PL and PD of whoever placed each marker
+                    PL = markers['PL']
+                    PD = markers['PD']
 
                     skill_all = swap.expectedInformationGain(0.5, PL, PD)
                     skill = skill_all[agents]
@@ -595,12 +581,9 @@ def make_lens_atlas(args):
                     ax.plot(x_center + b_arr, y_center + b_ones, c='r', ls='--', linewidth=4)
                     ax.plot(x_center + b_arr, y_center - b_ones, c='r', ls='--', linewidth=4)
 
-            itwas = annotationhistory['ItWas']
-            x_all = annotationhistory['At_X']
-            y_all = annotationhistory['At_Y']
-
-            x_markers_all = np.array([xi for xj in x_all for xi in xj])
-            y_markers_all = np.array([yi for yj in y_all for yi in yj])
+            markers = annotationhistory.markers()
+            x_markers_all = markers['x']
+            y_markers_all = markers['y']
 
             # now filter markers by those that are within
             # stamp_size of the stamp
@@ -628,20 +611,9 @@ def make_lens_atlas(args):
             y_markers_filtered = y_markers_all[agents_points]
 
             if flags['skill']:
-                PL_all = annotationhistory['PL']
-                PD_all = annotationhistory['PD']
-
-                # filter out the empty clicks
-                PL_list = []
-                for i, xj in enumerate(x_all):
-                    PL_list.append([PL_all[i]] * len(xj))
-                PL = np.array([PLi for PLj in PL_list for PLi in PLj])
-
-                # filter out the empty clicks
-                PD_list = []
-                for i, xj in enumerate(x_all):
-                    PD_list.append([PD_all[i]] * len(xj))
-                PD = np.array([PDi for PDj in PD_list for PDi in PDj])
+                # PL and PD of whoever placed each marker
+                PL = markers['PL']
+                PD = markers['PD']
 
                 skill_all = swap.expectedInformationGain(0.5, PL, PD)
                 skill = skill_all[agents]
@@ -236,40 +236,26 @@ def make_lens_catalog(args):
         P = subject.mean_probability
 
 
-        itwas = subject.annotationhistory['ItWas']
-        x_all = subject.annotationhistory['At_X']
-        y_all = subject.annotationhistory['At_Y']
-
-        x_markers = np.array([xi for xj in x_all for xi in xj])
-        y_markers = np.array([yi for yj in y_all for yi in yj])
+        # Markers come straight out of the collection's annotation
+        # store, along with the number of the classification each
+        # one belongs to:
+        markers = subject.annotationhistory.markers()
+        x_markers = markers['x']
+        y_markers = markers['y']
 
         catalog.update({ID: {'agents_reject': [],
                              'x': x_markers,
                              'y': y_markers,}})
+        PL = markers['PL']
+        PD = markers['PD']
+
+        # the classifications without any clicks are the NOTs
         PL_all = subject.annotationhistory['PL']
         PD_all = subject.annotationhistory['PD']
-
-        # filter out the empty clicks
-        PL_list = []
-        PL_nots = []
-        for i, xj in enumerate(x_all):
-            # len(xj) of empty = 0
-            PL_list.append([PL_all[i]] * len(xj))
-            if len(xj) == 0:
-                PL_nots.append(PL_all[i])
-        PL = np.array([PLi for PLj in PL_list for PLi in PLj])
-        PL_nots = np.array(PL_nots)
-
-        # filter out the empty clicks
-        PD_list = []
-        PD_nots = []
-        for i, xj in enumerate(x_all):
-            PD_list.append([PD_all[i]] * len(xj))
-            if len(xj) == 0:
-                PD_nots.append(PD_all[i])
-                catalog[ID]['agents_reject'].append(i)
-        PD = np.array([PDi for PDj in PD_list for PDi in PDj])
-        PD_nots = np.array(PD_nots)
+        nots = (np.bincount(markers['classification'], minlength=len(PL_all)) == 0)
+        PL_nots = PL_all[nots]
+        PD_nots = PD_all[nots]
+        catalog[ID]['agents_reject'] = list(np.where(nots)[0])
 
         skill = swap.expectedInformationGain(0.5, PL, PD)  # skill
 
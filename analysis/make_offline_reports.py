@@ -173,11 +173,13 @@ def make_offline_reports(args):
                         training_IDs.update({ID: -1})
                 probabilities.update({ID: pi})
                 online_probabilities.update({ID: subject.mean_probability})
-                for agent_i in xrange(len(subject.annotationhistory['Name'])):
-                    name = subject.annotationhistory['Name'][agent_i]
+                names = subject.annotationhistory['Name']
+                it_was = subject.annotationhistory['ItWas']
+                for agent_i in xrange(len(names)):
+                    name = names[agent_i]
                     if name in set_aside_agent:
                         continue
-                    xij = subject.annotationhistory['ItWas'][agent_i]
+                    xij = it_was[agent_i]
                     if name not in bureau_offline:
                         bureau_offline.update({name: {
                             'PD': PD0, 'PL': PL0,
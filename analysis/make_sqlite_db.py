@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# ======================================================================
+
+import sys,os,getopt,datetime
+
+import swap
+
+# ======================================================================
+
+def make_sqlite_db(argv):
+    """
+    NAME
+        make_sqlite_db
+
+    PURPOSE
+        Export the Space Warps classifications, and their subjects, to a
+        local SQLite store that SWAP can replay (with "dbspecies: SQLite"
+        and "dbfile" set to the store) with no database server.
+
+    COMMENTS
+        Classifications are read from the live Mongo database, or from
+        the .bson files of a database dump, in time order. Those from
+        every project and stage are kept. If the store already exists,
+        only the classifications made since the last one in it are
+        added - so running this again brings it up to date. See
+        swap/sqlitedb.py for the format of the store.
+
+    FLAGS
+        -h                        Print this message
+
+    INPUTS
+        store                     Name of the SQLite file to write
+
+    OPTIONAL INPUTS
+        -t start                  Only export classifications made since
+                                  this time, eg 2013-05-06_00:00:00
+        -b dump                   Read classifications from the .bson
+                                  files in this dump directory instead
+                                  of the Mongo
+
+    OUTPUTS
+        store                     SQLite file
+
+    EXAMPLE
+
+        make_sqlite_db.py -t 2013-05-06_00:00:00 spacewarps.sqlite
+
+    BUGS
+
+    AUTHORS
+        This file is part of the Space Warps project, and is distributed
+        under the GPL v2 by the Space Warps Science Team.
+        http://spacewarps.org/
+
+    """
+
+    # ------------------------------------------------------------------
+
+    try:
+       opts, args = getopt.getopt(argv,"ht:b:",["help"])
+    except getopt.GetoptError, err:
+       print str(err) # will print something like "option -a not recognized"
+       print make_sqlite_db.__doc__  # will print the big comment above.
+       return
+
+    since = datetime.datetime(1978, 2, 28, 12, 0, 0, 0)
+    dumpdir = None
+
+    for o,a in opts:
+       if o in ("-h", "--help"):
+          print make_sqlite_db.__doc__
+          return
+       elif o in ("-t"):
+          since = datetime.datetime.strptime(a, '%Y-%m-%d_%H:%M:%S')
+       elif o in ("-b"):
+          dumpdir = a
+       else:
+          assert False, "unhandled option"
+
+    if len(args) == 1:
+        store = args[0]
+    else:
+        print make_sqlite_db.__doc__
+        return
+
+    # ------------------------------------------------------------------
+    # Carry on from the last classification stored, if there is one:
+
+    latest = None
+    if os.path.exists(store):
+        latest = swap.SQLiteDB(store).latest()
+        if latest is not None:
+            print "make_sqlite_db: adding classifications made since "+latest+" to "+store
+
+    if dumpdir is not None:
+        print "make_sqlite_db: exporting classifications from the dump in "+dumpdir
+        db = swap.BSONDB(dumpdir)
+    else:
+        print "make_sqlite_db: exporting classifications from the Mongo"
+        db = swap.MongoDB()
+
+    batch = db.find('since',since,after=latest)
+    count = swap.write_sqlite_db(store,db,batch)
+    print "make_sqlite_db: subject "+str(db.cache)
+
+    # ------------------------------------------------------------------
+
+    print "make_sqlite_db: wrote",count,"classifications to "+store
+    print "make_sqlite_db: all done!"
+
+    return
+
+# ======================================================================
+
+if __name__ == '__main__':
+    make_sqlite_db(sys.argv[1:])
+
+# ======================================================================
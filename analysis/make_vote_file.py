@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# ======================================================================
+
+import sys,getopt
+
+import numpy as np
+
+import swap
+
+# ======================================================================
+
+def make_vote_file(argv):
+    """
+    NAME
+        make_vote_file
+
+    PURPOSE
+        Export the votes in a digested cache to a vote file, and/or run
+        the offline EM on a vote file out of core - so that whole
+        surveys can be analysed offline on a small machine.
+
+    COMMENTS
+        Each agent's last vote on each subject is kept, as SWAP's
+        offline analysis keeps it. The training subjects' true values
+        are used, or not, according to the mode, as in SWAP: in
+        supervised mode, the test subjects are left out of the M step;
+        in unsupervised mode, the training subjects are. See
+        swap/votefile.py for the format of the file.
+
+        With -e, the EM reads the votes from the file a chunk at a
+        time on every step, keeping only the agents' and subjects'
+        parameters in memory, and saves the fitted ones back into the
+        file (PL.npy, PD.npy, Pi.npy, tau.npy, in the order of the
+        names and IDs in index.pickle). Running it again carries on
+        from them.
+
+        With -v, the accelerated EM is first checked against plain EM:
+        both are run from the parameters in the file, and the number of
+        taus they disagree on (by more than 0.01) is reported. Where
+        the EM has more than one fixed point, SQUAREM's jumps can land
+        on a different one from plain EM's.
+
+    FLAGS
+        -h                        Print this message
+        -e                        Run the offline EM on the vote file
+        -v                        Check the accelerated EM against plain EM
+
+    INPUTS
+        votefile                  Name of the vote file directory
+
+    OPTIONAL INPUTS
+        -c cache                  Export the votes in this digested cache
+                                  (see make_digested_cache.py)
+        -g stage                  Only export votes from this stage
+        -m mode                   supervised, unsupervised or
+                                  supervised_and_unsupervised [supervised]
+        -p prior                  Subjects' initial probability [2e-4]
+        -i PL,PD                  Agents' initial PL and PD [0.5,0.5]
+        -a squarem                Accelerate the EM
+        -n N                      Run the EM in N processes [1]
+        -k chunksize              Votes to read at a time [1000000]
+
+    OUTPUTS
+        votefile/                 Directory of vote columns, parameters
+                                  and an index
+
+    EXAMPLE
+
+        make_vote_file.py -c CFHTLS.digested -g 1 -e -a squarem CFHTLS_stage1.votes
+
+    BUGS
+        Finding each agent's last vote on each subject takes an int64
+        key per vote in memory, while exporting.
+
+    AUTHORS
+        This file is part of the Space Warps project, and is distributed
+        under the GPL v2 by the Space Warps Science Team.
+        http://spacewarps.org/
+
+    """
+
+    # ------------------------------------------------------------------
+
+    try:
+       opts, args = getopt.getopt(argv,"hevc:g:m:p:i:a:n:k:",["help"])
+    except getopt.GetoptError, err:
+       print str(err) # will print something like "option -a not recognized"
+       print make_vote_file.__doc__  # will print the big comment above.
+       return
+
+    fit = False
+    check = False
+    cache = None
+    stage = None
+    mode = 'supervised'
+    prior = 2e-4
+    initialPL,initialPD = 0.5,0.5
+    accelerate = None
+    processes = 1
+    chunksize = 1000000
+
+    for o,a in opts:
+       if o in ("-h", "--help"):
+          print make_vote_file.__doc__
+          return
+       elif o in ("-e"):
+          fit = True
+       elif o in ("-v"):
+          check = True
+       elif o in ("-c"):
+          cache = a
+       elif o in ("-g"):
+          stage = a
+       elif o in ("-m"):
+          mode = a
+       elif o in ("-p"):
+          prior = float(a)
+       elif o in ("-i"):
+          initialPL,initialPD = [float(value) for value in a.split(',')]
+       elif o in ("-a"):
+          accelerate = a
+       elif o in ("-n"):
+          processes = int(a)
+       elif o in ("-k"):
+          chunksize = int(a)
+       else:
+          assert False, "unhandled option"
+
+    if len(args) == 1 and (cache is not None or fit):
+        votefile = args[0]
+    else:
+        print make_vote_file.__doc__
+        return
+
+    # ------------------------------------------------------------------
+    # Export the votes, keeping each agent's last word on each subject:
+
+    if cache is not None:
+
+        print "make_vote_file: exporting votes from the digested cache in "+cache
+        db = swap.DigestedDB(cache)
+        index = db.index
+        Nsubjects = len(index['IDs'])
+
+        if stage is None:
+            rows = np.arange(db.size())
+        elif str(stage) in index['stages']:
+            rows = np.flatnonzero(db.stage == index['stages'].index(str(stage)))
+        else:
+            rows = np.zeros(0,dtype=np.int64)
+
+        key = db.agent[rows].astype(np.int64)*Nsubjects + db.subject[rows]
+        unique,last = np.unique(key[::-1],return_index=True)
+        rows = np.sort(rows[len(rows)-1-last])
+        del key,unique,last
+        print "make_vote_file: keeping",len(rows),"votes"
+
+        # Training subjects' true values, by mode:
+        supervised,supervised_and_unsupervised = swap.MODES[mode]
+        category = np.zeros(Nsubjects,dtype=np.int8)
+        truth = np.zeros(Nsubjects,dtype=np.int8)
+        category[db.subject[rows]] = db.category[rows]
+        truth[db.subject[rows]] = db.truth[rows]
+        training_IDs = {}
+        for s in np.unique(db.subject[rows]):
+            if index['category'][category[s]] == 'training':
+                if supervised or supervised_and_unsupervised:
+                    training_IDs[index['IDs'][s]] = {'LENS': 1, 'NOT': 0}[index['truth'][truth[s]]]
+                else:
+                    training_IDs[index['IDs'][s]] = -1
+            elif not supervised or supervised_and_unsupervised:
+                pass
+            else:
+                training_IDs[index['IDs'][s]] = -1
+
+        LENS = index['result'].index('LENS')
+
+        def everything():
+            for start in xrange(0,len(rows),chunksize):
+                chunk = rows[start:start+chunksize]
+                for agent,subject,result in zip(db.agent[chunk],db.subject[chunk],db.result[chunk]):
+                    yield index['names'][agent],index['IDs'][subject],int(result == LENS)
+
+        count = swap.write_vote_file(votefile,everything(),training_IDs,
+                                     initialPL=initialPL,initialPD=initialPD,prior=prior)
+        print "make_vote_file: wrote",count,"votes to "+votefile
+
+    # ------------------------------------------------------------------
+    # Run the offline EM on them, out of core:
+
+    if fit:
+
+        if check and accelerate is not None:
+            print "make_vote_file: checking the "+accelerate+" EM against plain EM"
+            N_differ,difference,information_plain,information_fast = swap.compare_accelerated(
+                    swap.VoteFile(votefile,chunksize), N_min=10, N_max=100, epsilon_min=1e-6,
+                    accelerate=accelerate, processes=processes)
+            print "make_vote_file: plain EM took",information_plain['N_try'],"steps, "+accelerate,information_fast['N_try']
+            print "make_vote_file: they disagree on",N_differ,"taus, by up to",difference
+
+        print "make_vote_file: running the offline EM on the votes in "+votefile
+        votes,pi,information_dict = swap.EM_algorithm_streaming(votefile,
+                N_min=10, N_max=100, epsilon_min=1e-6, return_information=True,
+                accelerate=accelerate, processes=processes, chunksize=chunksize)
+        print "make_vote_file: "+str(votes)
+        print "make_vote_file: took",information_dict['N_try'],"EM steps, in %.1f seconds" % sum(information_dict['time_list'])
+        print "make_vote_file: pi =",pi,"with the taus' last change",information_dict['epsilon_taus']
+        print "make_vote_file: saved the fitted PL, PD, Pi and taus into "+votefile
+
+    # ------------------------------------------------------------------
+
+    print "make_vote_file: all done!"
+
+    return
+
+# ======================================================================
+
+if __name__ == '__main__':
+    make_vote_file(sys.argv[1:])
+
+# ======================================================================
@@ -1,11 +1,23 @@
 from logging import *
 from config import *
 from io import *
+from journal import *
 from bureau import *
 from agent import *
 from collection import *
 from subject import *
+from history import *
+from columns import *
+from replay import *
+from stream import *
+from pipeline import *
 from toydb import *
 from mongodb import *
+from bsondump import *
+from sqlitedb import *
+from digested import *
+from sweep import *
 from shannon import *
+from votes import *
+from votefile import *
 from offline import *
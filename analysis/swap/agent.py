@@ -65,16 +65,31 @@ class Agent(object):
         clearly sub-optimal, but might be good enough for a first
         attempt. We'll see!
 
+        The training and test histories are swap.History objects,
+        whose rows live in an Arena shared by the whole Bureau. They
+        read like the old dictionaries of arrays (eg
+        traininghistory['Skill']), but are appended to in amortized
+        O(1) time, via record_training and record_test.
+
 
     INITIALISATION
         name
+        pars
+        arena        The swap.Arena to keep histories in [a new one]
 
     METHODS
         Agent.update_contribution()  Calculate the expected
                                           information contributed
                                           per classification
         Agent.heard(it_was=X,actually_it_was=Y)     Read report.
+        Agent.record_training(it_was,actually_it_was)
+        Agent.record_test(ID,I,it_was)
+        Agent.get_LLR_realization(it_was,Ntrajectory)  Log likelihood
+                                          ratio of a classification
         Agent.plot_history(axes)
+        Agent.delta()                     State to journal at a checkpoint
+        Agent.apply(delta,arena)          Restore it
+        Agent.mark()                      Mark the histories as saved
 
     BUGS
 
@@ -89,7 +104,7 @@ class Agent(object):
 
 # ----------------------------------------------------------------------
 
-    def __init__(self,name,pars):
+    def __init__(self,name,pars,arena=None):
         self.name = name
         self.PD = pars['initialPD']
         self.PL = pars['initialPL']
@@ -99,8 +114,10 @@ class Agent(object):
         self.NT = 0
         # back-compatibility:
         self.contribution = 0.0*self.update_skill() # This call also sets self.skill, internally
-        self.traininghistory = {'ID':'tutorial', 'Skill':np.array([self.skill]), 'PL':np.array([self.PL]), 'PD':np.array([self.PD]), 'ItWas':np.array([], dtype=int), 'ActuallyItWas':np.array([], dtype=int)}
-        self.testhistory = {'ID':[], 'I':np.array([]), 'Skill':np.array([]), 'ItWas':np.array([], dtype=int)}
+        if arena is None:
+            arena = swap.Arena()
+        self.traininghistory = arena.training_history(self.skill,self.PL,self.PD)
+        self.testhistory = arena.test_history()
 
         return None
 
@@ -194,13 +211,28 @@ class Agent(object):
                 raise Exception("Apparently, the subject was actually a "+str(actually_it_was))
 
             # Always log progress, even if not learning:
-            self.traininghistory['Skill'] = np.append(self.traininghistory['Skill'],self.update_skill())
+            self.update_skill()
             # NB. self.skill is now up to date.
-            self.traininghistory['PL'] = np.append(self.traininghistory['PL'],self.PL)
-            self.traininghistory['PD'] = np.append(self.traininghistory['PD'],self.PD)
+            self.record_training(actually_it_was_dictionary[it_was],actually_it_was_dictionary[actually_it_was])
+
+        return
+
+# ----------------------------------------------------------------------
+# Log the agent's current skill and confusion matrix in its training
+# history, along with what was said (1 = LENS, 0 = NOT, -1 = UNKNOWN):
 
-            self.traininghistory['ItWas'] = np.append(self.traininghistory['ItWas'], actually_it_was_dictionary[it_was])
-            self.traininghistory['ActuallyItWas'] = np.append(self.traininghistory['ActuallyItWas'], actually_it_was_dictionary[actually_it_was])
+    def record_training(self,it_was,actually_it_was):
+
+        self.traininghistory.record((self.skill,self.PL,self.PD,it_was,actually_it_was))
+
+        return
+
+# ----------------------------------------------------------------------
+# Log a test subject classification, and the information it carried:
+
+    def record_test(self,ID,I,it_was):
+
+        self.testhistory.record((ID,I,self.skill,it_was))
 
         return
 
@@ -253,4 +285,78 @@ class Agent(object):
             PD_realize = self.PD
         return PD_realize;
 
+# ----------------------------------------------------------------------
+# Get the log likelihood ratio of a classification, for updating a
+# subject's log odds. With realizations, draw PL then PD as the
+# probability update does. Without, the ratio only changes when PL or
+# PD do, so keep it until they do:
+
+    def get_LLR_realization(self,it_was,Ntrajectory):
+        if Ntrajectory > 0:
+            PL_realize = self.get_PL_realization(Ntrajectory)
+            PD_realize = self.get_PD_realization(Ntrajectory)
+            if it_was == 'LENS':
+                return np.log(PL_realize/(1.0-PD_realize))
+            elif it_was == 'NOT':
+                return np.log((1.0-PL_realize)/PD_realize)
+            else:
+                raise Exception("Unrecognised classification result: "+it_was)
+
+        key = (self.PL,self.PD)
+        cache = getattr(self,'LLR',None)
+        if cache is None or cache[0] != key:
+            cache = (key,{'LENS':np.log(self.PL/(1.0-self.PD)),
+                          'NOT':np.log((1.0-self.PL)/self.PD)})
+            self.LLR = cache
+        if it_was not in cache[1]:
+            raise Exception("Unrecognised classification result: "+it_was)
+
+        return cache[1][it_was]
+
+# ----------------------------------------------------------------------
+# The agent's state, for a checkpoint journal: its numbers, and what
+# has been added to its histories since the last checkpoint. Views
+# add their table's numbers, so that the state looks the same either
+# way:
+
+    def delta(self):
+
+        state = self.__dict__.copy()
+        for key in ('LLR','_table','_row'):
+            state.pop(key,None)
+        state['traininghistory'] = self.traininghistory.delta()
+        state['testhistory'] = self.testhistory.delta()
+
+        return state
+
+# ----------------------------------------------------------------------
+# Restore the agent's state from a journal (the histories' records
+# have already been added to the arena):
+
+    def apply(self,delta,arena):
+
+        for key,value in delta.items():
+            if key == 'traininghistory' or key == 'testhistory':
+                continue
+            setattr(self,key,value)
+
+        if not isinstance(getattr(self,'traininghistory',None),swap.History):
+            self.traininghistory = swap.History(arena.training)
+        self.traininghistory.apply(delta['traininghistory'])
+
+        if not isinstance(getattr(self,'testhistory',None),swap.History):
+            self.testhistory = swap.History(arena.test)
+        self.testhistory.apply(delta['testhistory'])
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def mark(self):
+
+        self.traininghistory.mark()
+        self.testhistory.mark()
+
+        return
+
 # ======================================================================
@@ -0,0 +1,328 @@
+# ======================================================================
+
+import swap
+
+import numpy as np
+import os,sys,glob,struct,calendar,threading,cPickle
+
+try: import bson
+except:
+    print "BSONDB: pymongo (which provides bson) is not installed. You can still --practise though"
+
+# ======================================================================
+
+class BSONDB(object):
+    """
+    NAME
+        BSONDB
+
+    PURPOSE
+        Serve up classifications straight from a Mongo dump, just like
+        MongoDB does, without restoring it into a running mongod.
+
+    COMMENTS
+        A Space Warps dump (eg as unpacked by SWIPE.csh) holds the
+        classifications and subjects as .bson files: concatenated BSON
+        documents, each starting with its own length. They are read
+        directly, with the bson module that comes with pymongo.
+
+        The first time a dump is opened, both files are scanned once,
+        to make two indexes, which are saved beside them:
+
+          spacewarp_subjects.index          subject _id -> file offset
+          spacewarp_classifications.index   updated_at, file offset and
+                                            _id of every classification,
+                                            in (updated_at, _id) order
+
+        (Each is remade if its .bson file changes size.) find() then
+        searches the time index for the batch - so classifications come
+        in time order, as from MongoDB.find - and reads each document
+        from its offset as it is needed; subjects are read from theirs,
+        through a SubjectCache, when digest asks for them. Digesting is
+        done by the same functions as in MongoDB, and so are resume
+        tokens: find(...,after=token) bisects the index for the token's
+        time and then its _id.
+
+    INITIALISATION
+        directory     The unpacked dump
+        cachesize     Max. no. of subject documents to keep [100000]
+
+    METHODS AND VARIABLES
+        BSONDB.find(word,t,survey=None,stage=None,end=None,after=None)
+        BSONDB.token(classification)
+        BSONDB.digest(classification,survey,method=False)
+        BSONDB.subject(ID)
+        BSONDB.size()
+        BSONDB.skipped      No. of classifications the last find has
+                            left out so far (they are counted as the
+                            batch is read)
+
+    BUGS
+        The dump is taken to be complete: a dump that is still being
+        written should not be read.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,directory,cachesize=100000):
+
+        self.directory = directory
+        self.classificationfile = self.locate('spacewarp_classifications.bson')
+        self.subjectfile = self.locate('spacewarp_subjects.bson')
+
+        self.times,self.offsets,self.IDs = self.index_classifications()
+        self.positions = self.index_subjects()
+
+        self.classifications = open(self.classificationfile,'rb')
+        self.subjects = open(self.subjectfile,'rb')
+
+        self.cache = swap.SubjectCache(cachesize)
+        self.lock = threading.Lock()
+        self.skipped = 0
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def __str__(self):
+        return 'dump of %d classifications, of %d subjects, in %s' % (self.size(),len(self.positions),self.directory)
+
+# ----------------------------------------------------------------------------
+# The .bson files may be at the top of the dump, or in a database
+# directory (eg ouroboros/) inside it:
+
+    def locate(self,filename):
+
+        found = glob.glob(self.directory+'/'+filename)+glob.glob(self.directory+'/*/'+filename)
+        if len(found) == 0:
+            print "BSONDB: couldn't find "+filename+" in "+self.directory
+            sys.exit()
+
+        return found[0]
+
+# ----------------------------------------------------------------------------
+# Index the classifications by time (and _id, for ties), unless this
+# has been done already:
+
+    def index_classifications(self):
+
+        indexfile = os.path.splitext(self.classificationfile)[0]+'.index'
+        size = os.path.getsize(self.classificationfile)
+
+        index = read_index(indexfile,size)
+        if index is not None and len(index) == 3:
+            return index
+
+        print "BSONDB: indexing the classifications in "+self.classificationfile+", which may take a while..."
+        times,offsets,IDs = [],[],[]
+        for offset,document in scan(self.classificationfile):
+            times.append(microseconds(document['updated_at']))
+            offsets.append(offset)
+            IDs.append(str(document['_id']))
+
+        times = np.array(times,dtype=np.int64)
+        offsets = np.array(offsets,dtype=np.int64)
+        IDs = np.array(IDs,dtype=str)
+        order = np.lexsort((IDs,times))
+        index = (times[order],offsets[order],IDs[order])
+
+        write_index(indexfile,size,index)
+
+        return index
+
+# ----------------------------------------------------------------------------
+# Index the subjects by _id, unless this has been done already:
+
+    def index_subjects(self):
+
+        indexfile = os.path.splitext(self.subjectfile)[0]+'.index'
+        size = os.path.getsize(self.subjectfile)
+
+        index = read_index(indexfile,size)
+        if index is not None:
+            return index
+
+        print "BSONDB: indexing the subjects in "+self.subjectfile+"..."
+        index = {}
+        for offset,document in scan(self.subjectfile):
+            index[document['_id']] = offset
+
+        write_index(indexfile,size,index)
+
+        return index
+
+# ----------------------------------------------------------------------------
+# Return a batch of classifications, defined by a time range - either
+# classifications made 'since' t, or classifications made 'before' t.
+# As with MongoDB.find, the survey, stage, end time and a resume token
+# can be given too, and the number of classifications left out is kept
+# in self.skipped:
+
+    def find(self,word,t,survey=None,stage=None,end=None,after=None):
+
+        if word == 'since' and after is not None:
+            t,ID = swap.read_resume_token(after)
+            tied = np.searchsorted(self.times,microseconds(t),side='left')
+            untied = np.searchsorted(self.times,microseconds(t),side='right')
+            first = tied + np.searchsorted(self.IDs[tied:untied],ID,side='right')
+            last = len(self.times)
+
+        elif word == 'since':
+            first = np.searchsorted(self.times,microseconds(t),side='right')
+            last = len(self.times)
+
+        elif word == 'before':
+            first = 0
+            last = np.searchsorted(self.times,microseconds(t),side='left')
+
+        else:
+            print "BSONDB: error, cannot find classifications '"+word+"' "+str(t)
+            return []
+
+        if end is not None:
+            last = min(last,np.searchsorted(self.times,microseconds(end),side='right'))
+
+        self.skipped = 0
+
+        return self.reading(first,last,survey,stage)
+
+# ----------------------------------------------------------------------------
+# Return the token to resume a batch from, straight after this
+# classification:
+
+    def token(self,classification):
+
+        return swap.resume_token(classification['updated_at'],classification['_id'])
+
+# ----------------------------------------------------------------------------
+# Read the classifications in a range of the time index, leaving out any
+# from other projects or stages (digest would anyway):
+
+    def reading(self,first,last,survey,stage):
+
+        for k in xrange(first,last):
+            classification = self.read(self.classifications,self.offsets[k])
+
+            if survey is not None or stage is not None:
+                annotations = swap.read_annotations(classification['annotations'])
+                if (survey is not None and annotations[1] != survey) or \
+                   (stage is not None and str(annotations[0]) != str(stage)):
+                    self.skipped += 1
+                    continue
+
+            yield classification
+
+# ----------------------------------------------------------------------------
+# Read one document from a .bson file:
+
+    def read(self,F,offset):
+
+        self.lock.acquire()
+        try:
+            F.seek(int(offset))
+            header = F.read(4)
+            length = struct.unpack('<i',header)[0]
+            body = F.read(length-4)
+        finally:
+            self.lock.release()
+
+        return bson.BSON(header+body).decode()
+
+# ----------------------------------------------------------------------------
+# Return a tuple of the key quantities, given a classification - just
+# as MongoDB.digest does:
+
+    def digest(self,classification,survey,method=False):
+
+        vitals = swap.read_classification(classification,survey)
+        if vitals is None:
+            return None
+        ID = vitals[2]
+
+        return swap.interpret_classification(vitals,self.subject(ID),method=method)
+
+# ----------------------------------------------------------------------------
+# Return a subject's document, from the cache if possible:
+
+    def subject(self,ID):
+
+        subject = self.cache.get(ID)
+        if subject is None:
+            if ID not in self.positions:
+                return None
+            subject = self.read(self.subjects,self.positions[ID])
+            self.cache.put(ID,subject)
+
+        return subject
+
+# ----------------------------------------------------------------------------
+# Return the size of the classification table:
+
+    def size(self):
+
+        return len(self.times)
+
+# ======================================================================
+# Step through a .bson file, returning each document and its offset:
+
+def scan(filename):
+
+    F = open(filename,'rb')
+    offset = 0
+    while True:
+        header = F.read(4)
+        if len(header) < 4:
+            break
+        length = struct.unpack('<i',header)[0]
+        body = F.read(length-4)
+        if len(body) < length-4:
+            print "BSONDB: ignoring a truncated document at the end of "+filename
+            break
+        yield offset,bson.BSON(header+body).decode()
+        offset += length
+    F.close()
+
+    return
+
+# ----------------------------------------------------------------------------
+# Times are indexed as integer microseconds since 1970:
+
+def microseconds(t):
+    return calendar.timegm(t.timetuple())*1000000 + t.microsecond
+
+# ----------------------------------------------------------------------------
+# Indexes are pickled, together with the size of the file they index:
+
+def read_index(indexfile,size):
+
+    try:
+        F = open(indexfile,'rb')
+        indexed,index = cPickle.load(F)
+        F.close()
+    except:
+        return None
+
+    if indexed != size:
+        return None
+
+    return index
+
+def write_index(indexfile,size,index):
+
+    try:
+        F = open(indexfile+'.tmp','wb')
+        cPickle.dump((size,index),F,protocol=2)
+        F.close()
+        os.rename(indexfile+'.tmp',indexfile)
+    except IOError:
+        print "BSONDB: couldn't save the index "+indexfile+", so it will be made again next time"
+
+    return
+
+# ======================================================================
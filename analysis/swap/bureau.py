@@ -22,13 +22,45 @@ class Bureau(object):
 
     INITIALISATION
         From scratch.
+        columnar     Keep the agents' numbers in an AgentTable [False]
+        history_keep Keep at most this many records in each agent's
+                     training and test histories (0 = all) [0]
 
     METHODS AND VARIABLES
         Bureau.member(Name)         The agent assigned to Name
+        Bureau.register(Name,pars)  Assign a new agent to Name
+        Bureau.tabulate()           Move existing agents into an AgentTable
         Bureau.list                 The Names of the Bureau's members
         Bureau.size()               The size of the Bureau
         Bureau.start_history_plot()
         Bureau.finish_history_plot()
+        Bureau.dirty                The Names of agents changed since the
+                                    last checkpoint
+        Bureau.delta()              What to journal at a checkpoint
+        Bureau.apply(delta)         Replay a journal entry
+        Bureau.mark(everyone=False) Mark the dirty agents as saved
+
+    COLUMNAR MODE
+        With columnar=True, the agents are AgentViews: their PL, PD,
+        NL, ND, NT, N, skill and contribution are stored in
+        preallocated arrays in Bureau.table, indexed by integer row,
+        rather than in millions of separate __dict__s.
+        collect_probabilities() then just slices the table.
+
+    HISTORIES
+        All the agents' training and test histories are kept in one
+        swap.Arena, Bureau.arena, so that recording a classification
+        does not copy the agent's whole history. Agents read from old
+        pickles have their dictionary histories moved into the arena
+        as the bureau is unpickled.
+
+    CHECKPOINTS
+        Agents that are registered, or sent to a subject by a
+        swap.Replay, are marked dirty. At a checkpoint, delta() collects
+        their state and the arena's new rows, to be appended to a
+        journal (see swap/journal.py), and mark() then starts afresh.
+        The summaries made by collect_probabilities() are not
+        journalled, since they are always remade before they are used.
 
     BUGS
 
@@ -43,13 +75,37 @@ class Bureau(object):
 
 # ----------------------------------------------------------------------------
 
-    def __init__(self):
+    def __init__(self,columnar=False,history_keep=0):
         self.member = {}
         self.probabilities = {'LENS':np.array([]), 'NOT':np.array([])}
         self.contributions = np.array([])
+        if columnar:
+            self.table = swap.AgentTable()
+        else:
+            self.table = None
+        self.arena = swap.Arena(keep=history_keep)
+        self.dirty = set()
+        self.generation = None
 
         return None
 
+# ----------------------------------------------------------------------------
+# Old pickles have no arena: make one, and move the agents' histories
+# into it.
+
+    def __setstate__(self,state):
+
+        self.__dict__.update(state)
+        if getattr(self,'arena',None) is None:
+            self.arena = swap.Arena()
+            for Name in self.list():
+                self.arena.adopt(self.member[Name])
+        if getattr(self,'dirty',None) is None:
+            self.dirty = set()
+            self.generation = None
+
+        return
+
 # ----------------------------------------------------------------------------
 
     def __str__(self):
@@ -61,6 +117,92 @@ class Bureau(object):
     def size(self):
         return len(self.member)
 
+# ----------------------------------------------------------------------------
+# Assign a new agent to represent volunteer Name:
+
+    def register(self,Name,pars):
+
+        if self.columnar():
+            agent = swap.AgentView(Name,pars,self.table,arena=self.arena)
+        else:
+            agent = swap.Agent(Name,pars,arena=self.arena)
+        self.member[Name] = agent
+        self.dirty.add(Name)
+
+        return agent
+
+# ----------------------------------------------------------------------------
+# Are the agents' numbers stored in a table?
+
+    def columnar(self):
+        return getattr(self,'table',None) is not None
+
+# ----------------------------------------------------------------------------
+# Convert an existing bureau (eg one read from an old pickle) to
+# columnar storage:
+
+    def tabulate(self):
+
+        if self.columnar():
+            return
+
+        self.table = swap.AgentTable(capacity=max(self.size(),1024))
+        for Name in self.list():
+            self.member[Name] = swap.AgentView.adopt(self.member[Name],self.table)
+
+        return
+
+# ----------------------------------------------------------------------------
+# What has changed since the last checkpoint - or None, if the arena has
+# been compacted, and only a full snapshot will do:
+
+    def delta(self):
+
+        arena = self.arena.delta()
+        if arena is None:
+            return None
+
+        agents = {}
+        for Name in self.dirty:
+            if Name in self.member:
+                agents[Name] = self.member[Name].delta()
+
+        return {'arena':arena,'agents':agents}
+
+# ----------------------------------------------------------------------------
+# Replay a journal entry, registering any agents that are new:
+
+    def apply(self,delta):
+
+        self.arena.apply(delta['arena'])
+        for Name,state in delta['agents'].items():
+            try:
+                agent = self.member[Name]
+            except KeyError:
+                if self.columnar():
+                    agent = swap.AgentView.blank(Name,self.table)
+                else:
+                    agent = swap.Agent.__new__(swap.Agent)
+                self.member[Name] = agent
+            agent.apply(state,self.arena)
+
+        return
+
+# ----------------------------------------------------------------------------
+
+    def mark(self,everyone=False):
+
+        self.arena.mark()
+        if everyone:
+            Names = self.list()
+        else:
+            Names = [Name for Name in self.dirty if Name in self.member]
+        for Name in Names:
+            self.member[Name].mark()
+        self.dirty = set()
+
+        return
+
 # ----------------------------------------------------------------------------
 # Return a complete list of bureau members:
 
@@ -79,6 +221,18 @@ class Bureau(object):
 
     def collect_probabilities(self):
 
+        if self.columnar():
+            # Keep the same order as self.list(), for plot_probabilities:
+            rows = np.array([self.member[ID]._row for ID in self.list()],dtype=np.int64)
+            self.probabilities['LENS'] = self.table.PL[rows]
+            self.probabilities['NOT'] = self.table.PD[rows]
+            self.contributions = self.table.contribution[rows]
+            self.skills = self.table.skill[rows]
+            self.Ntraining = self.table.NT[rows].astype(float)
+            self.Ntotal = self.table.N[rows].astype(float)
+            self.Ntest = self.Ntotal - self.Ntraining
+            return
+
         PLarray = np.array([])
         PDarray = np.array([])
         contributions = np.array([])
@@ -19,11 +19,49 @@ class Collection(object):
 
     INITIALISATION
         From scratch.
+        columnar     Keep the subjects' numbers in a SubjectTable [False]
+        logodds      Store the subjects' log odds, not probabilities [False]
+        trajectory_dtype  Precision of the subjects' trajectories [np.float64]
 
     METHODS
         Collection.member(Name)     Returns the Subject called Name
+        Collection.register(ID,...) Make a new Subject called ID
+        Collection.tabulate()       Move existing subjects into a SubjectTable
         Collection.size()           Returns the size of the Collection
         Collection.list()           Returns the IDs of the members
+        Collection.dirty            The IDs of subjects changed since the
+                                    last checkpoint
+        Collection.delta()          What to journal at a checkpoint
+        Collection.apply(delta)     Replay a journal entry
+        Collection.mark(everyone=False)  Mark the dirty subjects as saved
+
+    COLUMNAR MODE
+        With columnar=True, the subjects are SubjectViews: their
+        probabilities, exposures, thresholds and (coded) status, state,
+        kind and category are stored in preallocated arrays in
+        Collection.table. collect_probabilities() and take_stock() then
+        work on whole columns at once. The table is made when the first
+        subject is registered, since only then do we know Nrealizations.
+
+    LOG-ODDS MODE
+        With logodds=True, new subjects keep the log odds of each
+        realization instead of its probability (see Subject). The mode
+        is fixed when the collection is made: subjects read back from
+        an old pickle keep whatever representation they had.
+
+    ANNOTATIONS
+        The subjects' annotation histories are all kept in one
+        swap.Annotations store, Collection.annotations, with volunteer
+        names interned and markers in one flat table. Subjects read
+        from old pickles have their annotation histories moved into
+        it as the collection is unpickled.
+
+    CHECKPOINTS
+        As for the Bureau: subjects that are registered, or described
+        via a swap.Replay, are marked dirty, and delta() collects their
+        state and the annotation store's new rows for the journal (see
+        swap/journal.py). The probability and exposure summaries are
+        not journalled, since they are always remade before use.
 
     BUGS
 
@@ -37,14 +75,38 @@ class Collection(object):
 
 # ----------------------------------------------------------------------------
 
-    def __init__(self):
+    def __init__(self,columnar=False,logodds=False,trajectory_dtype=np.float64):
 
         self.member = {}
         self.probabilities = {'sim':np.array([]), 'dud':np.array([]), 'test':np.array([])}
         self.exposure = {'sim':np.array([]), 'dud':np.array([]), 'test':np.array([])}
+        self.tabular = columnar
+        self.table = None
+        self.logodds = logodds
+        self.trajectory_dtype = trajectory_dtype
+        self.annotations = swap.Annotations()
+        self.dirty = set()
+        self.generation = None
 
         return None
 
+# ----------------------------------------------------------------------------
+# Old pickles have no annotation store: make one, and move the subjects'
+# annotation histories into it.
+
+    def __setstate__(self,state):
+
+        self.__dict__.update(state)
+        if getattr(self,'annotations',None) is None:
+            self.annotations = swap.Annotations()
+            for ID in self.list():
+                self.annotations.adopt(self.member[ID])
+        if getattr(self,'dirty',None) is None:
+            self.dirty = set()
+            self.generation = None
+
+        return
+
 # ----------------------------------------------------------------------------
 
     def __str__(self):
@@ -69,6 +131,103 @@ class Collection(object):
 #         self.exposure = N
 #         return N
 #
+# ----------------------------------------------------------------------------
+# Make a new subject, and add it to the collection:
+
+    def register(self,ID,ZooID,category,kind,flavor,truth,thresholds,location,Nrealizations):
+
+        logodds = getattr(self,'logodds',False)
+        dtype = getattr(self,'trajectory_dtype',np.float64)
+        if getattr(self,'tabular',False):
+            if self.table is None:
+                self.table = swap.SubjectTable(Nrealizations,logodds=logodds)
+            subject = swap.SubjectView(ID,ZooID,category,kind,flavor,truth,thresholds,location,Nrealizations,self.table,trajectory_dtype=dtype,annotations=self.annotations)
+        else:
+            subject = swap.Subject(ID,ZooID,category,kind,flavor,truth,thresholds,location,Nrealizations,logodds=logodds,trajectory_dtype=dtype,annotations=self.annotations)
+        self.member[ID] = subject
+        self.dirty.add(ID)
+
+        return subject
+
+# ----------------------------------------------------------------------------
+# Are the subjects' numbers stored in a table?
+
+    def columnar(self):
+        return getattr(self,'table',None) is not None
+
+# ----------------------------------------------------------------------------
+# Convert an existing collection (eg one read from an old pickle) to
+# columnar storage:
+
+    def tabulate(self):
+
+        self.tabular = True
+        if self.columnar() or self.size() == 0:
+            return
+
+        first = self.member[self.list()[0]]
+        logodds = (first.logodds is not None)
+        self.logodds = logodds
+        self.table = swap.SubjectTable(first.Nrealizations,logodds=logodds,capacity=max(self.size(),1024))
+        for ID in self.list():
+            self.member[ID] = swap.SubjectView.adopt(self.member[ID],self.table)
+
+        return
+
+# ----------------------------------------------------------------------------
+# What has changed since the last checkpoint:
+
+    def delta(self):
+
+        subjects = {}
+        for ID in self.dirty:
+            if ID in self.member:
+                subjects[ID] = self.member[ID].delta()
+
+        return {'annotations':self.annotations.delta(),'subjects':subjects}
+
+# ----------------------------------------------------------------------------
+# Replay a journal entry, registering any subjects that are new:
+
+    def apply(self,delta):
+
+        self.annotations.apply(delta['annotations'])
+        for ID,state in delta['subjects'].items():
+            try:
+                subject = self.member[ID]
+            except KeyError:
+                if getattr(self,'tabular',False):
+                    if self.table is None:
+                        self.table = swap.SubjectTable(state['Nrealizations'],logodds=('logodds' in state))
+                    subject = swap.SubjectView.blank(ID,self.table)
+                else:
+                    subject = swap.Subject.__new__(swap.Subject)
+                self.member[ID] = subject
+            subject.apply(state,self.annotations)
+
+        return
+
+# ----------------------------------------------------------------------------
+
+    def mark(self,everyone=False):
+
+        self.annotations.mark()
+        if everyone:
+            IDs = self.list()
+        else:
+            IDs = [ID for ID in self.dirty if ID in self.member]
+        for ID in IDs:
+            self.member[ID].mark()
+        self.dirty = set()
+
+        return
+
+# ----------------------------------------------------------------------------
+# Table rows of the members, in the same order as self.list():
+
+    def rows(self):
+        return np.array([self.member[ID]._row for ID in self.list()],dtype=np.int64)
+
 # ----------------------------------------------------------------------------
 # Return a complete list of collection members:
 
@@ -134,6 +293,13 @@ class Collection(object):
 #       self.probabilities[kind] = p
 #       self.exposure[kind] = n
 
+        if self.columnar():
+            rows = self.rows()
+            rows = rows[self.table.kind[rows] == swap.KIND.index(kind)]
+            self.probabilities[kind] = self.table.mean_probability[rows]
+            self.exposure[kind] = self.table.exposure[rows].astype(float)
+            return
+
         # print "Collecting probabilities in a faster way, size:",self.size()
         # Appending wastes a lot of time
         p = np.zeros(self.size())
@@ -172,6 +338,10 @@ class Collection(object):
         self.Ntd_detected = 0
         self.retirement_ages = np.array([])
 
+        if self.columnar():
+            self.take_stock_of_table()
+            return
+
         for ID in self.list():
             subject = self.member[ID]
             self.N += 1
@@ -212,6 +382,37 @@ class Collection(object):
 
         return
 
+# ----------------------------------------------------------------------
+# Same as take_stock, but counting whole columns of the subject table:
+
+    def take_stock_of_table(self):
+
+        rows = self.rows()
+        training = (self.table.category[rows] == swap.CATEGORY.index('training'))
+        sim = (self.table.kind[rows] == swap.KIND.index('sim'))
+        dud = (self.table.kind[rows] == swap.KIND.index('dud'))
+        detected = (self.table.status[rows] == swap.STATUS.index('detected'))
+        rejected = (self.table.status[rows] == swap.STATUS.index('rejected'))
+        inactive = (self.table.state[rows] == swap.STATE.index('inactive'))
+
+        self.N = len(rows)
+        self.Nt = np.sum(training)
+        self.Ntl = np.sum(training & sim)
+        self.Ntd = np.sum(training & dud)
+        self.Ns = self.N - self.Nt
+        self.Nt_detected = np.sum(training & detected)
+        self.Ntl_detected = np.sum(training & sim & detected)
+        self.Ntd_detected = np.sum(training & dud & detected)
+        self.Ns_detected = np.sum(~training & detected)
+        self.Nt_rejected = np.sum(training & rejected)
+        self.Ntl_rejected = np.sum(training & sim & rejected)
+        self.Ntd_rejected = np.sum(training & dud & rejected)
+        self.Ns_rejected = np.sum(~training & rejected)
+        self.Ns_retired = np.sum(inactive)
+        self.retirement_ages = self.table.retirement_age[rows[inactive]]
+
+        return
+
 # ----------------------------------------------------------------------
 # Make a list of subjects that have been retired during this run:
 
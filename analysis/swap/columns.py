@@ -0,0 +1,535 @@
+# ===========================================================================
+
+import swap
+
+import numpy as np
+
+# ======================================================================
+
+"""
+    NAME
+        columns
+
+    PURPOSE
+        Columnar ("struct of arrays") storage for the state of a Bureau's
+        agents and a Collection's subjects.
+
+    COMMENTS
+        Instead of every Agent and Subject carrying its own numbers
+        around in its __dict__, a Table keeps one preallocated NumPy
+        array per quantity, and each agent or subject is assigned an
+        integer row. The arrays grow by doubling, so registering a new
+        member is amortized O(1), and whole-population summaries
+        (collect_probabilities, take_stock) become array slices.
+
+        Old callers still see Agent and Subject objects: AgentView and
+        SubjectView are thin subclasses whose numerical attributes are
+        properties reading and writing their row of the table. All the
+        methods (heard, was_described, plot_trajectory...) are inherited
+        unchanged.
+
+        String-valued states (status, state, kind, category) are stored
+        as small integer codes; the tuples below give the mapping.
+
+    FUNCTIONS
+        column(name)           Property for a scalar column
+        vector(name)           Property for a vector (per-realization) column
+        coded(name,codes)      Property for a string column stored as a code
+
+    CLASSES
+        Table                  Growable struct of arrays, rows keyed by name
+        AgentTable             Table of agent confusion matrices etc
+        SubjectTable           Table of subject probabilities etc
+        AgentView              Agent whose numbers live in an AgentTable
+        SubjectView            Subject whose numbers live in a SubjectTable
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+"""
+
+# ======================================================================
+# Integer codes for string-valued subject attributes:
+
+STATUS = ('undecided','detected','rejected')
+STATE = ('active','inactive')
+KIND = ('test','sim','dud')
+CATEGORY = ('test','training')
+
+# ======================================================================
+# Properties mapping attributes onto table columns:
+
+def column(name):
+
+    def get(self):
+        return getattr(self._table,name)[self._row]
+
+    def set(self,value):
+        getattr(self._table,name)[self._row] = value
+
+    return property(get,set)
+
+# ----------------------------------------------------------------------
+
+def vector(name):
+
+    # The getter returns a view of the row, so that in-place
+    # operations like p[idx] = pmin act on the table itself.
+
+    def get(self):
+        return getattr(self._table,name)[self._row]
+
+    def set(self,value):
+        getattr(self._table,name)[self._row,:] = value
+
+    return property(get,set)
+
+# ----------------------------------------------------------------------
+
+def coded(name,codes):
+
+    lookup = dict((word,code) for code,word in enumerate(codes))
+
+    def get(self):
+        return codes[getattr(self._table,name)[self._row]]
+
+    def set(self,value):
+        getattr(self._table,name)[self._row] = lookup[value]
+
+    return property(get,set)
+
+# ======================================================================
+
+class Table(object):
+    """
+    NAME
+        Table
+
+    PURPOSE
+        A growable struct of arrays, with rows keyed by agent name or
+        subject ID.
+
+    COMMENTS
+        Columns are declared as (name, dtype, width) triples; width 0
+        means one number per row, width > 0 gives a 2D column with that
+        many numbers per row (eg one per realization). Storage doubles
+        whenever it fills up. Only the filled rows are pickled.
+
+    INITIALISATION
+        columns      List of (name, dtype, width) triples
+        capacity     Initial number of rows to allocate
+
+    METHODS AND VARIABLES
+        Table.add(key)          Allocate a row for key, return its index
+        Table.index[key]        The row assigned to key
+        Table.keys              The keys, in row order
+        Table.size              The number of rows in use
+        Table.rows(keys)        Integer array of rows for a list of keys
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,columns,capacity=1024):
+
+        self.columns = list(columns)
+        self.index = {}
+        self.keys = []
+        self.size = 0
+        self.capacity = capacity
+        for name,dtype,width in self.columns:
+            setattr(self,name,self.allocate(dtype,width,capacity))
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'table of %d rows in %d columns' % (self.size,len(self.columns))
+
+# ----------------------------------------------------------------------
+
+    def __len__(self):
+        return self.size
+
+# ----------------------------------------------------------------------
+
+    def allocate(self,dtype,width,capacity):
+        if width > 0:
+            return np.zeros((capacity,width),dtype=dtype)
+        else:
+            return np.zeros(capacity,dtype=dtype)
+
+# ----------------------------------------------------------------------
+# Double the storage of every column:
+
+    def grow(self):
+
+        capacity = max(2*self.capacity,16)
+        for name,dtype,width in self.columns:
+            new = self.allocate(dtype,width,capacity)
+            new[:self.size] = getattr(self,name)[:self.size]
+            setattr(self,name,new)
+        self.capacity = capacity
+
+        return
+
+# ----------------------------------------------------------------------
+# Assign a new row to key:
+
+    def add(self,key):
+
+        if self.size == self.capacity:
+            self.grow()
+        row = self.size
+        self.index[key] = row
+        self.keys.append(key)
+        self.size += 1
+
+        return row
+
+# ----------------------------------------------------------------------
+# Look up the rows of a list of keys:
+
+    def rows(self,keys):
+        return np.array([self.index[key] for key in keys],dtype=np.int64)
+
+# ----------------------------------------------------------------------
+# Only pickle the rows in use:
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name,dtype,width in self.columns:
+            state[name] = getattr(self,name)[:self.size].copy()
+        state['capacity'] = self.size
+        return state
+
+# ======================================================================
+
+class AgentTable(Table):
+    """
+    NAME
+        AgentTable
+
+    PURPOSE
+        Columnar storage for the confusion matrices, experience and
+        skill of a Bureau's agents.
+
+    COMMENTS
+        One row per agent: PL, PD, NL, ND, NT, N, skill, contribution.
+
+    INITIALISATION
+        capacity     Initial number of agents to allocate for
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+    def __init__(self,capacity=1024):
+
+        columns = [('PL',np.float64,0),
+                   ('PD',np.float64,0),
+                   ('NL',np.float64,0),
+                   ('ND',np.float64,0),
+                   ('NT',np.int64,0),
+                   ('N',np.int64,0),
+                   ('skill',np.float64,0),
+                   ('contribution',np.float64,0)]
+
+        Table.__init__(self,columns,capacity=capacity)
+
+        return None
+
+# ======================================================================
+
+class SubjectTable(Table):
+    """
+    NAME
+        SubjectTable
+
+    PURPOSE
+        Columnar storage for the probabilities, exposures and status of
+        a Collection's subjects.
+
+    COMMENTS
+        One row per subject. The probability column is 2D, holding
+        one number per realization (or just one, if Nrealizations = 0).
+        The status, state, kind and category columns hold codes into
+        the STATUS, STATE, KIND and CATEGORY tuples.
+
+        In log-odds mode the 2D column is logodds instead, and a
+        median_probability of NaN means it has not been worked out
+        since the last update.
+
+    INITIALISATION
+        Nrealizations   Number of realizations per subject
+        logodds         Store log odds rather than probabilities?
+        capacity        Initial number of subjects to allocate for
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+    mode = 'probability'
+
+    def __init__(self,Nrealizations,logodds=False,capacity=1024):
+
+        self.Nrealizations = Nrealizations
+        if logodds:
+            self.mode = 'logodds'
+        width = max(int(Nrealizations),1)
+
+        if logodds:
+            columns = [('logodds',np.float64,width)]
+        else:
+            columns = [('probability',np.float64,width)]
+        columns += [('mean_probability',np.float64,0),
+                   ('median_probability',np.float64,0),
+                   ('exposure',np.int64,0),
+                   ('retirement_age',np.float64,0),
+                   ('detection_threshold',np.float64,0),
+                   ('rejection_threshold',np.float64,0),
+                   ('status',np.int8,0),
+                   ('state',np.int8,0),
+                   ('kind',np.int8,0),
+                   ('category',np.int8,0)]
+
+        Table.__init__(self,columns,capacity=capacity)
+
+        return None
+
+# ======================================================================
+
+class AgentView(swap.Agent):
+    """
+    NAME
+        AgentView
+
+    PURPOSE
+        An Agent whose confusion matrix, experience and skill are
+        stored in a row of an AgentTable.
+
+    COMMENTS
+        Behaves exactly like an Agent: heard(), update_skill() and the
+        realization methods are inherited, and simply read and write
+        the table through properties. The training and test histories
+        are still held by the view itself (in the Bureau's Arena).
+
+    INITIALISATION
+        name
+        pars
+        table        The AgentTable to store the agent in
+        arena        The Arena to keep the histories in
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+    PL = column('PL')
+    PD = column('PD')
+    NL = column('NL')
+    ND = column('ND')
+    NT = column('NT')
+    N = column('N')
+    skill = column('skill')
+    contribution = column('contribution')
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,name,pars,table,arena=None):
+
+        self._table = table
+        self._row = table.add(name)
+        swap.Agent.__init__(self,name,pars,arena=arena)
+
+        return None
+
+# ----------------------------------------------------------------------
+# Make a view of an existing Agent, copying its state into the table:
+
+    @classmethod
+    def adopt(cls,agent,table):
+
+        view = cls.__new__(cls)
+        view._table = table
+        view._row = table.add(agent.name)
+        for key,value in agent.__dict__.items():
+            setattr(view,key,value)
+
+        return view
+
+# ----------------------------------------------------------------------
+# Journal the table's numbers along with the rest:
+
+    def delta(self):
+
+        state = swap.Agent.delta(self)
+        for name,dtype,width in self._table.columns:
+            state[name] = getattr(self,name)
+
+        return state
+
+# ----------------------------------------------------------------------
+# A view with a new row, ready for apply() to fill in:
+
+    @classmethod
+    def blank(cls,name,table):
+
+        view = cls.__new__(cls)
+        view._table = table
+        view._row = table.add(name)
+
+        return view
+
+# ======================================================================
+
+class SubjectView(swap.Subject):
+    """
+    NAME
+        SubjectView
+
+    PURPOSE
+        A Subject whose probabilities, exposure and status are stored in
+        a row of a SubjectTable.
+
+    COMMENTS
+        Behaves exactly like a Subject: was_described() and
+        plot_trajectory() are inherited, and read and write the table
+        through properties. Note that subject.probability is a view of
+        the table row, so in-place edits go straight into the table.
+        The trajectory and annotation history are still held by the
+        view itself. If the table is in log-odds mode, subject.logodds
+        is the row view instead, and subject.probability is computed
+        from it.
+
+    INITIALISATION
+        As for Subject, plus
+        table        The SubjectTable to store the subject in
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+    mean_probability = column('mean_probability')
+
+    def get_probability(self):
+        if self._table.mode == 'logodds':
+            return swap.expit(self._table.logodds[self._row])
+        else:
+            return self._table.probability[self._row]
+
+    def set_probability(self,value):
+        if self._table.mode == 'logodds':
+            self._table.logodds[self._row,:] = swap.logit(value)
+        else:
+            self._table.probability[self._row,:] = value
+
+    probability = property(get_probability,set_probability)
+
+    def get_logodds(self):
+        if self._table.mode == 'logodds':
+            return self._table.logodds[self._row]
+        else:
+            return None
+
+    def set_logodds(self,value):
+        if value is not None:
+            self._table.logodds[self._row,:] = value
+
+    logodds = property(get_logodds,set_logodds)
+
+    def get_median_probability(self):
+        median = self._table.median_probability[self._row]
+        if median != median:
+            median = self.median_from_logodds(self.logodds)
+            self._table.median_probability[self._row] = median
+        return median
+
+    def set_median_probability(self,value):
+        self._table.median_probability[self._row] = value
+
+    median_probability = property(get_median_probability,set_median_probability)
+
+    exposure = column('exposure')
+    retirement_age = column('retirement_age')
+    detection_threshold = column('detection_threshold')
+    rejection_threshold = column('rejection_threshold')
+    status = coded('status',STATUS)
+    state = coded('state',STATE)
+    kind = coded('kind',KIND)
+    category = coded('category',CATEGORY)
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,ID,ZooID,category,kind,flavor,truth,thresholds,location,Nrealizations,table,trajectory_dtype=np.float64,annotations=None):
+
+        self._table = table
+        self._row = table.add(ID)
+        swap.Subject.__init__(self,ID,ZooID,category,kind,flavor,truth,thresholds,location,Nrealizations,logodds=(table.mode == 'logodds'),trajectory_dtype=trajectory_dtype,annotations=annotations)
+
+        return None
+
+# ----------------------------------------------------------------------
+# Make a view of an existing Subject, copying its state into the table:
+
+    @classmethod
+    def adopt(cls,subject,table):
+
+        view = cls.__new__(cls)
+        view._table = table
+        view._row = table.add(subject.ID)
+        for key,value in subject.__dict__.items():
+            setattr(view,key,value)
+
+        return view
+
+# ----------------------------------------------------------------------
+# Journal the table's numbers along with the rest, as a Subject would
+# keep them: status etc as strings, and the median as it stands (NaN
+# if not yet worked out):
+
+    def delta(self):
+
+        state = swap.Subject.delta(self)
+        for name,dtype,width in self._table.columns:
+            if name in ('status','state','kind','category'):
+                state[name] = getattr(self,name)
+            else:
+                state[name] = np.copy(getattr(self._table,name)[self._row])
+
+        return state
+
+# ----------------------------------------------------------------------
+# A view with a new row, ready for apply() to fill in:
+
+    @classmethod
+    def blank(cls,ID,table):
+
+        view = cls.__new__(cls)
+        view._table = table
+        view._row = table.add(ID)
+
+        return view
+
+# ======================================================================
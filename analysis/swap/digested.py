@@ -0,0 +1,339 @@
+# ===========================================================================
+
+import swap
+
+import numpy as np
+import os,shutil,array,calendar,time,datetime,cPickle
+
+# ======================================================================
+
+"""
+    NAME
+        digested
+
+    PURPOSE
+        Digest a source of classifications once, into a compact
+        columnar cache on disk, and serve it back up through a memory
+        map - so that a parameter study can replay the same
+        classifications many times without going near the Mongo.
+
+    COMMENTS
+        The cache is a directory of numpy arrays, one per column, with
+        one row per digested classification (in the order the source
+        gave them):
+
+            time        int64   seconds since 1970 (UTC)
+            agent       int32   index into the interned agent names
+            subject     int32   index into the interned subject IDs
+            category    int8    index into CATEGORY (test, training)
+            kind        int8    index into KIND (test, sim, dud)
+            result      int8    index into RESULT (NOT, LENS)
+            truth       int8    index into TRUTH (NOT, LENS, UNKNOWN)
+            stage       int8    index into the stages seen
+            markers     int64   offsets into x and y (one more than
+                                the number of rows)
+            x, y        float64 marker positions, all classifications'
+                                end to end
+
+        and an index.pickle holding the interned names and IDs, and
+        each subject's ZooID, flavor and location, together with the
+        survey and marker method the source was digested with.
+        Vocabularies not in the tuples above (a new kind, say) are
+        appended to them, in the index.
+
+        A DigestedDB looks just like a MongoDB to SWAP: find() returns
+        the rows made since (or before) a given time, and digest()
+        turns a row back into the usual 13 items - except that the
+        marker positions come back as lists, not strings, so they need
+        no eval. The project cut was made when the cache was written,
+        and so was the tutorial subjects'; find() can make the stage
+        cut, and the end time cut, as MongoDB.find() does.
+
+        Use make_digested_cache.py to make a cache, and
+        "dbspecies: Digested" (with "dbfile" pointing at the cache) to
+        have SWAP read one.
+
+    FUNCTIONS
+        write_digested_cache(directory,classifications,survey=None,method=False)
+
+    CLASSES
+        DigestedDB(directory)
+
+    BUGS
+        A cache is not appended to: digest the whole source again
+        (or a later part of it, into a second cache) to bring it up to
+        date.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+"""
+
+RESULT = ('NOT','LENS')
+TRUTH = ('NOT','LENS','UNKNOWN')
+
+COLUMNS = {'time':np.int64,
+           'agent':np.int32,
+           'subject':np.int32,
+           'category':np.int8,
+           'kind':np.int8,
+           'result':np.int8,
+           'truth':np.int8,
+           'stage':np.int8}
+
+# ======================================================================
+# Write a cache, given an iterable of digested classifications (13-item
+# tuples, as returned by db.digest - None's are skipped). The cache is
+# written alongside, and then moved into place. Returns the number of
+# classifications cached:
+
+def write_digested_cache(directory,classifications,survey=None,method=False):
+
+    vocabulary = {'agent':[], 'subject':[], 'stage':[],
+                  'category':list(swap.CATEGORY), 'kind':list(swap.KIND),
+                  'result':list(RESULT), 'truth':list(TRUTH)}
+    codes = {}
+    for name in vocabulary.keys():
+        codes[name] = dict([(word,i) for i,word in enumerate(vocabulary[name])])
+
+    def intern(name,word):
+        try:
+            return codes[name][word]
+        except KeyError:
+            code = len(vocabulary[name])
+            vocabulary[name].append(word)
+            codes[name][word] = code
+            return code
+
+    columns = {}
+    for name in COLUMNS.keys():
+        columns[name] = array.array('l' if name == 'time' else 'i')
+    markers = array.array('l',[0])
+    x = array.array('d')
+    y = array.array('d')
+    ZooIDs,flavors,locations = [],[],[]
+    stamps = {}
+
+    for items in classifications:
+
+        if items is None: continue
+
+        tstring,Name,ID,ZooID,category,kind,flavor,X,Y,location,stage,at_x,at_y = items
+
+        if isinstance(at_x,str): at_x = eval(at_x)
+        if isinstance(at_y,str): at_y = eval(at_y)
+
+        # Several classifications are often made in the same second:
+        try:
+            t = stamps[tstring]
+        except KeyError:
+            t = calendar.timegm(time.strptime(tstring,'%Y-%m-%d_%H:%M:%S'))
+            stamps[tstring] = t
+            if len(stamps) > 100000: stamps.clear()
+
+        subject = intern('subject',ID)
+        if subject == len(ZooIDs):
+            ZooIDs.append(ZooID)
+            flavors.append(flavor)
+            locations.append(location)
+
+        columns['time'].append(t)
+        columns['agent'].append(intern('agent',Name))
+        columns['subject'].append(subject)
+        columns['category'].append(intern('category',category))
+        columns['kind'].append(intern('kind',kind))
+        columns['result'].append(intern('result',X))
+        columns['truth'].append(intern('truth',Y))
+        columns['stage'].append(intern('stage',stage))
+
+        x.extend(at_x)
+        y.extend(at_y)
+        markers.append(len(x))
+
+    # Write everything to a fresh directory, and swap it in at the end:
+    scratch = directory.rstrip('/')+'.tmp'
+    if os.path.exists(scratch): shutil.rmtree(scratch)
+    os.makedirs(scratch)
+
+    for name,dtype in COLUMNS.items():
+        np.save(scratch+'/'+name+'.npy',np.array(columns[name],dtype=dtype))
+    np.save(scratch+'/markers.npy',np.array(markers,dtype=np.int64))
+    np.save(scratch+'/x.npy',np.array(x,dtype=np.float64))
+    np.save(scratch+'/y.npy',np.array(y,dtype=np.float64))
+
+    index = {'names':vocabulary['agent'],
+             'IDs':vocabulary['subject'],
+             'ZooIDs':ZooIDs,
+             'flavors':flavors,
+             'locations':locations,
+             'stages':vocabulary['stage'],
+             'category':vocabulary['category'],
+             'kind':vocabulary['kind'],
+             'result':vocabulary['result'],
+             'truth':vocabulary['truth'],
+             'survey':survey,
+             'method':method}
+    F = open(scratch+'/index.pickle','wb')
+    cPickle.dump(index,F,protocol=2)
+    F.close()
+
+    if os.path.exists(directory): shutil.rmtree(directory)
+    os.rename(scratch,directory)
+
+    return len(columns['time'])
+
+# ======================================================================
+
+class DigestedDB(object):
+    """
+    NAME
+        DigestedDB
+
+    PURPOSE
+        Serve up classifications from a digested cache, just like
+        MongoDB does (but without the Mongo).
+
+    COMMENTS
+        The columns are memory-mapped, read-only, so opening even a
+        large cache is quick, and several SWAPs (eg in a parameter
+        study) can share the pages. A "batch" is an array of row
+        numbers; digest() takes one row number. The survey and method
+        passed to digest() are only checked against those the cache
+        was made with. A resume token names a row (the classifications
+        being in the order they were cached), so find(...,after=token)
+        starts with the next one.
+
+    INITIALISATION
+        directory   The cache, as written by write_digested_cache
+
+    METHODS AND VARIABLES
+        DigestedDB.find(word,t,survey=None,stage=None,end=None,after=None)
+                                    Rows made 'since' or 'before' t
+        DigestedDB.token(row)
+        DigestedDB.digest(row,survey,method=False)
+        DigestedDB.size()
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,directory):
+
+        self.directory = directory
+
+        for name in COLUMNS.keys()+['markers','x','y']:
+            self.__dict__[name] = np.load(directory+'/'+name+'.npy',mmap_mode='r')
+
+        F = open(directory+'/index.pickle','rb')
+        self.index = cPickle.load(F)
+        F.close()
+
+        self.checked = False
+        self.skipped = 0
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'digested cache of %d classifications' % (self.size())
+
+# ----------------------------------------------------------------------
+# Return a batch of classifications, defined by a time range - either
+# classifications made 'since' t, or classifications made 'before' t:
+
+# As with MongoDB.find, the stage, end time and a resume token can be
+# given too, and the number of classifications left out is kept in
+# self.skipped. The survey was chosen when the cache was made.
+
+    def find(self,word,t,survey=None,stage=None,end=None,after=None):
+
+        seconds = calendar.timegm(t.timetuple())
+
+        if word == 'since' and after is not None:
+            t,row = swap.read_resume_token(after)
+            window = np.zeros(self.size(),dtype=bool)
+            window[int(row)+1:] = True
+
+        elif word == 'since':
+            window = (self.time > seconds)
+
+        elif word == 'before':
+            window = (self.time < seconds)
+
+        else:
+            print "DigestedDB: error, cannot find classifications '"+word+"' "+str(t)
+            return np.zeros(0,dtype=np.int64)
+
+        if end is not None:
+            window &= (self.time <= calendar.timegm(end.timetuple()))
+
+        wanted = window
+        if stage is not None:
+            if str(stage) in self.index['stages']:
+                wanted = window & (self.stage == self.index['stages'].index(str(stage)))
+            else:
+                wanted = np.zeros(len(window),dtype=bool)
+
+        batch = np.flatnonzero(wanted)
+        self.skipped = np.sum(window) - len(batch)
+
+        return batch
+
+# ----------------------------------------------------------------------
+# Return the token to resume a batch from, straight after this row:
+
+    def token(self,row):
+
+        return swap.resume_token(datetime.datetime.utcfromtimestamp(self.time[row]),row)
+
+# ----------------------------------------------------------------------
+# Return a tuple of the key quantities, given a row number:
+
+    def digest(self,row,survey,method=False):
+
+        index = self.index
+
+        if not self.checked:
+            if index['survey'] is not None and survey != index['survey']:
+                print "DigestedDB: warning: cache was made for the "+str(index['survey'])+" survey, not "+str(survey)
+            if method != index['method']:
+                print "DigestedDB: warning: cache was made with use_marker_positions =",index['method']
+            self.checked = True
+
+        subject = self.subject[row]
+        start,end = self.markers[row],self.markers[row+1]
+
+        items = time.strftime('%Y-%m-%d_%H:%M:%S',time.gmtime(self.time[row])), \
+                index['names'][self.agent[row]], \
+                index['IDs'][subject], \
+                index['ZooIDs'][subject], \
+                index['category'][self.category[row]], \
+                index['kind'][self.kind[row]], \
+                index['flavors'][subject], \
+                index['result'][self.result[row]], \
+                index['truth'][self.truth[row]], \
+                index['locations'][subject], \
+                index['stages'][self.stage[row]], \
+                self.x[start:end].tolist(), \
+                self.y[start:end].tolist()
+
+        return items
+
+# ----------------------------------------------------------------------
+# Return the number of classifications in the cache:
+
+    def size(self):
+
+        return len(self.time)
+
+# ======================================================================
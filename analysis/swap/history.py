@@ -0,0 +1,1081 @@
+# ===========================================================================
+
+import swap
+
+import numpy as np
+import array
+
+# ======================================================================
+
+"""
+    NAME
+        history
+
+    PURPOSE
+        Growable storage for the histories that agents and subjects
+        accumulate, one classification at a time.
+
+    COMMENTS
+        Appending to a NumPy array with np.append copies the whole
+        array, so a history of k steps costs O(k^2) to build. The
+        buffers here keep some spare capacity instead, doubling it
+        whenever it runs out, so that appending is amortized O(1).
+        Only the filled part is pickled.
+
+        Agents' training and test histories all live in one Arena per
+        Bureau: a pair of Records tables, each a growable struct of
+        arrays with one row per classification, from any agent. Each
+        agent's History just remembers which rows are its own, and
+        hands back read-only arrays under the old dictionary keys.
+
+        Subjects' annotation histories are kept the same way, in one
+        Annotations store per Collection. Volunteer names are interned
+        to integer agent numbers, and the markers (clicks) of all the
+        classifications are kept in one flat table, each
+        classification recording the offset and number of its markers.
+
+        All of these only ever grow at the end (until downsampling
+        compacts a Records table), so each keeps a mark of how far it
+        had got at the last checkpoint: delta() returns what has been
+        added since, apply(delta) adds it to a copy read back from the
+        last snapshot, and mark() moves the mark on. See swap/journal.py.
+
+    CLASSES
+        Trajectory      A subject's probability (or log odds) after each
+                        classification, one row of realizations per step
+        Records         Growable struct of arrays, one row per record
+        History         One agent's rows of a Records table, dict-style
+        Arena           A Bureau's training and test Records
+        AnnotationHistory  One subject's classifications and markers
+        Annotations     A Collection's annotation and marker Records
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+"""
+
+# ======================================================================
+
+class Trajectory(object):
+    """
+    NAME
+        Trajectory
+
+    PURPOSE
+        Store a subject's trajectory: its Nrealizations probabilities
+        (or log odds) after each classification.
+
+    COMMENTS
+        The steps are the rows of a 2D array, with max(Nrealizations,1)
+        columns, whose capacity doubles as it fills. compact() returns
+        the (steps x realizations) array filled so far, which is what
+        plot_trajectory wants. np.asarray(trajectory) gives the old flat
+        layout, all the realizations of step 0, then step 1, and so on.
+
+        dtype=np.float32 halves the memory, at the cost of precision in
+        the plotted trajectories only - the subject's own probabilities
+        are kept in double precision.
+
+    INITIALISATION
+        Nrealizations   Number of realizations per step
+        dtype           Precision of the stored values [np.float64]
+        capacity        Initial number of steps to allocate for [4]
+
+    METHODS
+        Trajectory.append(values)   Add a step
+        Trajectory.compact()        The (steps x realizations) array
+        Trajectory.last()           The latest step
+        Trajectory.adopt(array,N)   Make a Trajectory from a flat array
+        Trajectory.delta()          The steps added since the last mark
+        Trajectory.apply(delta)     Add them
+        Trajectory.mark()           Mark the current step
+        len(Trajectory)             The number of steps
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    saved = 0
+
+    def __init__(self,Nrealizations,dtype=np.float64,capacity=4):
+
+        self.width = max(int(Nrealizations),1)
+        self.steps = 0
+        self.data = np.zeros((capacity,self.width),dtype=dtype)
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'trajectory of %d steps of %d realizations' % (self.steps,self.width)
+
+# ----------------------------------------------------------------------
+
+    def __len__(self):
+        return self.steps
+
+# ----------------------------------------------------------------------
+# Old code treated the trajectory as one flat array:
+
+    def __array__(self,dtype=None):
+        flat = self.compact().ravel()
+        if dtype is not None:
+            flat = flat.astype(dtype)
+        return flat
+
+# ----------------------------------------------------------------------
+# Add the values after the latest classification, doubling the storage
+# if it is full:
+
+    def append(self,values):
+
+        if self.steps == len(self.data):
+            data = np.zeros((max(2*len(self.data),4),self.width),dtype=self.data.dtype)
+            data[:self.steps] = self.data[:self.steps]
+            self.data = data
+        self.data[self.steps] = values
+        self.steps += 1
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def compact(self):
+        return self.data[:self.steps]
+
+# ----------------------------------------------------------------------
+
+    def last(self):
+        return self.data[self.steps-1]
+
+# ----------------------------------------------------------------------
+# Make a Trajectory out of an old flat trajectory array:
+
+    @classmethod
+    def adopt(cls,array,Nrealizations,dtype=np.float64):
+
+        trajectory = cls(Nrealizations,dtype=dtype,capacity=1)
+        array = np.asarray(array).reshape(-1,trajectory.width)
+        trajectory.data = np.array(array,dtype=dtype)
+        trajectory.steps = len(array)
+
+        return trajectory
+
+# ----------------------------------------------------------------------
+# The steps since the last checkpoint, and how to add them back:
+
+    def delta(self):
+        return {'saved':self.saved,'steps':self.data[self.saved:self.steps].copy()}
+
+# ----------------------------------------------------------------------
+
+    def apply(self,delta):
+
+        steps = delta['steps']
+        self.steps = min(self.steps,delta['saved'])
+        for values in steps:
+            self.append(values)
+        self.mark()
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def mark(self):
+        self.saved = self.steps
+        return
+
+# ----------------------------------------------------------------------
+# Only pickle the steps so far:
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['data'] = self.compact().copy()
+        return state
+
+# ======================================================================
+# Columns of the agents' training and test histories:
+
+TRAINING = [('Skill',np.float64),
+            ('PL',np.float64),
+            ('PD',np.float64),
+            ('ItWas',np.int64),
+            ('ActuallyItWas',np.int64)]
+
+TEST = [('ID',object),
+        ('I',np.float64),
+        ('Skill',np.float64),
+        ('ItWas',np.int64)]
+
+# ======================================================================
+
+class Records(object):
+    """
+    NAME
+        Records
+
+    PURPOSE
+        A growable struct of arrays, holding the records of many
+        Histories, one row per record.
+
+    COMMENTS
+        Rows are handed out in the order the records arrive, so one
+        agent's rows are scattered through the table. Storage doubles
+        whenever it fills up. If the Histories are being downsampled,
+        the rows they drop are counted as dead, and once they
+        outnumber the live ones the table is compacted.
+
+    INITIALISATION
+        columns      List of (name, dtype) pairs
+        capacity     Initial number of rows to allocate
+
+    METHODS AND VARIABLES
+        Records.append(values)  Store a record, return its row
+        Records.size            The number of rows in use
+        Records.dead            The number of those no longer wanted
+        Records.keep            Maximum number of records per History
+                                (0 means keep them all)
+        Records.delta()         The rows added since the last mark
+        Records.apply(delta)    Add them
+        Records.mark()          Mark the current size
+        Records.moved           Have the rows been compacted since?
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    saved = 0
+    moved = False
+
+    def __init__(self,columns,capacity=1024):
+
+        self.columns = list(columns)
+        self.size = 0
+        self.dead = 0
+        self.keep = 0
+        self.capacity = capacity
+        self.histories = []
+        for name,dtype in self.columns:
+            setattr(self,name,np.zeros(capacity,dtype=dtype))
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'table of %d records in %d columns' % (self.size,len(self.columns))
+
+# ----------------------------------------------------------------------
+
+    def __len__(self):
+        return self.size
+
+# ----------------------------------------------------------------------
+# Double the storage of every column:
+
+    def grow(self):
+
+        capacity = max(2*self.capacity,1024)
+        for name,dtype in self.columns:
+            new = np.zeros(capacity,dtype=dtype)
+            new[:self.size] = getattr(self,name)[:self.size]
+            setattr(self,name,new)
+        self.capacity = capacity
+
+        return
+
+# ----------------------------------------------------------------------
+# Store one record, given its values in column order:
+
+    def append(self,values):
+
+        if self.size == self.capacity:
+            self.grow()
+        row = self.size
+        for (name,dtype),value in zip(self.columns,values):
+            getattr(self,name)[row] = value
+        self.size += 1
+
+        return row
+
+# ----------------------------------------------------------------------
+# Throw away the dead rows, giving each History a contiguous block:
+
+    def compact(self):
+
+        live = [history.live() for history in self.histories]
+        if len(live) > 0:
+            rows = np.concatenate(live)
+        else:
+            rows = np.array([],dtype=np.int64)
+
+        capacity = max(2*len(rows),1024)
+        for name,dtype in self.columns:
+            new = np.zeros(capacity,dtype=dtype)
+            new[:len(rows)] = getattr(self,name)[rows]
+            setattr(self,name,new)
+        self.capacity = capacity
+        self.size = len(rows)
+        self.dead = 0
+
+        start = 0
+        for history,these in zip(self.histories,live):
+            history.relocate(start,len(these))
+            start += len(these)
+
+        # Every History has moved, so no delta can describe this:
+        self.moved = True
+
+        return
+
+# ----------------------------------------------------------------------
+# The rows added since the last checkpoint, and how to add them back:
+
+    def delta(self):
+
+        columns = {}
+        for name,dtype in self.columns:
+            columns[name] = getattr(self,name)[self.saved:self.size].copy()
+
+        return {'saved':self.saved,'columns':columns,'dead':self.dead}
+
+# ----------------------------------------------------------------------
+
+    def apply(self,delta):
+
+        columns = delta['columns']
+        n = len(columns[self.columns[0][0]])
+        self.size = min(self.size,delta['saved'])
+        while self.size + n > self.capacity:
+            self.grow()
+        for name,dtype in self.columns:
+            getattr(self,name)[self.size:self.size+n] = columns[name]
+        self.size += n
+        self.dead = delta['dead']
+        self.mark()
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def mark(self):
+        self.saved = self.size
+        self.moved = False
+        return
+
+# ----------------------------------------------------------------------
+# Only pickle the rows in use:
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name,dtype in self.columns:
+            state[name] = getattr(self,name)[:self.size].copy()
+        state['capacity'] = self.size
+        return state
+
+# ======================================================================
+
+class History(object):
+    """
+    NAME
+        History
+
+    PURPOSE
+        One agent's training or test history, stored as rows of a
+        shared Records table.
+
+    COMMENTS
+        Looks like the dictionary of arrays it replaces:
+        history['Skill'] is an array of the agent's skill after each
+        record, and so on. The arrays are gathered from the table
+        when first asked for, and kept until the next record (so
+        history['Skill'][i] in a loop does not gather them again);
+        they are read-only, and new records go in through
+        history.record().
+
+        A training history starts with the agent's initial skill, PL
+        and PD, before any ItWas - these are kept in history.start.
+        Values that never change (the training ID, 'tutorial') are
+        kept in history.constants.
+
+        If the Records table has keep > 0, the history is thinned
+        whenever it grows past keep records, by dropping every other
+        one, so that what remains is an evenly spaced sample of at
+        most keep records. The latest record is always kept, so that
+        history['Skill'][-1] is still the current skill.
+
+    INITIALISATION
+        records      The Records table to store the rows in
+        start        Dictionary of first values for some keys [None]
+        constants    Dictionary of fixed values for other keys [None]
+
+    METHODS AND VARIABLES
+        History.record(values)  Add a record, values in column order
+        History[key]            Read-only array of values
+        History.forget()        Drop the arrays gathered so far
+        History.keys()          The keys, as for the old dictionary
+        History.count           The number of records ever made
+        History.stride          Only every stride-th record is kept
+        History.delta()         Its rows, counts etc since the last mark
+        History.apply(delta)    Bring it up to date
+        History.mark()          Mark the current rows
+        len(History)            The number of records kept
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    saved = 0
+    cache = None
+
+    def __init__(self,records,start=None,constants=None):
+
+        self.records = records
+        self.start = start or {}
+        self.constants = constants or {}
+        self.rows = array.array('l')
+        self.last = -1
+        self.count = 0
+        self.stride = 1
+        records.histories.append(self)
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'history of %d records' % (self.count)
+
+# ----------------------------------------------------------------------
+
+    def __len__(self):
+        return len(self.live())
+
+# ----------------------------------------------------------------------
+
+    def keys(self):
+        return self.constants.keys() + [name for name,dtype in self.records.columns]
+
+# ----------------------------------------------------------------------
+
+    def __contains__(self,key):
+        return key in self.keys()
+
+# ----------------------------------------------------------------------
+# Add a record, thinning the history if there are too many:
+
+    def record(self,values):
+
+        records = self.records
+        row = records.append(values)
+
+        # The previous record was only held on to for being the latest:
+        if self.last >= 0 and (self.count-1) % self.stride != 0:
+            records.dead += 1
+
+        if self.count % self.stride == 0:
+            self.rows.append(row)
+            if records.keep > 0 and len(self.rows) > records.keep:
+                # Drop every other row - but the latest, if dropped, is
+                # still held as self.last until the next record:
+                records.dead += len(self.rows)/2 - (len(self.rows)%2 == 0)
+                self.rows = self.rows[::2]
+                self.stride *= 2
+                self.saved = 0
+
+        self.last = row
+        self.count += 1
+        self.forget()
+
+        if records.dead > 1024 and 2*records.dead > records.size:
+            records.compact()
+
+        return
+
+# ----------------------------------------------------------------------
+# The rows currently held, in order, including the latest one:
+
+    def live(self):
+
+        if len(self.rows) > 0:
+            rows = np.frombuffer(self.rows,dtype=np.int_).astype(np.int64)
+        else:
+            rows = np.array([],dtype=np.int64)
+        if self.last >= 0 and (len(rows) == 0 or rows[-1] != self.last):
+            rows = np.append(rows,self.last)
+
+        return rows
+
+# ----------------------------------------------------------------------
+# After compaction, our live rows are the block starting at start:
+
+    def relocate(self,start,n):
+
+        if n == 0:
+            return
+        latest_kept = ((self.count-1) % self.stride == 0)
+        if latest_kept:
+            self.rows = array.array('l',range(start,start+n))
+        else:
+            self.rows = array.array('l',range(start,start+n-1))
+        self.last = start+n-1
+        self.saved = 0
+        self.forget()
+
+        return
+
+# ----------------------------------------------------------------------
+# The rows added since the last checkpoint (the records themselves are
+# in the Records delta), and how to add them back:
+
+    def delta(self):
+
+        return {'start':self.start,
+                'constants':self.constants,
+                'saved':self.saved,
+                'rows':self.rows[self.saved:],
+                'last':self.last,
+                'count':self.count,
+                'stride':self.stride}
+
+# ----------------------------------------------------------------------
+
+    def apply(self,delta):
+
+        self.start = delta['start']
+        self.constants = delta['constants']
+        self.rows = self.rows[:delta['saved']]
+        self.rows.extend(delta['rows'])
+        self.last = delta['last']
+        self.count = delta['count']
+        self.stride = delta['stride']
+        self.mark()
+        self.forget()
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def mark(self):
+        self.saved = len(self.rows)
+        return
+
+# ----------------------------------------------------------------------
+
+    def forget(self):
+        self.cache = None
+        return
+
+# ----------------------------------------------------------------------
+# Values are gathered from the table once, and then served from the
+# cache until the rows change:
+
+    def __getitem__(self,key):
+
+        if key in self.constants:
+            return self.constants[key]
+        if self.cache is None:
+            self.cache = {}
+        if key not in self.cache:
+            self.cache[key] = self.gather(key)
+
+        return self.cache[key]
+
+# ----------------------------------------------------------------------
+
+    def gather(self,key):
+
+        if key not in self.keys():
+            raise KeyError(key)
+
+        values = getattr(self.records,key)[self.live()]
+        if key in self.start:
+            values = np.append(self.start[key],values)
+        if values.dtype == object:
+            # Strings, as np.append would have made them:
+            values = np.array(values.tolist())
+        values.flags.writeable = False
+
+        return values
+
+# ----------------------------------------------------------------------
+# The cache is rebuilt when needed, so is not pickled:
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('cache',None)
+        return state
+
+# ----------------------------------------------------------------------
+# Make a History out of an old dictionary of arrays:
+
+    @classmethod
+    def adopt(cls,dictionary,records,start=(),constants=()):
+
+        start = dict((key,dictionary[key][0]) for key in start if key in dictionary)
+        constants = dict((key,dictionary[key]) for key in constants if key in dictionary)
+        history = cls(records,start=start,constants=constants)
+
+        # Columns missing from very old pickles are filled with zeros:
+        n = max([len(dictionary[name]) - (name in start) for name,dtype in records.columns if name in dictionary] + [0])
+        columns = []
+        for name,dtype in records.columns:
+            if name in dictionary:
+                column = list(dictionary[name])[(name in start):]
+            else:
+                column = [0]*n
+            columns.append(column)
+        for values in zip(*columns):
+            history.record(values)
+
+        return history
+
+# ======================================================================
+
+class Arena(object):
+    """
+    NAME
+        Arena
+
+    PURPOSE
+        Hold the training and test histories of all of a Bureau's
+        agents.
+
+    COMMENTS
+        One Records table for training histories, one for test
+        histories. The Arena makes each new agent's pair of
+        Histories, and converts the dictionary histories of agents
+        read from old pickles.
+
+    INITIALISATION
+        keep         Maximum number of records kept per history
+                     (0 means keep them all) [0]
+
+    METHODS AND VARIABLES
+        Arena.training_history(skill,PL,PD)  New training History
+        Arena.test_history()                 New test History
+        Arena.adopt(agent)                   Convert an agent's histories
+        Arena.downsample(keep)               Change keep
+        Arena.delta(), apply(delta), mark()  As for Records (delta() is
+                                             None after a compaction)
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,keep=0):
+
+        self.training = Records(TRAINING)
+        self.test = Records(TEST)
+        self.downsample(keep)
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'arena of %d training and %d test records' % (self.training.size,self.test.size)
+
+# ----------------------------------------------------------------------
+
+    def downsample(self,keep):
+
+        self.training.keep = int(keep)
+        self.test.keep = int(keep)
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def training_history(self,skill,PL,PD):
+        return History(self.training,start={'Skill':skill,'PL':PL,'PD':PD},constants={'ID':'tutorial'})
+
+# ----------------------------------------------------------------------
+
+    def test_history(self):
+        return History(self.test)
+
+# ----------------------------------------------------------------------
+# Convert an agent's old dictionary histories (eg from an old pickle):
+
+    def adopt(self,agent):
+
+        if isinstance(agent.traininghistory,dict):
+            agent.traininghistory = History.adopt(agent.traininghistory,self.training,start=('Skill','PL','PD'),constants=('ID',))
+        if isinstance(agent.testhistory,dict):
+            agent.testhistory = History.adopt(agent.testhistory,self.test)
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def delta(self):
+
+        if self.training.moved or self.test.moved:
+            return None
+
+        return {'training':self.training.delta(),'test':self.test.delta()}
+
+# ----------------------------------------------------------------------
+
+    def apply(self,delta):
+
+        self.training.apply(delta['training'])
+        self.test.apply(delta['test'])
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def mark(self):
+
+        self.training.mark()
+        self.test.mark()
+
+        return
+
+# ======================================================================
+# Columns of the subjects' annotation histories, one row per
+# classification, and of their markers, one row per click:
+
+ANNOTATION = [('Agent',np.int32),
+              ('ItWas',np.int8),
+              ('PL',np.float64),
+              ('PD',np.float64),
+              ('Start',np.int64),
+              ('Count',np.int32)]
+
+MARKER = [('Subject',np.int32),
+          ('Classification',np.int32),
+          ('X',np.float64),
+          ('Y',np.float64)]
+
+# ======================================================================
+
+class AnnotationHistory(History):
+    """
+    NAME
+        AnnotationHistory
+
+    PURPOSE
+        One subject's annotation history: who classified it, what they
+        said, where they clicked, and their PL and PD at the time.
+
+    COMMENTS
+        Reads like the old dictionary: annotationhistory['Name'],
+        ['ItWas'], ['PL'] and ['PD'] are arrays, one entry per
+        classification, and ['At_X'] and ['At_Y'] are lists of each
+        classification's marker positions, as tuples. As for any
+        History, these are gathered once and kept until the next
+        classification comes in. Rather than rebuilding
+        flat marker arrays from those lists, use markers(), which
+        slices them straight out of the Annotations store.
+
+        Extra per-subject information (eg cluster 'labels') can be
+        attached with update().
+
+    INITIALISATION
+        annotations  The Annotations store
+        ID           The subject's ID
+
+    METHODS AND VARIABLES
+        AnnotationHistory.record((name,it_was,at_x,at_y,PL,PD))
+        AnnotationHistory.markers()     Flat arrays of marker x, y, PL,
+                                        PD, and classification number
+        AnnotationHistory.update(dict)  Attach extra keys
+        AnnotationHistory[key]
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,annotations,ID):
+
+        History.__init__(self,annotations.classifications)
+        self.annotations = annotations
+        self.subject = annotations.intern_subject(ID)
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'annotation history of %d classifications' % (self.count)
+
+# ----------------------------------------------------------------------
+
+    def keys(self):
+        return ['Name','ItWas','PL','PD','At_X','At_Y'] + self.constants.keys()
+
+# ----------------------------------------------------------------------
+
+    def update(self,dictionary):
+
+        for key in dictionary:
+            if key in ('Name','ItWas','PL','PD','At_X','At_Y'):
+                raise KeyError("Annotation history column "+key+" is read-only")
+        self.constants.update(dictionary)
+
+        return
+
+# ----------------------------------------------------------------------
+# Store a classification, and its markers:
+
+    def record(self,values):
+
+        name,it_was,at_x,at_y,PL,PD = values
+        annotations = self.annotations
+        markers = annotations.markers
+
+        start = markers.size
+        for x,y in zip(at_x,at_y):
+            markers.append((self.subject,self.count,x,y))
+
+        History.record(self,(annotations.intern(name),it_was,PL,PD,start,markers.size-start))
+
+        return
+
+# ----------------------------------------------------------------------
+# Rows of the marker table belonging to this subject, and which of the
+# subject's classifications each one came from:
+
+    def marker_rows(self):
+
+        rows = self.live()
+        start = self.records.Start[rows]
+        count = self.records.Count[rows]
+        total = np.sum(count)
+        first = np.cumsum(count) - count
+        marker_rows = np.arange(total) + np.repeat(start-first,count)
+        classification = np.repeat(np.arange(len(rows)),count)
+
+        return marker_rows,classification
+
+# ----------------------------------------------------------------------
+
+    def markers(self):
+
+        rows,classification = self.marker_rows()
+        markers = self.annotations.markers
+        clicked = self.live()[classification]
+
+        return {'x':markers.X[rows],
+                'y':markers.Y[rows],
+                'PL':self.records.PL[clicked],
+                'PD':self.records.PD[clicked],
+                'classification':classification}
+
+# ----------------------------------------------------------------------
+
+    def gather(self,key):
+
+        if key == 'Name':
+            names = self.annotations.names
+            agents = self.records.Agent[self.live()]
+            return np.array([names[agent] for agent in agents])
+
+        elif key == 'At_X' or key == 'At_Y':
+            rows,classification = self.marker_rows()
+            if key == 'At_X':
+                values = self.annotations.markers.X[rows]
+            else:
+                values = self.annotations.markers.Y[rows]
+            count = self.records.Count[self.live()]
+            if len(count) == 0:
+                return ()
+            # Tuples, so that the cached lists cannot be changed:
+            return tuple(tuple(chunk) for chunk in np.split(values,np.cumsum(count)[:-1]))
+
+        elif key == 'ItWas':
+            # Stored as int8, but handed back as ints, as before:
+            values = History.gather(self,key).astype(int)
+            values.flags.writeable = False
+            return values
+
+        return History.gather(self,key)
+
+# ======================================================================
+
+class Annotations(object):
+    """
+    NAME
+        Annotations
+
+    PURPOSE
+        Hold the annotation histories of all of a Collection's
+        subjects.
+
+    COMMENTS
+        One Records table of classifications (agent number, ItWas, PL,
+        PD, and the offset and number of its markers), and one of
+        markers (subject number, classification number, x, y). Each
+        marker's PL and PD are looked up from its classification, not
+        stored again. Volunteer names and subject IDs are interned:
+        stored once in a list, and referred to by their position in
+        it.
+
+    INITIALISATION
+        From scratch.
+
+    METHODS AND VARIABLES
+        Annotations.history(ID)       New AnnotationHistory for subject ID
+        Annotations.intern(name)      Agent number of volunteer name
+        Annotations.intern_subject(ID)  Subject number of ID
+        Annotations.names             Volunteer names, by agent number
+        Annotations.IDs               Subject IDs, by subject number
+        Annotations.adopt(subject)    Convert a subject's old history
+        Annotations.delta(), apply(delta), mark()  As for Records
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    saved_names = 0
+    saved_IDs = 0
+
+    def __init__(self):
+
+        self.classifications = Records(ANNOTATION)
+        self.markers = Records(MARKER)
+        self.names = []
+        self.agents = {}
+        self.IDs = []
+        self.subjects = {}
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'annotations of %d subjects by %d volunteers, with %d markers' % \
+               (len(self.IDs),len(self.names),self.markers.size)
+
+# ----------------------------------------------------------------------
+
+    def intern(self,name):
+
+        try:
+            return self.agents[name]
+        except KeyError:
+            self.agents[name] = len(self.names)
+            self.names.append(name)
+            return self.agents[name]
+
+# ----------------------------------------------------------------------
+
+    def intern_subject(self,ID):
+
+        try:
+            return self.subjects[ID]
+        except KeyError:
+            self.subjects[ID] = len(self.IDs)
+            self.IDs.append(ID)
+            return self.subjects[ID]
+
+# ----------------------------------------------------------------------
+
+    def history(self,ID):
+        return AnnotationHistory(self,ID)
+
+# ----------------------------------------------------------------------
+# Convert a subject's old dictionary annotation history (eg from an old
+# pickle). Columns missing from very old pickles are filled with zeros:
+
+    def adopt(self,subject):
+
+        old = subject.annotationhistory
+        if not isinstance(old,dict):
+            return
+
+        history = self.history(subject.ID)
+        n = len(old.get('ItWas',[]))
+        columns = []
+        for key in ('Name','ItWas','At_X','At_Y','PL','PD'):
+            if key in old:
+                columns.append(list(old[key]))
+            elif key == 'At_X' or key == 'At_Y':
+                columns.append([[]]*n)
+            else:
+                columns.append([0]*n)
+        for values in zip(*columns):
+            history.record(values)
+
+        extras = dict((key,old[key]) for key in old if key not in history.keys())
+        history.update(extras)
+        subject.annotationhistory = history
+
+        return
+
+# ----------------------------------------------------------------------
+# The names, IDs, classifications and markers added since the last
+# checkpoint, and how to add them back:
+
+    def delta(self):
+
+        return {'names':self.names[self.saved_names:],
+                'IDs':self.IDs[self.saved_IDs:],
+                'classifications':self.classifications.delta(),
+                'markers':self.markers.delta()}
+
+# ----------------------------------------------------------------------
+
+    def apply(self,delta):
+
+        for name in delta['names']:
+            self.intern(name)
+        for ID in delta['IDs']:
+            self.intern_subject(ID)
+        self.classifications.apply(delta['classifications'])
+        self.markers.apply(delta['markers'])
+        self.mark()
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def mark(self):
+
+        self.saved_names = len(self.names)
+        self.saved_IDs = len(self.IDs)
+        self.classifications.mark()
+        self.markers.mark()
+
+        return
+
+# ======================================================================
+
@@ -18,7 +18,10 @@ import os,cPickle,numpy as np
     FUNCTIONS
         write_pickle(contents,filename):
 
-        read_pickle(filename):
+        write_checkpoint(contents,filename,fraction=0.5,snapshot=False):
+            (see journal.py)
+
+        read_pickle(filename,flavour,columnar=False,logodds=False,trajectory_dtype=np.float64,history_keep=None):
 
         write_list(sample, filename, item=None):
         
@@ -45,35 +48,63 @@ import os,cPickle,numpy as np
 
 #=========================================================================
 # Read in an instance of a class, of a given flavour. Create an instance
-# if the file does not exist.
-
-def read_pickle(filename,flavour):
-
+# if the file does not exist. Bureaus and collections are brought up to
+# date with their checkpoint journals, if any. They can be asked to
+# keep their members' numbers in columnar tables - old pickles are
+# converted on the way in. New collections can be asked to store log
+# odds rather than probabilities, and to keep their trajectories at a
+# given precision. Bureaus, old or new, can be told to downsample their
+# agents' histories.
+
+def read_pickle(filename,flavour,columnar=False,logodds=False,trajectory_dtype=np.float64,history_keep=None):
+
+    # Only a missing pickle means starting afresh - one that cannot be
+    # read, a journal that cannot be replayed, or a failed conversion,
+    # must not be mistaken for it, or the next checkpoint would
+    # overwrite the pickle:
     try:
         F = open(filename,"rb")
         contents = cPickle.load(F)
         F.close()
 
-        print "SWAP: read an old",contents,"from "+filename
-
     except:
 
+        if filename is not None and os.path.exists(filename):
+            raise
+
         if filename is None:
             print "SWAP: no "+flavour+" filename supplied."
         else:
             print "SWAP: "+filename+" does not exist."
 
         if flavour == 'bureau':
-            contents = swap.Bureau()
+            contents = swap.Bureau(columnar=columnar,history_keep=(history_keep or 0))
             print "SWAP: made a new",contents
 
         elif flavour == 'collection':
-            contents = swap.Collection()
+            contents = swap.Collection(columnar=columnar,logodds=logodds,trajectory_dtype=trajectory_dtype)
             print "SWAP: made a new",contents
 
-        elif flavour == 'database':
+        elif flavour == 'database' or flavour == 'offline':
             contents = None
 
+        return contents
+
+    if flavour == 'offline':
+        print "SWAP: read an old offline analysis from "+filename
+    else:
+        print "SWAP: read an old",contents,"from "+filename
+
+    # Bring it up to date with its journal, if it has one:
+    if flavour == 'bureau' or flavour == 'collection':
+        swap.read_journal(contents,filename)
+
+    if columnar and (flavour == 'bureau' or flavour == 'collection'):
+        contents.tabulate()
+
+    if history_keep is not None and flavour == 'bureau':
+        contents.arena.downsample(history_keep)
+
     return contents
 
 # ----------------------------------------------------------------------------
@@ -81,9 +112,16 @@ def read_pickle(filename,flavour):
 
 def write_pickle(contents,filename):
 
-    F = open(filename,"wb")
+    # Write to a temporary file first, so that an interrupted write
+    # never leaves a broken pickle behind:
+    F = open(filename+'.tmp',"wb")
     cPickle.dump(contents,F,protocol=2)
     F.close()
+    os.rename(filename+'.tmp',filename)
+
+    # Any journal of changes to the old snapshot no longer applies (see
+    # swap/journal.py):
+    rm(filename+'.journal')
 
     return
 
@@ -270,6 +308,34 @@ def write_config(filename, pars):
         F.write('\n')
         F.write('%s: %s\n' % (keyword,str(pars[keyword])))
 
+    # Newer options are only written out if they were set:
+    optional = ['columnar', \
+                'chunksize', \
+                'logodds', \
+                'trajectory_precision', \
+                'history_keep', \
+                'daemon', \
+                'stream', \
+                'checkpoint_every', \
+                'checkpoint_interval', \
+                'journal', \
+                'journal_fraction', \
+                'prefetch_threads', \
+                'prefetch_depth', \
+                'dbfile', \
+                'resume', \
+                'offline_engine', \
+                'offline_accelerate', \
+                'offline_incremental', \
+                'offline_processes', \
+                'offlinefile', \
+                ]
+
+    for keyword in optional:
+        if keyword in pars:
+            F.write('\n')
+            F.write('%s: %s\n' % (keyword,str(pars[keyword])))
+
     F.write('\n')
     footer = '# ======================================================================'
     F.write(footer)
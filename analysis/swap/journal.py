@@ -0,0 +1,159 @@
+# ===========================================================================
+
+import swap
+
+import os,cPickle
+
+# ======================================================================
+
+"""
+    NAME
+        journal
+
+    PURPOSE
+        Checkpoint a bureau or collection by appending only what has
+        changed to a journal, rather than re-pickling the whole thing.
+
+    COMMENTS
+        A checkpoint is a full snapshot (an ordinary pickle, readable
+        with read_pickle as always) plus a journal beside it, called
+        <snapshot>.journal. The journal is a sequence of pickled
+        entries: the first names the generation of the snapshot it
+        belongs to, and each of the others holds the delta() of the
+        bureau or collection at one checkpoint - the state of the
+        agents or subjects marked dirty since the one before, and the
+        rows added to the shared history tables. So a checkpoint
+        costs in proportion to the batch, not the survey.
+
+        write_checkpoint() appends an entry if it can, and otherwise
+        (no snapshot yet, a snapshot of some other generation, or a
+        journal grown to more than a given fraction of the snapshot)
+        writes a new snapshot and starts a new journal: this is the
+        compaction. read_journal() replays the entries onto a
+        freshly-read snapshot, and is called by read_pickle.
+
+        A half-written last entry (eg if SWAP was killed mid-write) is
+        ignored, and cut off the journal. An ordinary write_pickle
+        over the snapshot removes its journal, which would no longer
+        apply.
+
+    FUNCTIONS
+        write_checkpoint(contents,filename,fraction=0.5,snapshot=False)
+        read_journal(contents,filename)
+
+    BUGS
+        Removing agents or subjects (as the offline analysis can) is
+        not journalled: checkpoint with snapshot=True after doing so.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+"""
+
+# ======================================================================
+# Save a bureau or collection: as a journal entry if possible, or as a
+# new snapshot if not (or if asked to). Returns which it was.
+
+def write_checkpoint(contents,filename,fraction=0.5,snapshot=False):
+
+    journal = filename+'.journal'
+    generation = getattr(contents,'generation',None)
+
+    if not snapshot:
+        snapshot = (generation is None) or \
+                   (not os.path.exists(filename)) or \
+                   (journal_generation(journal) != generation)
+
+    if not snapshot:
+        snapshot = (os.path.getsize(journal) > fraction*os.path.getsize(filename))
+
+    if not snapshot:
+        delta = contents.delta()
+        snapshot = (delta is None)
+
+    if snapshot:
+        contents.generation = os.urandom(8).encode('hex')
+        contents.mark(everyone=True)
+        swap.write_pickle(contents,filename)
+
+        F = open(journal+'.tmp','wb')
+        cPickle.dump(contents.generation,F,protocol=2)
+        F.close()
+        os.rename(journal+'.tmp',journal)
+
+        return 'snapshot'
+
+    F = open(journal,'ab')
+    cPickle.dump(delta,F,protocol=2)
+    F.flush()
+    os.fsync(F.fileno())
+    F.close()
+    contents.mark()
+
+    return 'journal'
+
+# ----------------------------------------------------------------------
+# The generation of the snapshot a journal belongs to:
+
+def journal_generation(journal):
+
+    try:
+        F = open(journal,'rb')
+        generation = cPickle.load(F)
+        F.close()
+    except (IOError,EOFError,cPickle.UnpicklingError):
+        generation = None
+
+    return generation
+
+# ----------------------------------------------------------------------
+# Bring a freshly-read snapshot up to date, if it has a journal.
+# Returns the number of entries replayed:
+
+def read_journal(contents,filename):
+
+    journal = filename+'.journal'
+    if not os.path.exists(journal):
+        return 0
+
+    generation = getattr(contents,'generation',None)
+
+    F = open(journal,'rb')
+    try:
+        belongs = (generation is not None and cPickle.load(F) == generation)
+    except (EOFError,cPickle.UnpicklingError):
+        belongs = False
+    if not belongs:
+        F.close()
+        print "SWAP: ignoring "+journal+", which belongs to another snapshot"
+        return 0
+
+    count = 0
+    end = F.tell()
+    while True:
+        try:
+            delta = cPickle.load(F)
+        except EOFError:
+            break
+        except Exception:
+            # Half-written: treat as the end.
+            break
+        contents.apply(delta)
+        count += 1
+        end = F.tell()
+    F.close()
+
+    # Cut off a half-written last entry, so that new ones follow on:
+    if os.path.getsize(journal) > end:
+        print "SWAP: cutting a half-written entry off the end of "+journal
+        F = open(journal,'r+b')
+        F.truncate(end)
+        F.close()
+
+    print "SWAP: replayed",count,"journal entries from "+journal
+
+    return count
+
+# ======================================================================
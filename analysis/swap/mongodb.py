@@ -6,9 +6,12 @@ TODO:
 # ======================================================================
 
 import numpy as np
-import os,sys,datetime
+import os,sys,datetime,threading,itertools,multiprocessing
+from collections import OrderedDict
 
-try: from pymongo import MongoClient
+try:
+    from pymongo import MongoClient
+    from bson.objectid import ObjectId
 except:
     print "MongoDB: pymongo is not installed. You can still --practise though"
     # sys.exit()
@@ -17,6 +20,10 @@ except:
 testGroup = '5154a3783ae74086ab000001'
 trainingGroup = '5154a3783ae74086ab000002'
 
+# The parts of classification and subject documents that digest needs:
+CLASSIFICATION_FIELDS = ['updated_at','user_id','user_ip','subjects.id','subjects.zooniverse_id','annotations']
+SUBJECT_FIELDS = ['group_id','metadata','location']
+
 # ======================================================================
 
 class MongoDB(object):
@@ -47,11 +54,54 @@ class MongoDB(object):
         Pr(LENS|d) updated using these matrices.
 
 
-    INITIALISATION
+        Each classification needs its subject's document, from the
+        subject table. Rather than asking for them one at a time, find()
+        reads the classifications a block at a time, and fetches all
+        the block's subjects that are not already to hand with a single
+        $in query. The subject documents are kept in a SubjectCache,
+        which holds the most recently used ones, up to a limit - most
+        subjects are classified many times over, so most are found
+        there.
+
+        find() can be told the survey, stage and end time too, in which
+        case the server filters and sorts the classifications, and only
+        sends the fields that digest needs. The classifications are
+        indexed by time, if they are not already.
+
+        Digesting a classification is a pure function of its document
+        and its subject's (digest_classification, which reads the
+        annotations in a single pass), so digest_all can farm a list of
+        them out to a pool of processes, once their subjects have been
+        fetched. digest_stream does this a block at a time, for a whole
+        batch - eg when making a digested cache.
+
+        Classifications come in (updated_at, _id) order, which the
+        compound index on the two serves directly. token() turns a
+        classification into a resume token - its exact update time and
+        _id, as a string that can be kept in update.config - and
+        find(...,after=token) starts straight after it, with a range
+        query on the index: SWAP resumes exactly where the last batch
+        stopped, neither dropping nor repeating the classifications
+        made in the same second.
 
+    INITIALISATION
+        prefetch      No. of classifications to fetch subjects for at once [1000]
+        cachesize     Max. no. of subject documents to keep [100000]
 
     METHODS AND VARIABLES
-        ToyDB.get_classification()
+        MongoDB.find(word,t,survey=None,stage=None,end=None,after=None)
+        MongoDB.token(classification)
+        MongoDB.selection(query,survey=None,stage=None)
+        MongoDB.digest(classification,survey,method=False)
+        MongoDB.digest_all(classifications,survey,method=False,processes=None)
+        MongoDB.digest_stream(batch,survey,method=False,processes=None,block=10000)
+        MongoDB.close()     Shut down digest_all's pool of processes
+        MongoDB.prefetch(classifications)
+        MongoDB.subject(ID)
+        MongoDB.cache       The SubjectCache, with its hits and misses
+        MongoDB.skipped     No. of classifications the last find left out
+                            (counted when asked for, once its batch has
+                            been read through)
 
     BUGS
         - groupIds are hard-coded, and so could go wrong any time.
@@ -69,7 +119,7 @@ class MongoDB(object):
 
 # ----------------------------------------------------------------------------
 
-    def __init__(self):
+    def __init__(self,prefetch=1000,cachesize=100000):
 
         # Connect to the Mongo:
         try: self.client = MongoClient('localhost', 27017)
@@ -89,213 +139,260 @@ class MongoDB(object):
         self.subjects = self.db['spacewarp_subjects']
         self.classifications = self.db['spacewarp_classifications']
 
+        # Keep subject documents to hand, fetching them in blocks:
+        self.block = prefetch
+        self.cache = SubjectCache(max(cachesize,prefetch))
+
+        self.indexed = False
+        self.span = None
+        self.found = 0
+
+        # Processes to digest classifications in, when asked to:
+        self.pool = None
+
         return None
 
 # ----------------------------------------------------------------------------
 # Return a batch of classifications, defined by a time range - either
 # claasifications made 'since' t, or classifications made 'before' t:
 
-    def find(self,word,t):
+# Given a survey, a stage or an end time, only the classifications that
+# might match are sent over (digest still checks each one), in time
+# order, and the number left behind is counted in self.skipped. Given a
+# resume token (see token, below), classifications 'since' it are
+# found instead - those after it in time, or at the same time but with
+# a greater _id:
 
-       if word == 'since':
-            batch = self.classifications.find({'updated_at': {"$gt": t}},timeout=False)
+    def find(self,word,t,survey=None,stage=None,end=None,after=None):
+
+       if word == 'since' and after is not None:
+            t,ID = read_resume_token(after)
+            window = {"$gt": t}
+            tied = {'updated_at': t, '_id': {"$gt": ObjectId(ID)}}
+
+       elif word == 'since':
+            window = {"$gt": t}
 
        elif word == 'before':
-            batch = self.classifications.find({'updated_at': {"$lt": t}},timeout=False)
+            window = {"$lt": t}
 
        else:
            print "MongoDB: error, cannot find classifications '"+word+"' "+str(t)
+           return []
 
-       return batch
+       if end is not None:
+           window["$lte"] = end
 
-# ----------------------------------------------------------------------------
-# Return a tuple of the key quantities, given a cursor pointing to a
-# record in the classifications table:
+       if after is None or (end is not None and t > end):
+           span = {'updated_at': window}
+       else:
+           span = {'$or': [{'updated_at': window},tied]}
 
-    def digest(self,classification,survey,method=False):
+       self.index()
+       query = self.selection(span,survey,stage)
+       batch = self.classifications.find(query,CLASSIFICATION_FIELDS,timeout=False).sort([('updated_at',1),('_id',1)])
 
-        # When was this classification made?
-        t = classification['updated_at']
+       # Only the time range is kept, to count what was left out of it
+       # if asked (see skipped, below):
+       if query is not span:
+           self.span = span
+       else:
+           self.span = None
+       self.found = 0
 
-        # Who made the classification?
+       return self.prefetching(batch)
 
-        # The classification will be identified by either the user_id or
-        # the user_ip.  The value will be abstracted into the variable
-        # Name.
+# ----------------------------------------------------------------------------
+# The number of classifications the last find left out: those in its
+# time range (an indexed count, on the server) less those it handed out.
+# This is only right once the batch has been read through - and handed
+# out counts those read ahead by a Pipeline's readers, so SWAP only asks
+# when it has read to the end of the batch:
 
-        # Not all records have all keys.  For instance, classifications
-        # from anonymous users will not have a user_id key. We must
-        # check that the key exists, and if so, get the value.
+    @property
+    def skipped(self):
 
-        if classification.has_key('user_id'):
-            Name = classification['user_id']
+        if self.span is None:
+            return 0
 
+        return self.classifications.find(self.span).count() - self.found
+
+# ----------------------------------------------------------------------------
+# Add the project and stage to a query, so that the server can leave
+# out classifications that digest would throw away. This must never
+# leave out one that digest would keep: digest looks at the last
+# project and stage annotations, and assumes CFHTLS and stage 1 if there
+# are none.
+
+    def selection(self,query,survey=None,stage=None):
+
+        conditions = [query]
+
+        if survey is not None:
+            projects = [{'annotations.project': survey}]
+            if survey == "CFHTLS":
+                projects.append({'annotations.project': {'$exists': False}})
+            conditions.append({'$or': projects})
+
+        if stage is not None:
+            stages = [{'annotations.stage': {'$in': [str(stage),int(stage)]}}]
+            if int(stage) == 1:
+                stages.append({'annotations.stage': {'$exists': False}})
+            conditions.append({'$or': stages})
+
+        if len(conditions) == 1:
+            return query
         else:
-            # If there is no user_id, get the ip address...
-            # I think we're safe with user_ip.  All records should have
-            # this field. Check the key if you're worried.
-            Name = classification['user_ip']
+            return {'$and': conditions}
 
-        # Pull out the subject that was classified. Note that by default
-        # Zooniverse subjects are stored as lists, because they can
-        # oontain multiple images.
+# ----------------------------------------------------------------------------
+# Make sure the classifications can be sorted by time (and _id, to
+# break ties), on the server:
 
-        subjects = classification['subjects']
+    def index(self):
 
-        # Ignore the empty lists (eg the first tutorial subject...)
-        if len(subjects) == 0:
-            return None
+        if self.indexed:
+            return
 
-        # Get the subject ID, and also its Zooniverse ID:
-        for subject in subjects:
-            ID = subject['id']
-            ZooID = subject['zooniverse_id']
-
-        # Pull out the annotations and get the stage the classification was made at:
-        annotations = classification['annotations']
-
-        classification_stage = 1
-        for annotation in annotations:
-            if annotation.has_key('stage'):
-                classification_stage = annotation['stage']
-
-        # Also get the survey name!
-        project = "CFHTLS"
-        for annotation in annotations:
-            if annotation.has_key('project'):
-                project = annotation['project']
-
-        # Check project: ignore this classification by returning None
-        # if classification is from a different project:
-        if project != survey:
-            # print "Fail! A classification from "+project+" ( != "+survey+" ), stage = ",classification_stage
-            return None
-        # else:
-            # Success! A classification from "+project+" ( = "+survey+" ), stage = ",classification_stage
+        keys = [[key for key,direction in info['key']] for info in self.classifications.index_information().values()]
+        if ['updated_at','_id'] not in keys:
+            print "MongoDB: indexing the classifications by updated_at and _id, which may take a while..."
+            self.classifications.create_index([('updated_at',1),('_id',1)])
+        self.indexed = True
 
-        # Now pull the subject itself from the subject table:
-        subject = self.subjects.find_one({'_id': ID},timeout=False)
+        return
 
-        # Was it a training subject or a test subject?
-        if subject.has_key('group_id'):
-            groupId = subject['group_id']
-        else:
-            # Subject is tutorial and has no group id:
-            return None
+# ----------------------------------------------------------------------------
+# Return the token to resume a batch from, straight after this
+# classification:
 
-        subject_metadata = subject['metadata']
-
-        # Check subject stage:
-        # if subject_metadata.has_key('stage2'):
-        #     if classification_stage == 1:
-        #         # This happens when the data is uploaded, but the site has
-        #         # not been taken down... Need to ignore these classifications!
-        #         # print "WARNING: classification labelled stage 1, while subject is stage 2!"
-        #         return None
-
-        # PJM: The above code causes a bug when SWAP is re-run on stage 1 later on!
-        # Commented out, and moved to using timestamps rigorously to delineate
-        # stage 1 and stage 2, as well as checking classification stage, that is.
-
-
-        # What kind of subject was it? Training or test? A sim or a dud?
-        # PJM 2014-08-21 And what flavor of sim is it?
-        kind = ''
-        if str(groupId) == trainingGroup:
-            category = 'training'
-            things = subject_metadata['training']
-            # things is either a list of dictionaries, or in beta, a
-            # single dictionary:
-            if type(things) == list:
-                thing = things[0]
-            else:
-                thing = things
-            flavor = thing['type']
-            if (flavor == 'lensing cluster' \
-               or flavor == 'lensed galaxy' \
-               or flavor == 'lensed quasar'):
-                kind = 'sim'
-            else:
-                kind = 'dud'
-                flavor = 'dud'
-        else: # It's a test subject:
-            category = 'test'
-            kind = 'test'
-            flavor = 'test'
-
-        # What's the URL of this image?
-        if subject.has_key('location'):
-            things = subject['location']
-            location = things['standard']
-        else:
-            location = None
+    def token(self,classification):
 
+        return resume_token(classification['updated_at'],classification['_id'])
 
-        # What did the volunteer say about this subject?
+# ----------------------------------------------------------------------------
+# Step through a cursor a block at a time, prefetching the subjects of
+# each block before handing its classifications on:
+
+    def prefetching(self,cursor):
+
+        block = []
+        for classification in cursor:
+            block.append(classification)
+            if len(block) == self.block:
+                self.prefetch(block)
+                for classification in block:
+                    self.found += 1
+                    yield classification
+                block = []
+
+        self.prefetch(block)
+        for classification in block:
+            self.found += 1
+            yield classification
 
-        # For sims, we really we want to know if the volunteer hit the
-        # arcs - but this is not yet stored in the database
-        # (issued 2013-04-23). For now, treat sims by just saying that
-        # any number of markers placed constitutes a hit.
+# ----------------------------------------------------------------------------
+# Fetch the subjects of a list of classifications, in one query, unless
+# they are in the cache already:
 
-        # NB: Not every annotation has an associated coordinate
-        # (e.g. x, y) - tutorials fail this criterion.
+    def prefetch(self,classifications):
 
-        N_markers = 0
-        simFound = False
-        # CPD 31.5.14: added annotation values
-        annotation_x = []
-        annotation_y = []
-        for annotation in annotations:
-            if annotation.has_key('x'):
-                N_markers += 1
-                if len(annotation['x']) > 0:
-                    annotation_x.append(float(annotation['x']))
-                    annotation_y.append(float(annotation['y']))
-
-
-        # Detect whether sim was found or not:
-        if kind == 'sim':
-            if method:
-                # Use the marker positions!
-                for annotation in annotations:
-                    if annotation.has_key('simFound'):
-                        string = annotation['simFound']
-                        if string == 'true': simFound = True
-            else:
-                if N_markers > 0: simFound = True
+        wanted = set()
+        for classification in classifications:
+            for subject in classification.get('subjects',[]):
+                ID = subject['id']
+                if ID in self.cache:
+                    self.cache.touch(ID)
+                else:
+                    wanted.add(ID)
 
-        # Now turn indicators into results:
-        if kind == 'sim':
-            if simFound:
-                result = 'LENS'
-            else:
-                result = 'NOT'
+        if len(wanted) > 0:
+            for subject in self.subjects.find({'_id': {'$in': list(wanted)}},SUBJECT_FIELDS,timeout=False):
+                self.cache.put(subject['_id'],subject)
+
+        return
+
+# ----------------------------------------------------------------------------
+# Return a subject's document, from the cache if possible:
+
+    def subject(self,ID):
+
+        subject = self.cache.get(ID)
+        if subject is None:
+            subject = self.subjects.find_one({'_id': ID},SUBJECT_FIELDS,timeout=False)
+            if subject is not None:
+                self.cache.put(ID,subject)
+
+        return subject
+
+# ----------------------------------------------------------------------------
+# Return a tuple of the key quantities, given a cursor pointing to a
+# record in the classifications table. The work is done by the
+# functions below, given the subject's document too:
+
+    def digest(self,classification,survey,method=False):
+
+        vitals = read_classification(classification,survey)
+        if vitals is None:
+            return None
+        ID = vitals[2]
+
+        return interpret_classification(vitals,self.subject(ID),method=method)
 
-        elif kind == 'test' or kind == 'dud':
-            if N_markers == 0:
-                result = 'NOT'
+# ----------------------------------------------------------------------------
+# Digest a whole list of classifications at once, in a pool of processes
+# (the subjects are looked up here first, all together). Returns the
+# digested classifications in the same order:
+
+    def digest_all(self,classifications,survey,method=False,processes=None):
+
+        self.prefetch(classifications)
+
+        jobs = []
+        for classification in classifications:
+            ID = classified_subject(classification)
+            if ID is None:
+                subject = None
             else:
-                result = 'LENS'
+                subject = self.subject(ID)
+            jobs.append((classification,subject,survey,method))
 
-        # And finally, what's the truth about this subject?
-        if kind == 'sim':
-            truth = 'LENS'
-        elif kind == 'dud':
-            truth = 'NOT'
-        else:
-            truth = 'UNKNOWN'
+        if processes == 1:
+            return [digest_job(job) for job in jobs]
 
-        # Testing to see what people do:
-        # print "In db.digest: kind,N_markers,simFound,result,truth = ",kind,N_markers,simFound,result,truth
+        if self.pool is None:
+            if processes is None: processes = multiprocessing.cpu_count()
+            self.pool = multiprocessing.Pool(processes)
+            self.processes = processes
 
-        # Check we got all 10 items:
-        items = t.strftime('%Y-%m-%d_%H:%M:%S'),str(Name),str(ID),str(ZooID),category,kind,flavor,result,truth,str(location),str(classification_stage),str(annotation_x),str(annotation_y)
-        if len(items) != 13: print "MongoDB: digest failed: ",items[:]
+        return self.pool.map(digest_job,jobs,chunksize=max(1,len(jobs)/(4*self.processes)))
 
+# ----------------------------------------------------------------------------
+# Shut down the pool of processes digest_all started, if any, once the
+# digesting is done:
+
+    def close(self):
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+        return
 
-        return items[:]
+# ----------------------------------------------------------------------------
+# Digest a batch, from find(), a block at a time with digest_all,
+# handing on the digested classifications in order:
+
+    def digest_stream(self,batch,survey,method=False,processes=None,block=10000):
 
+        cursor = iter(batch)
+        while True:
+            classifications = list(itertools.islice(cursor,block))
+            if len(classifications) == 0:
+                break
+            for items in self.digest_all(classifications,survey,method=method,processes=processes):
+                yield items
 
 # ----------------------------------------------------------------------------
 # Return the size of the classification table:
@@ -309,6 +406,7 @@ class MongoDB(object):
 
     def terminate(self):
 
+        self.close()
         self.process.terminate()
         self.logfile.close()
         self.cleanup()
@@ -334,6 +432,328 @@ class MongoDB(object):
 
 # ======================================================================
 
+class SubjectCache(object):
+    """
+    NAME
+        SubjectCache
+
+    PURPOSE
+        Keep the most recently used subject documents, up to a maximum
+        number, counting how often they are asked for and found.
+
+    COMMENTS
+        The documents are kept in an OrderedDict, oldest use first:
+        using one moves it to the end, and when the cache is full the
+        one at the front is dropped. A lock lets several reader threads
+        (see swap/pipeline.py) share the cache.
+
+    INITIALISATION
+        capacity    Max. no. of documents to keep [100000]
+
+    METHODS AND VARIABLES
+        SubjectCache.get(ID)            Document, or None (a miss)
+        SubjectCache.put(ID,document)
+        SubjectCache.touch(ID)          Mark as just used
+        SubjectCache.hits, .misses
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,capacity=100000):
+
+        self.capacity = capacity
+        self.documents = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def __str__(self):
+        return 'cache of %d subjects, with %d hits and %d misses' % (len(self.documents),self.hits,self.misses)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __contains__(self,ID):
+        return ID in self.documents
+
+# ----------------------------------------------------------------------------
+
+    def get(self,ID):
+
+        self.lock.acquire()
+        try:
+            document = self.documents.pop(ID)
+            self.documents[ID] = document
+            self.hits += 1
+        except KeyError:
+            document = None
+            self.misses += 1
+        self.lock.release()
+
+        return document
+
+# ----------------------------------------------------------------------------
+
+    def put(self,ID,document):
+
+        self.lock.acquire()
+        self.documents.pop(ID,None)
+        self.documents[ID] = document
+        while len(self.documents) > self.capacity:
+            self.documents.popitem(last=False)
+        self.lock.release()
+
+        return
+
+# ----------------------------------------------------------------------------
+
+    def touch(self,ID):
+
+        self.lock.acquire()
+        if ID in self.documents:
+            self.documents[ID] = self.documents.pop(ID)
+        self.lock.release()
+
+        return
+
+# ======================================================================
+# Digesting a classification only needs its document and its subject's,
+# so it can be done anywhere - eg in another process (see
+# MongoDB.digest_all).
+
+# Which subject was classified? None for the empty lists (eg the first
+# tutorial subject). Note that by default Zooniverse subjects are
+# stored as lists, because they can contain multiple images:
+
+def classified_subject(classification):
+
+    subjects = classification['subjects']
+    if len(subjects) == 0:
+        return None
+
+    return subjects[-1]['id']
+
+# ----------------------------------------------------------------------------
+# A resume token is a classification's update time, to the microsecond,
+# and its _id (or whatever else orders classifications made at the same
+# time), with no spaces - so that it survives a trip through
+# update.config - eg 2013-05-06_12:34:56.789000,5187a0cc3ae7400001000abc
+
+def resume_token(t,ID):
+    return t.strftime('%Y-%m-%d_%H:%M:%S.%f')+','+str(ID)
+
+def read_resume_token(token):
+    t,ID = token.split(',')
+    return datetime.datetime.strptime(t,'%Y-%m-%d_%H:%M:%S.%f'),ID
+
+# ----------------------------------------------------------------------------
+# Read everything we need from the annotations, in one pass. Where there
+# is more than one stage or project annotation, the last one counts:
+
+def read_annotations(annotations):
+
+    stage = 1
+    project = "CFHTLS"
+    N_markers = 0
+    annotation_x = []
+    annotation_y = []
+    simFound = False
+
+    for annotation in annotations:
+        if annotation.has_key('stage'):
+            stage = annotation['stage']
+        if annotation.has_key('project'):
+            project = annotation['project']
+        # NB: Not every annotation has an associated coordinate
+        # (e.g. x, y) - tutorials fail this criterion.
+        if annotation.has_key('x'):
+            N_markers += 1
+            if len(annotation['x']) > 0:
+                annotation_x.append(float(annotation['x']))
+                annotation_y.append(float(annotation['y']))
+        if annotation.has_key('simFound'):
+            if annotation['simFound'] == 'true': simFound = True
+
+    return stage,project,N_markers,annotation_x,annotation_y,simFound
+
+# ----------------------------------------------------------------------------
+# Return a tuple of the key quantities, given a classification and the
+# document of the subject it classified. This is done in two steps, so
+# that digest only needs to look up the subject if the classification
+# is from the right project:
+
+def digest_classification(classification,subject,survey,method=False):
+
+    vitals = read_classification(classification,survey)
+    if vitals is None:
+        return None
+
+    return interpret_classification(vitals,subject,method=method)
+
+# ----------------------------------------------------------------------------
+# First, what can be read from the classification itself. Returns None
+# if it is not to be analysed:
+
+def read_classification(classification,survey):
+
+    # When was this classification made?
+    t = classification['updated_at']
+
+    # Who made the classification?
+
+    # The classification will be identified by either the user_id or
+    # the user_ip.  The value will be abstracted into the variable
+    # Name.
+
+    # Not all records have all keys.  For instance, classifications
+    # from anonymous users will not have a user_id key. We must
+    # check that the key exists, and if so, get the value.
+
+    if classification.has_key('user_id'):
+        Name = classification['user_id']
+
+    else:
+        # If there is no user_id, get the ip address...
+        # I think we're safe with user_ip.  All records should have
+        # this field. Check the key if you're worried.
+        Name = classification['user_ip']
+
+    # Pull out the subject that was classified, and also its Zooniverse
+    # ID. Ignore the empty lists (eg the first tutorial subject...)
+    subjects = classification['subjects']
+    if len(subjects) == 0:
+        return None
+    ID = subjects[-1]['id']
+    ZooID = subjects[-1]['zooniverse_id']
+
+    # Get the stage the classification was made at, the survey name,
+    # and the markers, from the annotations:
+    classification_stage,project,N_markers,annotation_x,annotation_y,simFound = \
+        read_annotations(classification['annotations'])
+
+    # Check project: ignore this classification by returning None
+    # if classification is from a different project:
+    if project != survey:
+        return None
+
+    return t,Name,ID,ZooID,classification_stage,N_markers,annotation_x,annotation_y,simFound
+
+# ----------------------------------------------------------------------------
+# Then, interpret it, given the subject's document (None if there isn't
+# one, in which case the classification is not analysed either):
+
+def interpret_classification(vitals,subject,method=False):
+
+    t,Name,ID,ZooID,classification_stage,N_markers,annotation_x,annotation_y,simFound = vitals
+
+    # Was it a training subject or a test subject?
+    if subject is None:
+        return None
+    if subject.has_key('group_id'):
+        groupId = subject['group_id']
+    else:
+        # Subject is tutorial and has no group id:
+        return None
+
+    subject_metadata = subject['metadata']
+
+    # PJM: Checking the subject's stage caused a bug when SWAP was re-run
+    # on stage 1 later on, so we use timestamps rigorously to delineate
+    # stage 1 and stage 2, as well as checking classification stage.
+
+    # What kind of subject was it? Training or test? A sim or a dud?
+    # PJM 2014-08-21 And what flavor of sim is it?
+    kind = ''
+    if str(groupId) == trainingGroup:
+        category = 'training'
+        things = subject_metadata['training']
+        # things is either a list of dictionaries, or in beta, a
+        # single dictionary:
+        if type(things) == list:
+            thing = things[0]
+        else:
+            thing = things
+        flavor = thing['type']
+        if (flavor == 'lensing cluster' \
+           or flavor == 'lensed galaxy' \
+           or flavor == 'lensed quasar'):
+            kind = 'sim'
+        else:
+            kind = 'dud'
+            flavor = 'dud'
+    else: # It's a test subject:
+        category = 'test'
+        kind = 'test'
+        flavor = 'test'
+
+    # What's the URL of this image?
+    if subject.has_key('location'):
+        things = subject['location']
+        location = things['standard']
+    else:
+        location = None
+
+    # What did the volunteer say about this subject?
+
+    # For sims, we really we want to know if the volunteer hit the
+    # arcs - but this is not yet stored in the database
+    # (issued 2013-04-23). For now, treat sims by just saying that
+    # any number of markers placed constitutes a hit - unless we are
+    # to use the marker positions, via simFound.
+
+    # Detect whether sim was found or not:
+    if kind == 'sim':
+        if not method:
+            simFound = (N_markers > 0)
+
+    # Now turn indicators into results:
+    if kind == 'sim':
+        if simFound:
+            result = 'LENS'
+        else:
+            result = 'NOT'
+
+    elif kind == 'test' or kind == 'dud':
+        if N_markers == 0:
+            result = 'NOT'
+        else:
+            result = 'LENS'
+
+    # And finally, what's the truth about this subject?
+    if kind == 'sim':
+        truth = 'LENS'
+    elif kind == 'dud':
+        truth = 'NOT'
+    else:
+        truth = 'UNKNOWN'
+
+    # Check we got all 13 items:
+    items = t.strftime('%Y-%m-%d_%H:%M:%S'),str(Name),str(ID),str(ZooID),category,kind,flavor,result,truth,str(location),str(classification_stage),str(annotation_x),str(annotation_y)
+    if len(items) != 13: print "MongoDB: digest failed: ",items[:]
+
+    return items
+
+# ----------------------------------------------------------------------------
+# For the pool's workers:
+
+def digest_job(job):
+    classification,subject,survey,method = job
+    return digest_classification(classification,subject,survey,method=method)
+
+# ======================================================================
+
 if __name__ == '__main__':
 
     db = MongoDB()
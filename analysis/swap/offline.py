@@ -62,11 +62,13 @@ EXAMPLE
                     training_IDs.update({ID: truth})
                 taus.update({ID: pi})
                 online_taus.update({ID: subject.mean_probability})
-                for agent_i in xrange(len(subject.annotationhistory['Name'])):
-                    name = subject.annotationhistory['Name'][agent_i]
+                names = subject.annotationhistory['Name']
+                it_was = subject.annotationhistory['ItWas']
+                for agent_i in xrange(len(names)):
+                    name = names[agent_i]
                     if name in set_aside_agent:
                         continue
-                    xij = subject.annotationhistory['ItWas'][agent_i]
+                    xij = it_was[agent_i]
                     if name not in bureau_offline:
                         bureau_offline.update({name: {'PD': 0.75, 'PL': 0.75,
                                               'PL': bureau.member[name].PL,
@@ -86,7 +88,23 @@ METHODS
     Estep(bureau_offline, pi, collection, taus, training_IDs={})
     Mstep(bureau_offline, pi, collection, taus, training_IDs={})
     EM_algorithm(bureau_offline, pi, collection, taus, training_IDs={},
-                 return_information=False)
+                 return_information=False, engine='dict', accelerate=None,
+                 updated=None, processes=1)
+
+    With engine='sparse', EM_algorithm hands over to EM_algorithm_sparse
+    (see swap/votes.py), which does the same steps on a sparse matrix of
+    the votes, with numpy, and returns the same things. So it does with
+    accelerate='squarem', which extrapolates the EM steps to converge in
+    fewer of them (though perhaps on different taus - see
+    compare_accelerated), and with updated=(names,IDs), the agents and subjects
+    with new votes since the bureau and taus were last fitted: the EM
+    then resumes from them, iterating on just those agents and subjects
+    before sweeping over all of them. With processes other than 1, the
+    steps are shared out among that many processes (None for one per
+    core).
+
+    For more votes than will fit in memory, see EM_algorithm_streaming
+    (in swap/votefile.py) and make_vote_file.py.
 
 BUGS
 
@@ -125,6 +143,8 @@ LICENCE
 """
 #============================================================================
 
+import swap
+
 from numpy import square, sqrt
 
 # ----------------------------------------------------------------------------
@@ -147,8 +167,9 @@ def Estep_old(bureau_offline, pi, collection, taus, training_IDs={}):
         #         continue
 
         subject = collection.member[ID]
-        for agent_i in xrange(len(subject.annotationhistory['Name'])):
-            name = subject.annotationhistory['Name'][agent_i]
+        names = subject.annotationhistory['Name']
+        for agent_i in xrange(len(names)):
+            name = names[agent_i]
             agent = bureau_offline[name]
             xij = agent['Subjects'][ID]
             PDi = agent['PD']
@@ -171,7 +192,7 @@ def Estep(bureau_offline, pi, taus, training_IDs={}):
     # bureau_offline
     taus_prime = taus.copy()
     taus_calculation = {}
-    taus_skip = []
+    taus_skip = set()
 
     for name in bureau_offline:
 
@@ -192,7 +213,7 @@ def Estep(bureau_offline, pi, taus, training_IDs={}):
                 try:
                     taus_calculation.update({ID: [0, 0, taus[ID]]})
                 except KeyError:
-                    taus_skip.append(ID)
+                    taus_skip.add(ID)
                     continue
             tau_j = taus_calculation[ID][0]
             N_j = taus_calculation[ID][1]
@@ -280,7 +301,16 @@ def Mstep(bureau_offline, pi, taus, training_IDs={}, laplace=1):
 
 def EM_algorithm(bureau_offline, pi, taus, training_IDs={},
                  N_min=10, N_max=50, epsilon_min=1e-5,
-                 return_information=False):
+                 return_information=False, engine='dict', accelerate=None,
+                 updated=None, processes=1):
+
+    if engine == 'sparse' or accelerate is not None or updated is not None \
+            or processes != 1:
+        return swap.EM_algorithm_sparse(bureau_offline, pi, taus, training_IDs,
+                                        N_min, N_max, epsilon_min,
+                                        return_information, accelerate,
+                                        updated, processes)
+
     epsilon_taus = 10
 
     N_try = 0
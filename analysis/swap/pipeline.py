@@ -0,0 +1,214 @@
+# ===========================================================================
+
+import swap
+
+import sys,time,threading,itertools,Queue
+
+# ======================================================================
+
+class Pipeline(object):
+    """
+    NAME
+        Pipeline
+
+    PURPOSE
+        Read and digest classifications in background threads, while
+        the main thread gets on with interpreting them.
+
+    COMMENTS
+        Reading a classification from the Mongo, and looking up its
+        subject, mostly means waiting for the database - time in which
+        the agents and subjects could be being updated. So one or more
+        reader threads take blocks of classifications from the batch
+        (one reader at a time), digest them, and put them on a queue of
+        limited depth; iterating over the Pipeline takes them off again,
+        digested and in their original order, whichever reader finished
+        first. Digests of None (tutorials, other projects) are passed
+        on as they are, just as db.digest would return them.
+
+        The main thread should call stop() when it has had enough (eg
+        at the end of a batch), so that the readers stop too.
+
+        The queue's depth, and the time spent waiting at either end of
+        it, are kept: if the main thread waits a lot, the database is
+        the bottleneck; if the readers do, the interpretation is.
+
+    INITIALISATION
+        db          A swap.MongoDB (or DigestedDB)
+        batch       Iterable of raw classifications, from db.find
+        survey      Passed on to db.digest
+        method      Passed on to db.digest (use_marker_positions)
+        readers     Number of reader threads [1]
+        depth       Maximum number of blocks in the queue [16]
+        block       Classifications per block [100]
+
+    METHODS AND VARIABLES
+        Pipeline.stop()
+        Pipeline.current        The (raw) classification last handed on,
+                                eg for db.token
+        Pipeline.served         Classifications handed on so far
+        Pipeline.waited         Seconds the main thread waited for them
+        Pipeline.blocked        Seconds the readers waited for room
+        Pipeline.mean_depth()   Mean queue depth, when asked for a block
+        Pipeline.max_depth      Largest queue depth seen
+
+    BUGS
+        Only for batch runs: a daemon's stream is read in the main
+        thread.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,db,batch,survey,method=False,readers=1,depth=16,block=100):
+
+        self.db = db
+        self.cursor = iter(batch)
+        self.survey = survey
+        self.method = method
+        self.block = block
+        self.depth = depth
+
+        self.lock = threading.Lock()
+        self.tally = threading.Lock()
+        self.queue = Queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        self.sequence = 0
+        self.exhausted = False
+        self.current = None
+
+        self.served = 0
+        self.waited = 0.0
+        self.blocked = 0.0
+        self.depths = 0
+        self.asked = 0
+        self.max_depth = 0
+
+        self.readers = []
+        for i in range(max(1,readers)):
+            reader = threading.Thread(target=self.read,name='SWAP reader '+str(i))
+            reader.daemon = True
+            reader.start()
+            self.readers.append(reader)
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'pipeline of %d reader threads: %d classifications served, mean queue depth %.1f (max %d of %d), main thread waited %.1fs, readers waited %.1fs' % \
+               (len(self.readers),self.served,self.mean_depth(),self.max_depth,self.depth,self.waited,self.blocked)
+
+# ----------------------------------------------------------------------
+# The readers take the next block off the batch, in turn, and then
+# digest it in their own time. Each block is numbered, so that the
+# blocks can be put back in order at the other end:
+
+    def read(self):
+
+        try:
+            while not self.stopped.is_set():
+                self.lock.acquire()
+                try:
+                    if self.exhausted: break
+                    raw = list(itertools.islice(self.cursor,self.block))
+                    number = self.sequence
+                    self.sequence += 1
+                    if len(raw) < self.block: self.exhausted = True
+                finally:
+                    self.lock.release()
+
+                digested = [(classification,self.db.digest(classification,self.survey,method=self.method)) for classification in raw]
+                self.put((number,digested,None))
+
+        except Exception:
+            self.put((None,None,sys.exc_info()))
+
+        # Tell the main thread this reader is done:
+        self.put((None,None,None))
+
+        return
+
+# ----------------------------------------------------------------------
+# Wait for room in the queue - unless the pipeline has been stopped:
+
+    def put(self,entry):
+
+        start = time.time()
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(entry,timeout=0.1)
+                break
+            except Queue.Full:
+                continue
+        self.tally.acquire()
+        self.blocked += time.time() - start
+        self.tally.release()
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def __iter__(self):
+
+        waiting = {}
+        following = 0
+        finished = 0
+
+        while finished < len(self.readers):
+
+            depth = self.queue.qsize()
+            self.depths += depth
+            self.asked += 1
+            self.max_depth = max(self.max_depth,depth)
+
+            start = time.time()
+            while True:
+                try:
+                    number,digested,error = self.queue.get(timeout=0.1)
+                    break
+                except Queue.Empty:
+                    continue
+            self.waited += time.time() - start
+
+            if error is not None:
+                self.stop()
+                raise error[0],error[1],error[2]
+
+            if number is None:
+                finished += 1
+                continue
+
+            waiting[number] = digested
+            while following in waiting:
+                for classification,items in waiting.pop(following):
+                    self.current = classification
+                    self.served += 1
+                    yield items
+                following += 1
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def mean_depth(self):
+        if self.asked == 0:
+            return 0.0
+        return float(self.depths)/self.asked
+
+# ----------------------------------------------------------------------
+
+    def stop(self):
+
+        self.stopped.set()
+        for reader in self.readers:
+            reader.join(1.0)
+
+        return
+
+# ======================================================================
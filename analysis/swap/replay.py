@@ -0,0 +1,440 @@
+# ===========================================================================
+
+import swap
+
+import numpy as np
+
+# ======================================================================
+
+"""
+    NAME
+        replay
+
+    PURPOSE
+        Apply a stream of digested classifications to a bureau of agents
+        and a collection of subjects - either one at a time, exactly as
+        SWAP.py always has, or a chunk at a time using NumPy.
+
+    COMMENTS
+        Each classification does two things: the agent is sent to the
+        subject (Subject.was_described), and then, depending on the
+        learning mode, the agent hears what the subject was
+        (Agent.heard). Replay.classify() does just this, for one
+        classification.
+
+        Replay.chunk() does the same for a whole chunk of
+        classifications, with NumPy operations on the columns of the
+        bureau's and collection's tables (so both must be columnar).
+        Order matters: an agent's confusion matrix depends on everything
+        it has heard so far, and likewise a subject's probability. The
+        chunk is therefore cut into contiguous segments in which no
+        agent and no subject appears twice. Within a segment the
+        updates are independent, so they can be done all at once; the
+        segments are then applied in order. Because segments are
+        contiguous, even the binomial draws for the realizations are
+        made in the same order as in the serial path, and the results
+        are the same.
+
+        The bookkeeping (trajectories and histories) is still done one
+        classification at a time.
+
+    CLASSES
+        Replay      Knows the learning mode, and updates bureau and sample
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+"""
+
+# ======================================================================
+
+class Replay(object):
+    """
+    NAME
+        Replay
+
+    PURPOSE
+        Interpret digested classifications, updating agents and
+        subjects.
+
+    COMMENTS
+        The classification tuples are the 13 items returned by
+        db.digest, except that at_x and at_y should already be lists
+        rather than strings.
+
+    INITIALISATION
+        bureau, sample                  The agents and subjects to update
+        pars                            Parameters for new agents
+        thresholds                      Detection and rejection thresholds
+        Nrealizations                   For new subjects
+        supervised,
+        supervised_and_unsupervised,
+        agents_willing_to_learn         Learning mode, as in SWAP.py
+        a_few_at_the_start              Agents ignored until NT > this
+        hasty                           Skip classifications of retired subjects
+
+    METHODS
+        Replay.classify(items)          Apply one classification
+        Replay.chunk(chunk)             Apply a list of classifications
+        Replay.learns_from(category)    Will agents hear about this subject?
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,bureau,sample,pars,thresholds,Nrealizations,
+                 supervised=False,supervised_and_unsupervised=False,
+                 agents_willing_to_learn=False,a_few_at_the_start=0,
+                 hasty=False):
+
+        self.bureau = bureau
+        self.sample = sample
+        self.pars = pars
+        self.thresholds = thresholds
+        self.Nrealizations = Nrealizations
+        self.supervised = supervised
+        self.supervised_and_unsupervised = supervised_and_unsupervised
+        self.agents_willing_to_learn = agents_willing_to_learn
+        self.a_few_at_the_start = a_few_at_the_start
+        self.hasty = hasty
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'replay of classifications into a %s and a %s' % (self.bureau,self.sample)
+
+# ----------------------------------------------------------------------
+# Does the agent get to hear about a subject of this category? Returns
+# whether heard() is called at all, and whether the agent then ignores
+# what it hears:
+
+    def learns_from(self,category):
+
+        ignore = not self.agents_willing_to_learn
+
+        if self.supervised_and_unsupervised:
+            # use both training and test images
+            hear = (category == 'test' or category == 'training')
+        elif self.supervised:
+            # Only use training images!
+            hear = (category == 'training')
+        else:
+            # Unsupervised: ignore all the training images...
+            hear = (category == 'test')
+
+        return hear,ignore
+
+# ----------------------------------------------------------------------
+# Register new volunteers and subjects, and mark them as dirty:
+
+    def register(self,items):
+
+        tstring,Name,ID,ZooID,category,kind,flavor,X,Y,location,stage,at_x,at_y = items
+
+        try: agent = self.bureau.member[Name]
+        except: agent = self.bureau.register(Name,self.pars)
+
+        try: subject = self.sample.member[ID]
+        except: subject = self.sample.register(ID,ZooID,category,kind,flavor,Y,self.thresholds,location,self.Nrealizations)
+
+        # Both are about to change, so will need saving at the next
+        # checkpoint:
+        self.bureau.dirty.add(Name)
+        self.sample.dirty.add(ID)
+
+        return agent,subject
+
+# ----------------------------------------------------------------------
+# Apply one classification, returning the subject's new probability:
+
+    def classify(self,items):
+
+        tstring,Name,ID,ZooID,category,kind,flavor,X,Y,location,stage,at_x,at_y = items
+
+        agent,subject = self.register(items)
+
+        # Update the subject's lens probability using input from the
+        # classifier. We send that classifier's agent to the subject
+        # to do this.
+        subject.was_described(by=agent,as_being=X,at_time=tstring,while_ignoring=self.a_few_at_the_start,haste=self.hasty,at_x=at_x,at_y=at_y)
+
+        # Update the agent's confusion matrix, based on what it heard:
+        P = subject.mean_probability
+
+        hear,ignore = self.learns_from(category)
+        if hear:
+            agent.heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=ignore)
+
+        return P
+
+# ----------------------------------------------------------------------
+# Apply a chunk of classifications, in order:
+
+    def chunk(self,chunk):
+
+        if len(chunk) == 0:
+            return
+
+        # Register everyone first - this doesn't depend on order:
+        agents,subjects = [],[]
+        for items in chunk:
+            agent,subject = self.register(items)
+            agents.append(agent)
+            subjects.append(subject)
+
+        if not (self.bureau.columnar() and self.sample.columnar()):
+            for items in chunk:
+                self.classify(items)
+            return
+
+        # Cut the chunk into segments with no repeated agent or subject:
+        start = 0
+        these_agents,these_subjects = set(),set()
+        for k in range(len(chunk)):
+            a,s = agents[k]._row,subjects[k]._row
+            if a in these_agents or s in these_subjects:
+                self.segment(chunk[start:k],agents[start:k],subjects[start:k])
+                start = k
+                these_agents,these_subjects = set(),set()
+            these_agents.add(a)
+            these_subjects.add(s)
+        self.segment(chunk[start:],agents[start:],subjects[start:])
+
+        return
+
+# ----------------------------------------------------------------------
+# Apply a segment of classifications of distinct subjects by distinct
+# agents, all at once. This is Subject.was_described followed by
+# Agent.heard, written for columns:
+
+    def segment(self,chunk,agents,subjects):
+
+        A = self.bureau.table
+        S = self.sample.table
+        n = len(chunk)
+
+        a = np.array([agent._row for agent in agents],dtype=np.int64)
+        s = np.array([subject._row for subject in subjects],dtype=np.int64)
+        said = np.array([items[7] == 'LENS' for items in chunk])
+        for items in chunk:
+            if items[7] != 'LENS' and items[7] != 'NOT':
+                raise Exception("Unrecognised classification result: "+items[7])
+            # As Agent.heard would, for the agents that hear about it:
+            if items[8] not in (None,'LENS','NOT','UNKNOWN') and self.learns_from(items[4])[0]:
+                raise Exception("Apparently, the subject was actually a "+str(items[8]))
+        Y = [items[8] for items in chunk]
+
+        # Update agents:
+        A.N[a] += 1
+
+        # Skip straight past inactive subjects, if hasty:
+        if self.hasty:
+            skip = (S.state[s] == swap.STATE.index('inactive')) \
+                 | (S.status[s] == swap.STATUS.index('detected')) \
+                 | (S.status[s] == swap.STATUS.index('rejected'))
+        else:
+            skip = np.zeros(n,dtype=bool)
+
+        # Still advance exposure, even if the agent is being ignored:
+        S.exposure[s[~skip]] += 1
+
+        # Now the subjects whose agents are listened to:
+        k = np.where(~skip & (A.NT[a] > self.a_few_at_the_start))[0]
+        if len(k) > 0:
+            self.describe(chunk,agents,subjects,k,a[k],s[k],said[k])
+
+        # Agents hear about the subjects, in their learning mode:
+        P = S.mean_probability[s]
+        for category in ('test','training'):
+            hear,ignore = self.learns_from(category)
+            if not hear: continue
+            k = [i for i in range(n) if chunk[i][4] == category]
+            for truth in ('LENS','NOT','UNKNOWN'):
+                kk = np.array([i for i in k if Y[i] == truth],dtype=np.int64)
+                if len(kk) > 0:
+                    self.hear(agents,kk,a[kk],said[kk],truth,P[kk],ignore)
+
+        return
+
+# ----------------------------------------------------------------------
+# Bayesian update of the subjects' probabilities - the body of
+# Subject.was_described, for the subjects in rows s:
+
+    def describe(self,chunk,agents,subjects,k,a,s,said):
+
+        A = self.bureau.table
+        S = self.sample.table
+        Nrealizations = int(S.Nrealizations)
+
+        PL,PD = A.PL[a],A.PD[a]
+        NL,ND = A.NL[a],A.ND[a]
+
+        # Draw realizations of the confusion matrices, PL then PD for
+        # each classification in turn, just as get_PL_realization and
+        # get_PD_realization would:
+        if Nrealizations > 0:
+            # NB. binomial() truncates float NL,ND to integers itself,
+            # given scalars, but must be given integer arrays:
+            N = np.array([NL,ND]).T[:,:,np.newaxis].astype(np.int64)
+            P = np.array([PL,PD]).T[:,:,np.newaxis]
+            draws = np.random.binomial(N,P,size=(len(a),2,Nrealizations))
+            PL_realization = (draws[:,0,:]*1.0)/NL[:,np.newaxis]
+            PL_realization = np.minimum(PL_realization,swap.PLmax)
+            PL_realization = np.maximum(PL_realization,swap.PLmin)
+            PD_realization = (draws[:,1,:]*1.0)/ND[:,np.newaxis]
+            PD_realization = np.minimum(PD_realization,swap.PDmax)
+            PD_realization = np.maximum(PD_realization,swap.PDmin)
+        else:
+            PL_realization = PL[:,np.newaxis]
+            PD_realization = PD[:,np.newaxis]
+
+        said = said[:,np.newaxis]
+
+        if S.mode == 'logodds':
+
+            # Add the log likelihood ratios, and floor at pmin:
+            l = S.logodds[s]
+            l += np.where(said,
+                        np.log(PL_realization/(1.0-PD_realization)),
+                        np.log((1.0-PL_realization)/PD_realization))
+            np.maximum(l,swap.logit(swap.pmin),out=l)
+            S.logodds[s] = l
+            p = l
+
+            # Geometric mean probability; the median waits until needed:
+            if Nrealizations > 0:
+                mean = np.exp(-np.sum(np.logaddexp(0.0,-l),axis=1)/S.Nrealizations)
+            else:
+                mean = swap.expit(l[:,0])
+            S.mean_probability[s] = mean
+            S.median_probability[s] = np.nan
+
+        else:
+
+            p = S.probability[s]
+            likelihood = np.where(said,
+                            PL_realization/(PL_realization*p + (1-PD_realization)*(1-p)),
+                            (1-PL_realization)/((1-PL_realization)*p + PD_realization*(1-p)))
+            p = likelihood*p
+            p[p < swap.pmin] = swap.pmin
+            S.probability[s] = p
+
+            # Mean and median. NB. accumulate the logs in order, like the
+            # builtin sum() in was_described (np.sum would add pairwise):
+            if Nrealizations > 0:
+                mean = 10.0**(np.cumsum(np.log10(p),axis=1)[:,-1]/(S.Nrealizations))
+                median = np.sort(p,axis=1)[:,Nrealizations/2]
+            else:
+                mean = p[:,0]
+                median = p[:,0]
+            S.mean_probability[s] = mean
+            S.median_probability[s] = median
+
+        # Should we count it as a detection, or a rejection?
+        # Only test subjects get de-activated:
+        test = (S.kind[s] == swap.KIND.index('test'))
+        rejected = (mean < S.rejection_threshold[s])
+        detected = ~rejected & (mean > S.detection_threshold[s])
+        undecided = ~rejected & ~detected
+        inactive = (S.state[s] == swap.STATE.index('inactive'))
+
+        S.status[s[rejected]] = swap.STATUS.index('rejected')
+        S.status[s[detected]] = swap.STATUS.index('detected')
+        S.status[s[undecided]] = swap.STATUS.index('undecided')
+
+        retiring = rejected & test
+        S.state[s[retiring]] = swap.STATE.index('inactive')
+        S.retirement_age[s[retiring]] = S.exposure[s[retiring]]
+        for i in np.where(retiring)[0]:
+            subjects[k[i]].retirement_time = chunk[k[i]][0]
+
+        # Keep the subject alive! Active subjects already have
+        # retirement_time = 'not yet':
+        reviving = undecided & test
+        S.state[s[reviving]] = swap.STATE.index('active')
+        S.retirement_age[s[reviving]] = 0.0
+        for i in np.where(reviving & inactive)[0]:
+            subjects[k[i]].retirement_time = 'not yet'
+
+        # Update agents' test histories (NB. informationGain is always
+        # called with a truthy "lens" in was_described):
+        if np.any(test):
+            I = swap.informationGain(mean[test], PL[test], PD[test], True)
+            for i,j in enumerate(np.where(test)[0]):
+                agents[k[j]].record_test(subjects[k[j]].ID, I[i], int(said[j,0]))
+            A.contribution[a[test]] += A.skill[a[test]]
+
+        # Update the trajectories (of probability or log odds) and
+        # annotation histories:
+        for i in range(len(k)):
+            items = chunk[k[i]]
+            subject = subjects[k[i]]
+            subject.extend_trajectory(p[i])
+            subject.record_annotation(agents[k[i]].name, int(said[i,0]), items[11], items[12], PL[i], PD[i])
+
+        return
+
+# ----------------------------------------------------------------------
+# Update the agents' confusion matrices - the body of Agent.heard, for
+# the agents in rows a, who were all told the subject's truth was the
+# same:
+
+    def hear(self,agents,k,a,said,truth,P,ignore):
+
+        A = self.bureau.table
+        PL,PD = A.PL[a],A.PD[a]
+        NL,ND = A.NL[a],A.ND[a]
+
+        if truth == 'LENS':
+            if not ignore:
+                PL = (PL*NL + said)/(1+NL)
+                PL = np.maximum(np.minimum(PL,swap.PLmax),swap.PLmin)
+            NL += 1
+
+        elif truth == 'NOT':
+            if not ignore:
+                PD = (PD*ND + ~said)/(1+ND)
+                PD = np.maximum(np.minimum(PD,swap.PDmax),swap.PDmin)
+            ND += 1
+
+        # Unsupervised learning!
+        elif truth == 'UNKNOWN':
+            increment = P
+            if not ignore:
+                PL = np.where(said, (PL*NL + increment)/(NL + increment),
+                                    (PL*NL +       0.0)/(NL + increment))
+                PL = np.maximum(np.minimum(PL,swap.PLmax),swap.PLmin)
+                PD = np.where(said, (PD*ND +             0.0)/(ND + (1.0-increment)),
+                                    (PD*ND + (1.0-increment))/(ND + (1.0-increment)))
+                PD = np.maximum(np.minimum(PD,swap.PDmax),swap.PDmin)
+            NL += increment
+            ND += (1.0 - increment)
+
+        else:
+            raise Exception("Apparently, the subject was actually a "+str(truth))
+
+        A.PL[a],A.PD[a] = PL,PD
+        A.NL[a],A.ND[a] = NL,ND
+        A.NT[a] += 1
+
+        # Always log progress, even if not learning:
+        A.skill[a] = swap.expectedInformationGain(0.5, PL, PD)
+        itwas = np.where(said,1,0)
+        actually = swap.actually_it_was_dictionary[truth]
+        for i in range(len(k)):
+            agents[k[i]].record_training(itwas[i],actually)
+
+        return
+
+# ======================================================================
@@ -0,0 +1,369 @@
+# ======================================================================
+
+import swap
+
+import numpy as np
+import os,datetime,threading,sqlite3
+
+# ======================================================================
+
+"""
+    NAME
+        sqlitedb
+
+    PURPOSE
+        Keep a recorded stream of classifications, and the subjects they
+        were of, in a single local SQLite file - so that SWAP can replay
+        them quickly, and reproducibly, with no database server at all.
+
+    COMMENTS
+        The file has two tables. The classifications table has one row
+        per classification, holding what digest reads from the document
+        (who made it, of which subject, with which project, stage and
+        markers - see swap.read_annotations), in columns:
+
+            updated_at  TEXT     eg 2013-05-06 12:34:56.789000
+            id          TEXT     the classification's _id
+            name        TEXT     user_id, or user_ip if anonymous
+            subject     TEXT     subject _id (NULL if there was none)
+            zooid       TEXT     the subject's Zooniverse ID
+            project     TEXT
+            stage       TEXT
+            markers     INTEGER  number of markers placed
+            x, y        BLOB     marker positions (float64 arrays)
+            simfound    INTEGER
+
+        indexed on (updated_at, id), so that find() is a range query on
+        the index, in time order, and can resume straight after a
+        resume token (see swap/mongodb.py). The subjects table holds
+        what digest needs from each subject's document: its group_id,
+        its training type, and the location of its image.
+
+        Classifications from every project and stage are kept: find()
+        can leave out the others, as MongoDB.find() does. Digesting a
+        row is done by the same function as for a Mongo document, so
+        the two give the same results.
+
+        Use make_sqlite_db.py to export (or bring up to date) a store
+        from the Mongo, or from a dump, and "dbspecies: SQLite" (with
+        "dbfile" pointing at the file) to have SWAP read one.
+
+    FUNCTIONS
+        write_sqlite_db(filename,db,batch)
+
+    CLASSES
+        SQLiteDB(filename)
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+"""
+
+TIMEFORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+SCHEMA = ["CREATE TABLE IF NOT EXISTS classifications (updated_at TEXT, id TEXT, name TEXT, subject TEXT, zooid TEXT, project TEXT, stage TEXT, markers INTEGER, x BLOB, y BLOB, simfound INTEGER)",
+          "CREATE UNIQUE INDEX IF NOT EXISTS updated_at_id ON classifications (updated_at, id)",
+          "CREATE TABLE IF NOT EXISTS subjects (id TEXT PRIMARY KEY, group_id TEXT, training TEXT, location TEXT)"]
+
+# ======================================================================
+# Write (or add to) a store, given a batch of classification documents
+# from another database (eg db.find from a MongoDB or a BSONDB), whose
+# subjects are looked up in that database as they are needed.
+# Classifications already in the store are skipped. Returns the number
+# of classifications added:
+
+def write_sqlite_db(filename,db,batch):
+
+    connection = sqlite3.connect(filename)
+    connection.text_factory = str
+    for statement in SCHEMA:
+        connection.execute(statement)
+
+    stored = set([row[0] for row in connection.execute("SELECT id FROM subjects")])
+    before = connection.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+
+    rows,subjects = [],[]
+    for classification in batch:
+
+        ID = swap.classified_subject(classification)
+        if ID is not None:
+            ZooID = classification['subjects'][-1]['zooniverse_id']
+            ID = str(ID)
+            if ID not in stored:
+                subjects.append(flatten_subject(ID,db.subject(classification['subjects'][-1]['id'])))
+                stored.add(ID)
+        else:
+            ZooID = None
+
+        if classification.has_key('user_id'):
+            Name = classification['user_id']
+        else:
+            Name = classification['user_ip']
+
+        stage,project,N_markers,at_x,at_y,simFound = swap.read_annotations(classification['annotations'])
+
+        rows.append((classification['updated_at'].strftime(TIMEFORMAT),str(classification['_id']),
+                     str(Name),ID,None if ZooID is None else str(ZooID),
+                     project,str(stage),N_markers,
+                     buffer(np.array(at_x,dtype=np.float64).tostring()),
+                     buffer(np.array(at_y,dtype=np.float64).tostring()),
+                     int(simFound)))
+
+        # Write in blocks, as a single transaction each:
+        if len(rows) == 10000:
+            save_rows(connection,rows,subjects)
+            rows,subjects = [],[]
+
+    save_rows(connection,rows,subjects)
+
+    after = connection.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+    connection.close()
+
+    return after - before
+
+# ----------------------------------------------------------------------------
+
+def save_rows(connection,rows,subjects):
+
+    connection.executemany("INSERT OR IGNORE INTO subjects VALUES (?,?,?,?)",subjects)
+    connection.executemany("INSERT OR IGNORE INTO classifications VALUES (?,?,?,?,?,?,?,?,?,?,?)",rows)
+    connection.commit()
+
+    return
+
+# ----------------------------------------------------------------------------
+# Keep just what digest needs from a subject's document (a subject that
+# could not be found is kept as a tutorial subject would be, with no
+# group_id, so that its classifications are not analysed either):
+
+def flatten_subject(ID,subject):
+
+    if subject is None or not subject.has_key('group_id'):
+        return ID,None,None,None
+
+    training = None
+    if str(subject['group_id']) == swap.trainingGroup:
+        things = subject['metadata']['training']
+        if type(things) == list:
+            training = things[0]['type']
+        else:
+            training = things['type']
+
+    location = None
+    if subject.has_key('location'):
+        location = subject['location']['standard']
+
+    return ID,str(subject['group_id']),training,location
+
+# ======================================================================
+
+class SQLiteDB(object):
+    """
+    NAME
+        SQLiteDB
+
+    PURPOSE
+        Serve up classifications from a local SQLite store, just like
+        MongoDB does (but without the Mongo).
+
+    COMMENTS
+        A "batch" is a stream of classifications table rows, in
+        (updated_at, id) order; digest() takes one row. Subjects are
+        looked up in the subjects table as they are needed, through a
+        SubjectCache. The connection is shared with any reader threads
+        (see swap/pipeline.py), one query at a time.
+
+    INITIALISATION
+        filename      The store, as written by write_sqlite_db
+        cachesize     Max. no. of subjects to keep [100000]
+
+    METHODS AND VARIABLES
+        SQLiteDB.find(word,t,survey=None,stage=None,end=None,after=None)
+        SQLiteDB.token(row)
+        SQLiteDB.latest()       Token of the last classification stored
+        SQLiteDB.digest(row,survey,method=False)
+        SQLiteDB.subject(ID)
+        SQLiteDB.size()
+        SQLiteDB.skipped        No. of classifications the last find left out
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,filename,cachesize=100000):
+
+        if not os.path.exists(filename):
+            raise IOError("SQLiteDB: no classification store called "+filename)
+
+        self.filename = filename
+        self.connection = sqlite3.connect(filename,check_same_thread=False)
+        self.connection.text_factory = str
+        self.lock = threading.Lock()
+
+        self.count = self.query("SELECT COUNT(*) FROM classifications")[0][0]
+
+        self.cache = swap.SubjectCache(cachesize)
+        self.skipped = 0
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def __str__(self):
+        return 'store of %d classifications in %s' % (self.size(),self.filename)
+
+# ----------------------------------------------------------------------------
+# Run a query, one at a time:
+
+    def query(self,statement,parameters=(),size=None):
+
+        self.lock.acquire()
+        try:
+            if size is None:
+                rows = self.connection.execute(statement,parameters).fetchall()
+            else:
+                rows = statement.fetchmany(size)
+        finally:
+            self.lock.release()
+
+        return rows
+
+# ----------------------------------------------------------------------------
+# Return a batch of classifications, defined by a time range - either
+# classifications made 'since' t, or classifications made 'before' t.
+# As with MongoDB.find, the survey, stage, end time and a resume token
+# can be given too, and the number of classifications left out is kept
+# in self.skipped:
+
+    def find(self,word,t,survey=None,stage=None,end=None,after=None):
+
+        if word == 'since' and after is not None:
+            t,ID = swap.read_resume_token(after)
+            window = "(updated_at > ? OR (updated_at = ? AND id > ?))"
+            parameters = [t.strftime(TIMEFORMAT),t.strftime(TIMEFORMAT),ID]
+
+        elif word == 'since':
+            window = "updated_at > ?"
+            parameters = [t.strftime(TIMEFORMAT)]
+
+        elif word == 'before':
+            window = "updated_at < ?"
+            parameters = [t.strftime(TIMEFORMAT)]
+
+        else:
+            print "SQLiteDB: error, cannot find classifications '"+word+"' "+str(t)
+            return []
+
+        if end is not None:
+            window += " AND updated_at <= ?"
+            parameters.append(end.strftime(TIMEFORMAT))
+
+        selection,chosen = window,list(parameters)
+        if survey is not None:
+            selection += " AND project = ?"
+            chosen.append(survey)
+        if stage is not None:
+            selection += " AND stage = ?"
+            chosen.append(str(stage))
+
+        if selection != window:
+            found = self.query("SELECT COUNT(*) FROM classifications WHERE "+window,parameters)[0][0]
+            self.skipped = found - self.query("SELECT COUNT(*) FROM classifications WHERE "+selection,chosen)[0][0]
+        else:
+            self.skipped = 0
+
+        self.lock.acquire()
+        try:
+            cursor = self.connection.execute("SELECT * FROM classifications WHERE "+selection+" ORDER BY updated_at, id",chosen)
+        finally:
+            self.lock.release()
+
+        return self.reading(cursor)
+
+# ----------------------------------------------------------------------------
+# Step through a cursor, a block of rows at a time:
+
+    def reading(self,cursor):
+
+        while True:
+            rows = self.query(cursor,size=1000)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                yield row
+
+# ----------------------------------------------------------------------------
+# Return the token to resume a batch from, straight after this row, or
+# after the last classification in the store:
+
+    def token(self,row):
+
+        return swap.resume_token(datetime.datetime.strptime(row[0],TIMEFORMAT),row[1])
+
+    def latest(self):
+
+        rows = self.query("SELECT * FROM classifications ORDER BY updated_at DESC, id DESC LIMIT 1")
+        if len(rows) == 0:
+            return None
+
+        return self.token(rows[0])
+
+# ----------------------------------------------------------------------------
+# Return a tuple of the key quantities, given a row - just as
+# MongoDB.digest does:
+
+    def digest(self,row,survey,method=False):
+
+        updated_at,identifier,Name,ID,ZooID,project,stage,N_markers,x,y,simFound = row
+
+        if project != survey or ID is None:
+            return None
+
+        t = datetime.datetime.strptime(updated_at,TIMEFORMAT)
+        at_x = np.frombuffer(x,dtype=np.float64).tolist()
+        at_y = np.frombuffer(y,dtype=np.float64).tolist()
+        vitals = t,Name,ID,ZooID,stage,N_markers,at_x,at_y,bool(simFound)
+
+        return swap.interpret_classification(vitals,self.subject(ID),method=method)
+
+# ----------------------------------------------------------------------------
+# Return a subject's document - or as much of it as digest needs - from
+# the cache if possible:
+
+    def subject(self,ID):
+
+        subject = self.cache.get(ID)
+        if subject is None:
+            rows = self.query("SELECT group_id,training,location FROM subjects WHERE id = ?",(ID,))
+            if len(rows) == 0:
+                return None
+            group_id,training,location = rows[0]
+
+            subject = {'metadata': {'training': {'type': training}}}
+            if group_id is not None:
+                subject['group_id'] = group_id
+            if location is not None:
+                subject['location'] = {'standard': location}
+            self.cache.put(ID,subject)
+
+        return subject
+
+# ----------------------------------------------------------------------------
+# Return the size of the classification table:
+
+    def size(self):
+
+        return self.count
+
+# ======================================================================
@@ -0,0 +1,576 @@
+# ===========================================================================
+
+import swap
+
+import numpy as np
+import os,sys,time,datetime,signal
+
+# ======================================================================
+
+"""
+    NAME
+        stream
+
+    PURPOSE
+        Keep SWAP running: consume digested classifications as they
+        arrive, from a pluggable source, and checkpoint the bureau and
+        sample every so often.
+
+    COMMENTS
+        In batch mode, SWAPSHOP runs SWAP.py again and again, each time
+        reading in the pickles, finding the classifications made since
+        the last run, and pickling everything again. In daemon mode,
+        SWAP.py keeps the bureau and sample in memory, and a Daemon
+        polls a stream for new classifications, interpreting them with
+        a swap.Replay as soon as they arrive. Every so many
+        classifications, or every so many seconds, it calls a
+        checkpoint function (supplied by SWAP.py) to write out the
+        pickles, the retirement list and update.config - so that
+        retirements go out within seconds, and a batch run can always
+        pick up from the last checkpoint.
+
+        A stream is anything with a poll() method, returning a list
+        of the 13-item tuples made by db.digest (possibly empty, if
+        nothing new has arrived), and a finished attribute, set when
+        there will never be any more. Three are provided:
+
+        MongoStream     Follows the live classifications collection:
+                        with a tailable cursor if it is capped, by
+                        re-querying on updated_at otherwise.
+        FileStream      Follows an append-only file of digested
+                        classifications, one per line (see
+                        write_digested). Handy for testing.
+        BatchStream     Serves up a single db.find('since',t), and
+                        then finishes - eg for a Toy database.
+
+    CLASSES
+        Daemon          Polls a stream, replays, and checkpoints
+
+    FUNCTIONS
+        write_digested(filename,batch)  Append digested classifications
+                                        to a FileStream's file
+
+    BUGS
+        Classifications are only taken in updated_at order by the
+        MongoStream; the other streams take them in the order they
+        come.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+"""
+
+# ======================================================================
+
+class MongoStream(object):
+    """
+    NAME
+        MongoStream
+
+    PURPOSE
+        Serve up new classifications from the live Mongo database, as
+        they are made.
+
+    COMMENTS
+        If the classifications collection is capped, a tailable cursor
+        is kept open on it, and simply waits for new documents.
+        Otherwise, each poll asks for classifications updated at or
+        after the last one seen, in time order, skipping those already
+        seen at that very time (so that none are lost or repeated when
+        several share a timestamp).
+
+    INITIALISATION
+        db          A swap.MongoDB
+        since       datetime: only take classifications updated after this
+        survey      Passed on to db.digest
+        method      Passed on to db.digest (use_marker_positions)
+        batch       Maximum number of classifications per poll [1000]
+        stage       If given, only ask for this stage's classifications
+
+    METHODS
+        MongoStream.poll()      List of digested classifications
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,db,since,survey,method=False,batch=1000,stage=None):
+        self.db = db
+        self.last = since
+        self.seen = set()
+        self.survey = survey
+        self.method = method
+        self.stage = stage
+        self.batch = batch
+        self.finished = False
+        self.cursor = None
+
+        options = self.db.classifications.options()
+        self.tailable = options.get('capped',False)
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def poll(self):
+
+        if self.tailable:
+            found = self.tail()
+        else:
+            found = self.query()
+
+        self.db.prefetch(found)
+
+        digested = []
+        for classification in found:
+            t = classification['updated_at']
+            if t > self.last:
+                self.last = t
+                self.seen = set()
+            self.seen.add(classification['_id'])
+
+            items = self.db.digest(classification,self.survey,method=self.method)
+            if items is not None:
+                digested.append(items)
+
+        return digested
+
+# ----------------------------------------------------------------------
+# Until a classification has been seen, the start time is exclusive, as
+# in db.find('since',t); after that, ties with the last one are allowed:
+
+    def after(self):
+        if len(self.seen) == 0:
+            return "$gt"
+        else:
+            return "$gte"
+
+# ----------------------------------------------------------------------
+# Re-query for anything updated since the last classification seen:
+
+    def query(self):
+
+        query = self.db.selection({'updated_at': {self.after(): self.last}},self.survey,self.stage)
+        cursor = self.db.classifications.find(query,swap.CLASSIFICATION_FIELDS,timeout=False)
+        cursor = cursor.sort('updated_at',1).limit(self.batch+len(self.seen))
+
+        found = []
+        for classification in cursor:
+            if classification['updated_at'] == self.last and classification['_id'] in self.seen:
+                continue
+            found.append(classification)
+        cursor.close()
+
+        return found
+
+# ----------------------------------------------------------------------
+# Read whatever has arrived on the open tailable cursor, re-opening it
+# from the last classification seen if it has died:
+
+    def tail(self):
+
+        if self.cursor is None or not self.cursor.alive:
+            query = self.db.selection({'updated_at': {self.after(): self.last}},self.survey,self.stage)
+            self.cursor = self.db.classifications.find(query,swap.CLASSIFICATION_FIELDS,tailable=True,await_data=True)
+
+        found = []
+        while len(found) < self.batch:
+            try:
+                classification = self.cursor.next()
+            except StopIteration:
+                break
+            if classification['updated_at'] < self.last:
+                continue
+            if classification['updated_at'] == self.last and classification['_id'] in self.seen:
+                continue
+            found.append(classification)
+
+        return found
+
+# ======================================================================
+
+class FileStream(object):
+    """
+    NAME
+        FileStream
+
+    PURPOSE
+        Serve up digested classifications from an append-only file,
+        as they are written to it.
+
+    COMMENTS
+        Each line holds the 13 items of one digested classification,
+        separated by tabs, as written by write_digested. Lines starting
+        with '#' are ignored, and so is a last line that has not been
+        finished yet - it will be read on a later poll, once its
+        newline has arrived. Classifications made at or before the
+        start time are skipped, just as db.find('since',t) would.
+
+        Unless asked to follow the file, the stream finishes when it
+        reaches the end of it.
+
+    INITIALISATION
+        filename    The file to follow (it need not exist yet)
+        since       datetime: only take classifications made after this
+        follow      Keep waiting for more at the end of the file [True]
+        batch       Maximum number of classifications per poll [1000]
+
+    METHODS
+        FileStream.poll()       List of digested classifications
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,filename,since=None,follow=True,batch=1000):
+        self.filename = filename
+        if since is None:
+            self.since = None
+        else:
+            self.since = since.strftime('%Y-%m-%d_%H:%M:%S')
+        self.follow = follow
+        self.batch = batch
+        self.finished = False
+        self.file = None
+        self.partial = ''
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def poll(self):
+
+        digested = []
+        if self.finished:
+            return digested
+
+        if self.file is None:
+            if not os.path.exists(self.filename):
+                if not self.follow:
+                    self.finished = True
+                return digested
+            self.file = open(self.filename,'r')
+
+        while len(digested) < self.batch:
+            line = self.file.readline()
+            if line == '':
+                if not self.follow:
+                    self.finished = True
+                    self.file.close()
+                break
+            if not line.endswith('\n'):
+                # Half-written: keep it for next time.
+                self.partial += line
+                continue
+            line = self.partial + line
+            self.partial = ''
+
+            line = line.rstrip('\n')
+            if len(line) == 0 or line.startswith('#'):
+                continue
+
+            items = tuple(line.split('\t'))
+            if len(items) != 13:
+                print "FileStream: skipping malformed line: "+line
+                continue
+            if self.since is not None and items[0] <= self.since:
+                continue
+            digested.append(items)
+
+        return digested
+
+# ======================================================================
+
+class BatchStream(object):
+    """
+    NAME
+        BatchStream
+
+    PURPOSE
+        Serve up one batch of classifications from a database, and
+        then finish.
+
+    INITIALISATION
+        db          A swap.ToyDB or swap.MongoDB
+        since       datetime: only take classifications made after this
+        survey      Passed on to db.digest
+        method      Passed on to db.digest (use_marker_positions)
+        batch       Maximum number of classifications per poll [1000]
+
+    METHODS
+        BatchStream.poll()      List of digested classifications
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,db,since,survey,method=False,batch=1000):
+        self.db = db
+        self.cursor = iter(db.find('since',since))
+        self.survey = survey
+        self.method = method
+        self.batch = batch
+        self.finished = False
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def poll(self):
+
+        digested = []
+        if self.finished:
+            return digested
+
+        while len(digested) < self.batch:
+            try:
+                classification = self.cursor.next()
+            except StopIteration:
+                self.finished = True
+                break
+            items = self.db.digest(classification,self.survey,method=self.method)
+            if items is not None:
+                digested.append(items)
+
+        return digested
+
+# ======================================================================
+
+class Daemon(object):
+    """
+    NAME
+        Daemon
+
+    PURPOSE
+        Keep interpreting classifications from a stream, and
+        checkpoint every so often.
+
+    COMMENTS
+        Classifications from other stages are skipped, as in batch
+        mode. If a chunksize is given, classifications are replayed a
+        chunk at a time - but a part-filled chunk is always replayed
+        before a checkpoint, and whenever the stream runs dry, so that
+        nothing is left waiting.
+
+        The checkpoint function is called as checkpoint(daemon), after
+        at least every classifications or interval seconds - whichever
+        comes first - as long as there is something new to save. It is
+        called once more when the daemon stops: when the stream
+        finishes, a classification made after the end time arrives,
+        or on SIGINT or SIGTERM.
+
+    INITIALISATION
+        replay          The swap.Replay to interpret classifications with
+        stream          Where the classifications come from
+        stage           Only interpret classifications from this stage
+        checkpoint      Function to call to save the state
+        every           Checkpoint after this many classifications [10000]
+        interval        ...or after this many seconds [600]
+        chunksize       Replay this many at a time (0 = one by one) [0]
+        wait            Seconds to sleep when the stream is dry [1]
+        end             datetime: stop at the first classification after this
+        vb              Verbose [False]
+
+    METHODS
+        Daemon.run()            Go, until stopped
+        Daemon.interpret(items) Replay one digested classification
+        Daemon.flush()          Replay the part-filled chunk
+        Daemon.save_if_due(t)   Checkpoint, if one is due
+        Daemon.stop()           Stop after the current poll
+
+    BUGS
+        Offline analysis is a batch operation, and is not done.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,replay,stream,stage,checkpoint,every=10000,interval=600.0,chunksize=0,wait=1.0,end=None,vb=False):
+        self.replay = replay
+        self.stream = stream
+        self.stage = stage
+        self.checkpoint = checkpoint
+        self.every = every
+        self.interval = interval
+        self.chunksize = chunksize
+        self.wait = wait
+        self.end = end
+        self.vb = vb
+
+        self.chunk = []
+        self.count = 0
+        self.saved = 0
+        self.first = None
+        self.last = None
+        self.running = False
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'daemon that has interpreted %d classifications' % (self.count)
+
+# ----------------------------------------------------------------------
+
+    def run(self):
+
+        self.running = True
+        handlers = {}
+        for sig in (signal.SIGINT,signal.SIGTERM):
+            try:
+                handlers[sig] = signal.signal(sig,self.stop)
+            except ValueError:
+                # Not in the main thread: stop() will have to be called.
+                pass
+
+        try:
+            checked = time.time()
+            while self.running:
+
+                # Checkpoints fall due in the middle of a poll, too:
+                batch = self.stream.poll()
+                for items in batch:
+                    if not self.interpret(items):
+                        self.running = False
+                        break
+                    checked = self.save_if_due(checked)
+
+                if len(batch) == 0:
+                    self.flush()
+                    if self.stream.finished:
+                        self.running = False
+                    else:
+                        time.sleep(self.wait)
+                    checked = self.save_if_due(checked)
+
+            self.save()
+
+        finally:
+            for sig in handlers:
+                signal.signal(sig,handlers[sig])
+
+        return self.count
+
+# ----------------------------------------------------------------------
+# Interpret one digested classification. Returns False if it was made
+# after the end time, so that the daemon should stop:
+
+    def interpret(self,items):
+
+        tstring,Name,ID,ZooID,category,kind,flavor,X,Y,location,classification_stage,at_x,at_y = items
+
+        if classification_stage != self.stage:
+            if self.vb:
+                print "Found classification from different stage: ",classification_stage," cf. ",self.stage,", items = ",items
+            return True
+
+        if self.end is not None:
+            t = datetime.datetime.strptime(tstring, '%Y-%m-%d_%H:%M:%S')
+            if t > self.end:
+                return False
+
+        # this is probably bad form:
+        if isinstance(at_x,str): at_x = eval(at_x)
+        if isinstance(at_y,str): at_y = eval(at_y)
+
+        items = tstring,Name,ID,ZooID,category,kind,flavor,X,Y,location,classification_stage,at_x,at_y
+        if self.chunksize > 0:
+            self.chunk.append(items)
+            if len(self.chunk) == self.chunksize:
+                self.flush()
+        else:
+            self.replay.classify(items)
+
+        self.count += 1
+        if self.first is None:
+            self.first = tstring
+        self.last = tstring
+
+        return True
+
+# ----------------------------------------------------------------------
+
+    def flush(self):
+
+        if len(self.chunk) > 0:
+            self.replay.chunk(self.chunk)
+            self.chunk = []
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def save(self):
+
+        self.flush()
+        if self.count > self.saved:
+            self.checkpoint(self)
+            self.saved = self.count
+
+        return
+
+# ----------------------------------------------------------------------
+# Checkpoint if every classifications or interval seconds have gone by
+# since the last one (checked). Returns the time of the latest:
+
+    def save_if_due(self,checked):
+
+        due = (self.count - self.saved >= self.every) or \
+              (time.time() - checked >= self.interval)
+        if due and self.count > self.saved:
+            self.save()
+            checked = time.time()
+
+        return checked
+
+# ----------------------------------------------------------------------
+# Can be used as a signal handler:
+
+    def stop(self,*args):
+
+        self.running = False
+
+        return
+
+# ======================================================================
+# Append digested classifications to a file, for a FileStream to read:
+
+def write_digested(filename,batch):
+
+    F = open(filename,'a')
+    for items in batch:
+        F.write('\t'.join([str(item) for item in items])+'\n')
+    F.close()
+
+    return
+
+# ======================================================================
@@ -13,6 +13,15 @@ prior = 2e-4
 # Nrealizations = 50
 # This should really be a user-supplied constant, in the configuration.
 
+# ======================================================================
+# Conversions between probability and log odds:
+
+def logit(p):
+    return np.log(p) - np.log(1.0-p)
+
+def expit(logodds):
+    return 1.0/(1.0+np.exp(-logodds))
+
 # ======================================================================
 
 class Subject(object):
@@ -56,7 +65,24 @@ class Subject(object):
         CPD 23 June 2014:
         Each subject also has an annotationhistory, which keeps track of who
         clicked, what they said it was, where they clicked, and their ability
-        to tell a lens (PL) and a dud (PD)
+        to tell a lens (PL) and a dud (PD). It is a swap.AnnotationHistory,
+        kept in the Collection's Annotations store; use its markers()
+        method to get all the clicks as flat arrays.
+
+        Log-odds mode:
+        With logodds=True, each realization is stored as its log odds,
+        ln(p/(1-p)). Each classification then just adds the agent's
+        log likelihood ratio (cached by the agent, if Nrealizations =
+        0) - no normalising division, and the pmin floor becomes a
+        floor in log odds. The mean probability is still needed at
+        every step, to decide the subject's status; the median is only
+        worked out when someone asks for it, and subject.probability
+        is computed from the log odds on demand. In this mode the
+        trajectory holds log odds too.
+
+        The trajectory is a swap.Trajectory buffer, with one row of
+        realizations per classification, that grows without copying
+        itself every time. trajectory_dtype=np.float32 halves its size.
 
     INITIALISATION
         ID
@@ -64,7 +90,12 @@ class Subject(object):
     METHODS
         Subject.described(by=X,as=Y)     Calculate Pr(LENS|d) given
                                          classifier X's assessment Y
+        Subject.record_annotation(name,it_was,at_x,at_y,PL,PD)
+        Subject.extend_trajectory(values)
         Subject.plot_trajectory(axes)
+        Subject.delta()                  State to journal at a checkpoint
+        Subject.apply(delta,annotations) Restore it
+        Subject.mark()                   Mark the trajectory etc as saved
 
     BUGS
 
@@ -83,9 +114,51 @@ class Subject(object):
       2013-05-15  Surhud More (KIPMU)
     """
 
+# ----------------------------------------------------------------------
+# In log-odds mode, subject.probability and subject.median_probability
+# are derived from the log odds when asked for. Otherwise, they are
+# just stored in the subject's __dict__, as they always were:
+
+    logodds = None
+
+    def get_probability(self):
+        if self.logodds is None:
+            return self.__dict__['probability']
+        else:
+            return expit(self.logodds)
+
+    def set_probability(self,value):
+        if self.logodds is None:
+            self.__dict__['probability'] = value
+        else:
+            self.logodds = logit(value)
+
+    probability = property(get_probability,set_probability)
+
+    # A median of NaN means "not worked out yet":
+
+    def get_median_probability(self):
+        median = self.__dict__['median_probability']
+        if median != median:
+            median = self.median_from_logodds(self.logodds)
+            self.__dict__['median_probability'] = median
+        return median
+
+    def set_median_probability(self,value):
+        self.__dict__['median_probability'] = value
+
+    median_probability = property(get_median_probability,set_median_probability)
+
+    def median_from_logodds(self,logodds):
+        if self.Nrealizations > 0:
+            middle = int(self.Nrealizations)/2
+            return expit(np.partition(logodds,middle)[middle])
+        else:
+            return expit(logodds[0])
+
 # ----------------------------------------------------------------------
 
-    def __init__(self,ID,ZooID,category,kind,flavor,truth,thresholds,location,Nrealizations):
+    def __init__(self,ID,ZooID,category,kind,flavor,truth,thresholds,location,Nrealizations,logodds=False,trajectory_dtype=np.float64,annotations=None):
 
         self.ID = ID
         self.ZooID = ZooID
@@ -101,17 +174,20 @@ class Subject(object):
         self.retirement_time = 'not yet'
         self.retirement_age = 0.0
 
-        if self.Nrealizations > 0:
+        if logodds:
+            self.logodds = np.zeros(max(int(self.Nrealizations),1))+logit(prior)
+        elif self.Nrealizations > 0:
             self.probability = np.zeros(self.Nrealizations)+prior
         else:
             self.probability = np.array([prior])
 
         self.mean_probability = prior
         self.median_probability = prior
-        if self.Nrealizations > 0:
-            self.trajectory = np.zeros(self.Nrealizations)+self.probability;
+        self.trajectory = swap.Trajectory(self.Nrealizations,dtype=trajectory_dtype)
+        if logodds:
+            self.trajectory.append(self.logodds)
         else:
-            self.trajectory = self.probability
+            self.trajectory.append(self.probability)
 
         self.exposure = 0
 
@@ -120,12 +196,9 @@ class Subject(object):
 
         self.location = location
 
-        self.annotationhistory = {'Name': np.array([]),
-                            'ItWas': np.array([], dtype=int),
-                            'PL': np.array([]),
-                            'PD': np.array([]),
-                            'At_X': [],
-                            'At_Y': []}
+        if annotations is None:
+            annotations = swap.Annotations()
+        self.annotationhistory = annotations.history(self.ID)
 
         return None
 
@@ -180,42 +253,66 @@ class Subject(object):
 
             if by.NT > a_few_at_the_start:
 
-                # Calculate likelihood for all self.Nrealizations trajectories, generating as many binomial deviates
-                PL_realization=by.get_PL_realization(self.Nrealizations);
-                PD_realization=by.get_PD_realization(self.Nrealizations);
-                prior_probability=self.probability*1.0;
-
-                if as_being == 'LENS':
-                    likelihood = PL_realization
-                    likelihood /= (PL_realization*self.probability + (1-PD_realization)*(1-self.probability))
-                    as_being_number = 1
+                if self.logodds is not None:
 
-                elif as_being == 'NOT':
-                    likelihood = (1-PL_realization)
-                    likelihood /= ((1-PL_realization)*self.probability + PD_realization*(1-self.probability))
-                    as_being_number = 0
-
-                else:
-                    raise Exception("Unrecognised classification result: "+as_being)
+                    # Add the log likelihood ratio to the log odds of all
+                    # self.Nrealizations trajectories, and floor them at pmin:
+                    self.logodds += by.get_LLR_realization(as_being,self.Nrealizations)
+                    np.maximum(self.logodds,logit(swap.pmin),out=self.logodds)
+                    as_being_number = swap.actually_it_was_dictionary[as_being]
 
-                # Update subject:
-                self.probability = likelihood*self.probability
-                idx=np.where(self.probability < swap.pmin)
-                self.probability[idx]=swap.pmin
-                #if self.probability < swap.pmin: self.probability = swap.pmin
-                posterior_probability=self.probability*1.0;
+                    self.extend_trajectory(self.logodds)
 
-                self.trajectory = np.append(self.trajectory,self.probability)
+                    self.exposure += 1
 
-                self.exposure += 1
+                    # Geometric mean probability, using ln p = -ln(1 + exp(-logodds)).
+                    # The median can wait until it is needed:
+                    if self.Nrealizations > 0:
+                        self.mean_probability = np.exp(-np.sum(np.logaddexp(0.0,-self.logodds))/self.Nrealizations)
+                    else:
+                        self.mean_probability = expit(self.logodds[0])
+                    self.median_probability = np.nan
 
-                # Update median probability
-                if self.Nrealizations > 0 :
-                    self.mean_probability=10.0**(sum(np.log10(self.probability))/(self.Nrealizations))
-                    self.median_probability=np.sort(self.probability)[self.Nrealizations/2]
                 else:
-                    self.mean_probability = self.probability
-                    self.median_probability = self.probability
+
+                    # Calculate likelihood for all self.Nrealizations trajectories, generating as many binomial deviates
+                    PL_realization=by.get_PL_realization(self.Nrealizations);
+                    PD_realization=by.get_PD_realization(self.Nrealizations);
+                    prior_probability=self.probability*1.0;
+
+                    if as_being == 'LENS':
+                        likelihood = PL_realization
+                        likelihood /= (PL_realization*self.probability + (1-PD_realization)*(1-self.probability))
+                        as_being_number = 1
+
+                    elif as_being == 'NOT':
+                        likelihood = (1-PL_realization)
+                        likelihood /= ((1-PL_realization)*self.probability + PD_realization*(1-self.probability))
+                        as_being_number = 0
+
+                    else:
+                        raise Exception("Unrecognised classification result: "+as_being)
+
+                    # Update subject:
+                    self.probability = likelihood*self.probability
+                    idx=np.where(self.probability < swap.pmin)
+                    self.probability[idx]=swap.pmin
+                    #if self.probability < swap.pmin: self.probability = swap.pmin
+                    posterior_probability=self.probability*1.0;
+
+                    self.extend_trajectory(self.probability)
+
+                    self.exposure += 1
+
+                    # Update median probability
+                    if self.Nrealizations > 0 :
+                        self.mean_probability=10.0**(sum(np.log10(self.probability))/(self.Nrealizations))
+                        self.median_probability=np.sort(self.probability)[self.Nrealizations/2]
+                    else:
+                        # Keep these scalar: an array here leaks into the
+                        # agent's PL and PD via heard(with_probability=P).
+                        self.mean_probability = self.probability[0]
+                        self.median_probability = self.probability[0]
 
                 # Should we count it as a detection, or a rejection?
                 # Only test subjects get de-activated:
@@ -249,19 +346,11 @@ class Subject(object):
                 # which also keeps agent.skill up to date.
                 if self.kind == 'test':
 
-                     by.testhistory['ID'] = np.append(by.testhistory['ID'], self.ID)
-                     by.testhistory['I'] = np.append(by.testhistory['I'], swap.informationGain(self.mean_probability, by.PL, by.PD, as_being))
-                     by.testhistory['Skill'] = np.append(by.testhistory['Skill'], by.skill)
-                     by.testhistory['ItWas'] = np.append(by.testhistory['ItWas'], as_being_number)
+                     by.record_test(self.ID, swap.informationGain(self.mean_probability, by.PL, by.PD, as_being), as_being_number)
                      by.contribution += by.skill
 
                 # update the annotation history
-                self.annotationhistory['Name'] = np.append(self.annotationhistory['Name'], by.name)
-                self.annotationhistory['ItWas'] = np.append(self.annotationhistory['ItWas'], as_being_number)
-                self.annotationhistory['At_X'].append(at_x)
-                self.annotationhistory['At_Y'].append(at_y)
-                self.annotationhistory['PL'] = np.append(self.annotationhistory['PL'], by.PL)
-                self.annotationhistory['PD'] = np.append(self.annotationhistory['PD'], by.PD)
+                self.record_annotation(by.name, as_being_number, at_x, at_y, by.PL, by.PD)
 
             else:
                 # Still advance exposure, even if by.NT <= ignore:
@@ -271,34 +360,110 @@ class Subject(object):
 
         return
 
+# ----------------------------------------------------------------------
+# Log who classified this subject, what they said, where they
+# clicked, and their confusion matrix at the time:
+
+    def record_annotation(self,name,it_was,at_x,at_y,PL,PD):
+
+        self.annotationhistory.record((name,it_was,at_x,at_y,PL,PD))
+
+        return
+
+# ----------------------------------------------------------------------
+# Add a step to the subject's trajectory. Subjects from old pickles have
+# flat trajectory arrays, which are converted first:
+
+    def extend_trajectory(self,values):
+
+        if not isinstance(self.trajectory,swap.Trajectory):
+            self.trajectory = swap.Trajectory.adopt(self.trajectory,self.Nrealizations)
+        self.trajectory.append(values)
+
+        return
+
+# ----------------------------------------------------------------------
+# The subject's state, for a checkpoint journal: its numbers, and the
+# steps and classifications added since the last checkpoint. Views add
+# their table's numbers, so that the state looks the same either way:
+
+    def delta(self):
+
+        if not isinstance(self.trajectory,swap.Trajectory):
+            self.trajectory = swap.Trajectory.adopt(self.trajectory,self.Nrealizations)
+
+        state = self.__dict__.copy()
+        for key in ('_table','_row'):
+            state.pop(key,None)
+        state['trajectory'] = self.trajectory.delta()
+        state['annotationhistory'] = self.annotationhistory.delta()
+
+        return state
+
+# ----------------------------------------------------------------------
+# Restore the subject's state from a journal (the classifications have
+# already been added to the annotation store):
+
+    def apply(self,delta,annotations):
+
+        for key,value in delta.items():
+            if key == 'trajectory' or key == 'annotationhistory':
+                continue
+            setattr(self,key,value)
+
+        trajectory = getattr(self,'trajectory',None)
+        if trajectory is None:
+            self.trajectory = swap.Trajectory(self.Nrealizations,dtype=delta['trajectory']['steps'].dtype)
+        elif not isinstance(trajectory,swap.Trajectory):
+            self.trajectory = swap.Trajectory.adopt(trajectory,self.Nrealizations)
+        self.trajectory.apply(delta['trajectory'])
+
+        if not isinstance(getattr(self,'annotationhistory',None),swap.AnnotationHistory):
+            self.annotationhistory = annotations.history(self.ID)
+        self.annotationhistory.apply(delta['annotationhistory'])
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def mark(self):
+
+        if isinstance(self.trajectory,swap.Trajectory):
+            self.trajectory.mark()
+        self.annotationhistory.mark()
+
+        return
+
 # ----------------------------------------------------------------------
 # Plot subject's trajectory, as an overlay on an existing plot:
 
     def plot_trajectory(self,axes,highlight=False):
 
         plt.sca(axes[0])
-        if self.Nrealizations > 0:
-            NN = len(self.trajectory)/self.Nrealizations
-        else:
-            NN = len(self.trajectory)
 
+        trajectory = self.trajectory
+        if not isinstance(trajectory,swap.Trajectory):
+            trajectory = swap.Trajectory.adopt(trajectory,self.Nrealizations)
+        trajectory = trajectory.compact()
+
+        # In log-odds mode, plot probabilities all the same:
+        if self.logodds is not None:
+            trajectory = expit(trajectory)
+
+        NN = len(trajectory)
         N = np.linspace(0, NN+1, NN, endpoint=True);
         N[0] = 0.5
-        mdn_trajectory=np.array([]);
-        sigma_trajectory_m=np.array([]);
-        sigma_trajectory_p=np.array([]);
+
+        # Median and 68% range of the realizations, at each step:
         if self.Nrealizations > 0:
-            for i in range(len(N)):
-    	        sorted_arr=np.sort(self.trajectory[i*self.Nrealizations:(i+1)*self.Nrealizations])
-                sigma_p=sorted_arr[int(0.84*self.Nrealizations)]-sorted_arr[int(0.50*self.Nrealizations)]
-                sigma_m=sorted_arr[int(0.50*self.Nrealizations)]-sorted_arr[int(0.16*self.Nrealizations)]
-                mdn_trajectory=np.append(mdn_trajectory,sorted_arr[int(0.50*self.Nrealizations)]);
-                sigma_trajectory_p=np.append(sigma_trajectory_p,sigma_p);
-                sigma_trajectory_m=np.append(sigma_trajectory_m,sigma_m);
+            sorted_arr = np.sort(trajectory,axis=1)
+            mdn_trajectory = sorted_arr[:,int(0.50*self.Nrealizations)]
+            sigma_trajectory_p = sorted_arr[:,int(0.84*self.Nrealizations)] - mdn_trajectory
+            sigma_trajectory_m = mdn_trajectory - sorted_arr[:,int(0.16*self.Nrealizations)]
         else:
-            mdn_trajectory     = self.trajectory
-            sigma_trajectory_p = self.trajectory*0
-            sigma_trajectory_m = self.trajectory*0
+            mdn_trajectory     = trajectory[:,0]
+            sigma_trajectory_p = mdn_trajectory*0
+            sigma_trajectory_m = mdn_trajectory*0
 
         if self.kind == 'sim':
             colour = 'blue'
@@ -0,0 +1,321 @@
+# ===========================================================================
+
+import swap
+
+import numpy as np
+import os,datetime,time,itertools,cPickle,multiprocessing
+
+# ======================================================================
+
+"""
+    NAME
+        sweep
+
+    PURPOSE
+        Replay one set of classifications under many different SWAP
+        configurations at once, each in its own process, and tabulate
+        the results side by side.
+
+    COMMENTS
+        The classifications are read from a digested cache (see
+        swap/digested.py), so they are only read from the database or
+        digested once. Every worker process opens the same cache
+        through a memory map: the pages are shared between them by the
+        operating system, rather than copied into each one.
+
+        Each configuration is a full SWAP parameter dictionary, and gets
+        its own bureau and collection (new ones, or read from its
+        bureaufile and samplefile), its own random state (read from its
+        random_file, as in SWAP.py, or seeded with SWAPSHOP's default
+        seed if there is none), and its own output directory, holding
+        its pickles, retirement list, candidate catalog and an
+        update.config that SWAP.py could carry on from.
+
+        sweep_configurations() makes the list of configurations from a
+        set of config files and a dictionary of parameters to vary
+        (every combination is run). As well as ordinary parameters,
+        "mode" can be varied over supervised, unsupervised and
+        supervised_and_unsupervised.
+
+        Offline analysis, verbose and one-by-one replay are not
+        available in a sweep; nor are plots, which make_*_plots.py can
+        make from the pickles afterwards.
+
+    FUNCTIONS
+        sweep_configurations(configfiles,vary=None)
+        run_sweep(cache,configurations,outdir,processes=None)
+        replay_configuration(pars,db,outdir)
+        write_sweep_summary(summaries,filename,varied=[])
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+"""
+
+MODES = {'supervised':(True,False),
+         'unsupervised':(False,False),
+         'supervised_and_unsupervised':(True,True)}
+
+SUMMARY = ['count','Nagents','N','Ns','Ns_detected','Ns_rejected','Ns_retired',
+           'Ntl','Ntl_detected','Ntl_rejected','Ntd','Ntd_detected','Ntd_rejected',
+           'seconds']
+
+# ======================================================================
+# Interpret a parameter value given on the command line, just as the
+# Configuration does values read from a file:
+
+def interpret(value):
+
+    try:
+        value = float(value)
+    except ValueError:
+        pass
+
+    if value == 'False':
+        value = False
+    elif value == 'True':
+        value = True
+    elif value == 'None':
+        value = None
+
+    return value
+
+# ----------------------------------------------------------------------
+# Make a list of parameter dictionaries, one for every combination of
+# the varied parameters, for each config file. Each one gets a 'name'
+# (used for its output directory) and a 'varied' dictionary:
+
+def sweep_configurations(configfiles,vary=None):
+
+    if vary is None: vary = {}
+    keys = sorted(vary.keys())
+
+    configurations = []
+    for configfile in configfiles:
+        stem = os.path.splitext(os.path.basename(configfile))[0]
+        combinations = list(itertools.product(*[vary[key] for key in keys]))
+
+        for k,values in enumerate(combinations):
+            pars = swap.Configuration(configfile).parameters
+
+            varied = {}
+            for key,value in zip(keys,values):
+                value = interpret(value)
+                varied[key] = value
+                if key == 'mode':
+                    pars['supervised'],pars['supervised_and_unsupervised'] = MODES[value]
+                else:
+                    pars[key] = value
+
+            if len(combinations) > 1:
+                pars['name'] = '%s_%03d' % (stem,k)
+            else:
+                pars['name'] = stem
+            pars['varied'] = varied
+            configurations.append(pars)
+
+    return configurations
+
+# ----------------------------------------------------------------------
+# Each worker process opens the cache once, and keeps it here:
+
+_cache = None
+
+def open_cache(cache):
+    global _cache
+    _cache = swap.DigestedDB(cache)
+    return
+
+def replay_in_worker(job):
+    pars,outdir = job
+    return replay_configuration(pars,_cache,outdir)
+
+# ----------------------------------------------------------------------
+# Run all the configurations, in a pool of processes (or in this one,
+# if processes=1). Returns their summaries, in order:
+
+def run_sweep(cache,configurations,outdir,processes=None):
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1,min(processes,len(configurations)))
+
+    jobs = [(pars,outdir) for pars in configurations]
+
+    if processes == 1:
+        open_cache(cache)
+        summaries = [replay_in_worker(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes,initializer=open_cache,initargs=(cache,))
+        try:
+            summaries = pool.map(replay_in_worker,jobs,chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    return summaries
+
+# ----------------------------------------------------------------------
+# Replay the classifications under one configuration, as SWAP.py does,
+# write its outputs, and return a dictionary summarizing the results:
+
+def replay_configuration(pars,db,outdir):
+
+    started = time.time()
+    name = pars['name']
+
+    try:
+        F = open(pars['random_file'],'r')
+        np.random.set_state(cPickle.load(F))
+        F.close()
+    except:
+        np.random.seed(7623)
+
+    stage = str(int(pars['stage']))
+    survey = pars['survey']
+
+    try: supervised = pars['supervised']
+    except: supervised = False
+    try: supervised_and_unsupervised = pars['supervised_and_unsupervised']
+    except: supervised_and_unsupervised = False
+    try: agents_willing_to_learn = pars['agents_willing_to_learn']
+    except: agents_willing_to_learn = False
+    if agents_willing_to_learn:
+        a_few_at_the_start = pars['a_few_at_the_start']
+    else:
+        a_few_at_the_start = 0
+
+    if pars['start'] == 'the_beginning':
+        t1 = datetime.datetime(1978, 2, 28, 12, 0, 0, 0)
+    else:
+        t1 = datetime.datetime.strptime(pars['start'], '%Y-%m-%d_%H:%M:%S')
+    if pars['end'] == 'the_end_of_time':
+        t2 = datetime.datetime(2100, 1, 1, 12, 0, 0, 0)
+    else:
+        t2 = datetime.datetime.strptime(pars['end'], '%Y-%m-%d_%H:%M:%S')
+    # Timestamps compare just like the strings they are written as:
+    end = t2.strftime('%Y-%m-%d_%H:%M:%S')
+
+    try: N_per_batch = pars['N_per_batch']
+    except: N_per_batch = 5000000
+    try: use_marker_positions = pars['use_marker_positions']
+    except: use_marker_positions = False
+
+    thresholds = {}
+    thresholds['detection'] = pars['detection_threshold']
+    thresholds['rejection'] = pars['rejection_threshold']
+    Nrealizations = pars['Nrealizations']
+
+    try: columnar = pars['columnar']
+    except: columnar = False
+    try: chunksize = int(pars['chunksize'])
+    except: chunksize = 0
+    if chunksize > 0: columnar = True
+    try: logodds = pars['logodds']
+    except: logodds = False
+    try: precision = pars['trajectory_precision']
+    except: precision = 'double'
+    if precision == 'single':
+        trajectory_dtype = np.float32
+    else:
+        trajectory_dtype = np.float64
+    try: history_keep = int(pars['history_keep'])
+    except: history_keep = 0
+
+    bureau = swap.read_pickle(pars['bureaufile'],'bureau',columnar=columnar,history_keep=history_keep)
+    sample = swap.read_pickle(pars['samplefile'],'collection',columnar=columnar,logodds=logodds,trajectory_dtype=trajectory_dtype)
+
+    replay = swap.Replay(bureau,sample,pars,thresholds,Nrealizations,
+                         supervised=supervised,
+                         supervised_and_unsupervised=supervised_and_unsupervised,
+                         agents_willing_to_learn=agents_willing_to_learn,
+                         a_few_at_the_start=a_few_at_the_start,
+                         hasty=pars['hasty'])
+
+    # Replay the classifications, just as SWAP.py would:
+    count = 0
+    first,last = None,pars['start']
+    chunk = []
+    for row in db.find('since',t1,stage=stage,end=t2):
+
+        items = db.digest(row,survey,method=use_marker_positions)
+        if items is None: continue
+        tstring = items[0]
+        if items[10] != stage: continue
+        if tstring > end: break
+
+        if chunksize > 0:
+            chunk.append(items)
+            if len(chunk) == chunksize:
+                replay.chunk(chunk)
+                chunk = []
+        else:
+            replay.classify(items)
+
+        count += 1
+        if count == 1: first = tstring
+        last = tstring
+        if count == N_per_batch: break
+
+    if len(chunk) > 0:
+        replay.chunk(chunk)
+
+    bureau.collect_probabilities()
+    sample.take_stock()
+
+    # Write the outputs in this configuration's own directory:
+    if first is None: first = pars['start']
+    pars['finish'] = first
+    pars['start'] = last
+    pars['trunk'] = name
+    pars['dir'] = os.path.abspath(outdir)+'/'+name
+    if not os.path.exists(pars['dir']): os.makedirs(pars['dir'])
+
+    pars['bureaufile'] = pars['dir']+'/'+name+'_bureau.pickle'
+    swap.write_pickle(bureau,pars['bureaufile'])
+    pars['samplefile'] = pars['dir']+'/'+name+'_collection.pickle'
+    swap.write_pickle(sample,pars['samplefile'])
+
+    swap.write_list(sample,swap.get_new_filename(pars,'retire_these'),item='retired_subject')
+    swap.write_catalog(sample,swap.get_new_filename(pars,'candidate_catalog'),thresholds,kind='test')
+
+    config = dict([(key,value) for key,value in pars.items() if key not in ('name','varied')])
+    swap.write_config(pars['dir']+'/update.config',config)
+
+    summary = {'name':name, 'varied':pars['varied']}
+    summary['count'] = count
+    summary['Nagents'] = bureau.size()
+    for key in SUMMARY:
+        if key in sample.__dict__:
+            summary[key] = int(sample.__dict__[key])
+    summary['seconds'] = time.time() - started
+
+    print "SWAP: sweep: %s interpreted %d classifications in %.1f seconds" % (name,count,summary['seconds'])
+
+    return summary
+
+# ----------------------------------------------------------------------
+# Write a table of the sweep's results, one configuration per line:
+
+def write_sweep_summary(summaries,filename,varied=[]):
+
+    F = open(filename,'w')
+    F.write('# '+'  '.join(['name']+list(varied)+SUMMARY)+'\n')
+    for summary in summaries:
+        words = [summary['name']]
+        words += [str(summary['varied'].get(key,'-')) for key in varied]
+        for key in SUMMARY:
+            if key == 'seconds':
+                words.append('%.1f' % summary[key])
+            else:
+                words.append(str(summary[key]))
+        F.write('  '.join(words)+'\n')
+    F.close()
+
+    return
+
+# ======================================================================
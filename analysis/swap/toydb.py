@@ -1,8 +1,21 @@
 # ======================================================================
 
+import swap
+
 import numpy as np
 
-import datetime,sys
+import datetime,calendar,itertools,sys
+
+# Toy classifications are made in the first fortnight of April 2013:
+START = calendar.timegm(datetime.datetime(2013, 4, 1).timetuple())
+PERIOD = 14*24*3600
+
+# Sims come in three flavors, in roughly these proportions:
+FLAVORS = ('lensed galaxy','lensed quasar','lensing cluster')
+FLAVOR_RATES = (0.6,0.3,0.1)
+
+# Toy images are this many pixels on a side:
+IMAGESIZE = 440.0
 
 # ======================================================================
 
@@ -16,13 +29,33 @@ class ToyDB(object):
         (except using standard dictionaries).
 
     COMMENTS
+        The classifications are all drawn at once, with numpy, so
+        making millions of them takes seconds. They are kept in time
+        order, so find() is a binary search; it returns an iterator
+        over row numbers, which digest() turns into classifications.
+
+        digest() returns the same 13 items as MongoDB.digest: each sim
+        has a flavor, each lens (sim or test) a position in its image,
+        and each LENS classification some markers, scattered about the
+        lens if there is one (and anywhere in the image if not). With
+        "stages: 2", the second week's classifications are Stage 2
+        ones. The marker positions come back as lists, as from a
+        DigestedDB; a sim counts as found whenever it is marked, with
+        or without use_marker_positions.
+
+        For soak tests, find(...,endless=True) never runs out: after
+        the last classification, the whole fortnight is classified
+        again, in the next fortnight, and so on (row numbers past
+        size() stand for these repeats).
 
     INITIALISATION
         From scratch.
     
     METHODS AND VARIABLES
-        ToyDB.get_classification()
-        
+        ToyDB.find(word,t,endless=False)
+        ToyDB.digest(row,survey=None,method=False)
+        ToyDB.size()
+
     BUGS
 
     AUTHORS
@@ -58,6 +91,9 @@ class ToyDB(object):
 
         try: self.difficulty = int(pars['difficulty']) # Mean no. of classifications per person
         except: self.difficulty = 0.5
+
+        try: self.stages = int(pars['stages']) # No. of stages in the fortnight
+        except: self.stages = 1
         
         self.classifiers = self.populate('classifiers')
         
@@ -75,31 +111,46 @@ class ToyDB(object):
         return 'database of %d Toy classifications' % (self.size())       
         
 # ----------------------------------------------------------------------------
-# Generate various tables in the database:
+# Generate various tables in the database. Each is drawn all at once, in
+# numpy arrays: the classifiers and subjects are also kept as lists of
+# dictionaries, but the classifications are kept as columns - the time
+# (in seconds since 1970), and the indices of the classifier, the
+# subject and the result (in swap.RESULT) - so that there can be millions
+# of them:
 
     def populate(self,things,category=None):
 
         array = []
-        
+
         if things == 'classifiers':
             # Store their name, and other information:
+            self.truePL,self.truePD = self.draw_from_Beta2D(size=self.population)
             for k in range(self.population):
                 classifier = {}
                 classifier['Name'] = 'Phil'+str(k)
                 classifier['count'] = 0
-                classifier['truePL'],classifier['truePD'] = self.draw_from_Beta2D()
+                classifier['truePL'],classifier['truePD'] = self.truePL[k],self.truePD[k]
                 array.append(classifier)
 
-        
+
         elif things == 'subjects':
 
             if category not in ['training','test']:
                 print "ToyDB: confused by category "+category
                 sys.exit()
-             
-            if category == 'training': Nj = self.trainingsize   
-            if category == 'test': Nj = self.surveysize   
-            
+
+            if category == 'training': Nj = self.trainingsize
+            if category == 'test': Nj = self.surveysize
+
+            if category == 'training':
+                lens = (np.random.rand(Nj) > 0.5)
+            else:
+                # But we do actually need to know what these are!
+                lens = (np.random.rand(Nj) < self.prior)
+
+            flavors = np.random.choice(len(FLAVORS),size=Nj,p=FLAVOR_RATES)
+            positions = IMAGESIZE*(0.1 + 0.8*np.random.rand(Nj,2))
+
             for j in range(Nj):
                 subject = {}
                 ID = category+'Image'+str(j)
@@ -110,191 +161,246 @@ class ToyDB(object):
                 subject['category'] = category
 
                 if subject['category'] == 'training':
-                    if np.random.rand() > 0.5:
+                    if lens[j]:
                         subject['kind'] = 'sim'
                         subject['truth'] = 'LENS'
+                        subject['flavor'] = FLAVORS[flavors[j]]
                     else:
                         subject['kind'] = 'dud'
                         subject['truth'] = 'NOT'
-                        
+                        subject['flavor'] = 'dud'
+
                 elif subject['category'] == 'test':
                     subject['kind'] = 'test'
                     subject['truth'] = 'UNKNOWN'
-                    # But we do actually need to know what this is!
-                    if np.random.rand() < self.prior: 
+                    subject['flavor'] = 'test'
+                    if lens[j]:
                         subject['strewth'] = 'LENS'
                     else:
                         subject['strewth'] = 'NOT'
 
+                # Where is the lens, if there is one?
+                if lens[j]:
+                    subject['x'],subject['y'] = positions[j]
+
                 png = ID+'_gri.png'
                 subject['location'] = 'http://toy.org/standard/'+png
 
                 array.append(subject)
-                
-                
+
+
         elif things == 'classifications':
 
-            count = 0
+            # Classifiers are chosen first, and then what they are shown
+            # depends on how many classifications they had made before
+            # - in time order:
             N = self.population*self.enthusiasm
-            for i in range(N):
-                classification = {}
-                t = self.pick_one('epochs')
-                
-                classifier = self.pick_one('classifiers')
-                classification['Name'] = classifier['Name']
-
-                subject = self.pick_one('subjects',classifier=classifier)
-                
-                classification['updated_at'] = t
-                classification['ID'] = subject['ID']
-                classification['category'] = subject['category']
-                classification['kind'] = subject['kind']
-                classification['truth'] = subject['truth']
-                classification['result'] = \
-                  self.make_classification(subject=subject,classifier=classifier)
-                
-                array.append(classification)
-                count += 1
+            t = np.sort(self.pick('epochs',N))
+            classifiers = self.pick('classifiers',N)
+            subjects = self.pick('subjects',N,classifiers=classifiers)
+
+            array = {'time': t,
+                     'classifier': classifiers.astype(np.int32),
+                     'subject': subjects.astype(np.int32),
+                     'result': self.make_classifications(subjects,classifiers)}
+
+            # Stage 2 starts half way through, if there is one:
+            array['stage'] = np.ones(N,dtype=np.int8)
+            if self.stages > 1:
+                array['stage'][t >= START + PERIOD/2] = 2
 
-                # Count up to 74 in dots:
-                if count == 1: sys.stdout.write('SWAP: ')
-                elif np.mod(count,int(N/73.0)) == 0: sys.stdout.write('.')
-                elif count == N: sys.stdout.write('\n')
-                sys.stdout.flush()
+            array['markers'],array['x'],array['y'] = self.make_markers(subjects,array['result'])
+
+            counts = np.bincount(classifiers,minlength=self.population)
+            for k in range(self.population):
+                self.classifiers[k]['count'] = counts[k]
 
         return array
 
 # ----------------------------------------------------------------------------
-# Random selection of something from its list:
+# Random selection of N things from their lists (as indices):
+
+    def pick(self,things,N,classifiers=None):
 
-    def pick_one(self,things,classifier=None):
-    
         if things == 'classifiers':
-            
-            # Distribution of number of classifications peaks at low N. 
-            # Suppose mean number is 40; exponential distribution with this 
+
+            # Distribution of number of classifications peaks at low N.
+            # Suppose mean number is 40; exponential distribution with this
             # mean?
-            
+
             # Original uniform distribution:
-            # k = int(self.population*np.random.rand())
-            
-            j = 0
-            while (j == 0):
-            
+            # k = np.random.randint(self.population,size=N)
+
+            mu = float(self.enthusiasm)
+            KK = float(self.population)
+
+            k = np.zeros(N,dtype=np.int64)
+            todo = np.arange(N)
+            while len(todo) > 0:
+
                 # Exponential distribution for Nk with mean = enthusiasm:
-                Nk = int(np.random.exponential(scale=self.enthusiasm)) + 1
+                Nk = np.random.exponential(scale=self.enthusiasm,size=len(todo)).astype(int) + 1
                 # This is the number of classifications made by the kth classifier
                 # Nk = 1 is the most likely number, it's the bin with the most
-                # classifiers in it. Now find where in the ordered sequence of 
-                # classifiers we are, by drawing randomly from this bin of the 
+                # classifiers in it. Now find where in the ordered sequence of
+                # classifiers we are, by drawing randomly from this bin of the
                 # histogram.
-                
-                mu = self.enthusiasm
-                KK = self.population
-                                
+
                 # First count the classifiers who will do less than Nk
                 # classifications:
-                i = int((KK/mu)*(mu - (Nk-1.0+mu)*np.exp(-1.0*(Nk-1.0)/mu)))
-                
-                # Now draw a classifier from the Nk column:
-                j = int((KK*Nk/(mu*mu))*np.exp(-1.0*Nk/mu))
-                k = i + int(np.random.rand() * j)
-                
+                i = (KK/mu)*(mu - (Nk-1.0+mu)*np.exp(-1.0*(Nk-1.0)/mu))
+
+                # Now draw a classifier from the Nk column. (The column
+                # is not rounded down to a whole number of classifiers:
+                # in a small population, every column would be empty.)
+                j = (KK*Nk/(mu*mu))*np.exp(-1.0*Nk/mu)
+                kk = (i + np.random.rand(len(todo)) * j).astype(int)
+
                 # BUG: this should really be a draw without replacement.
                 # No matter - its good enough for a sim.
-                               
-                # print "Classifier: Nk,i,j,k = ",Nk,i,j,k
-                if j == 0 or k >= KK:
-                    # print "Rejecting Classifier: Nk,i,j,k = ",Nk,i,j,k
-                    j = 0
-                        
-            something = self.classifiers[k]
 
-        
+                # Reject, and draw again, the overflows:
+                good = (kk < KK)
+                k[todo[good]] = kk[good]
+                todo = todo[~good]
+
+            something = k
+
+
         elif things == 'subjects':
-            
+
             # Here, we have to emulate the stream. What the classifier
-            # is shown depends on what they have already seen!
-            
-            j = classifier['count'] + 1
-            level = int(j/20.0) + 1
+            # is shown depends on what they have already seen - so
+            # count each classifier's classifications so far:
+
+            # (Sorting classifier and position together, in one int64,
+            # is much quicker than a stable argsort.)
+            keys = np.sort(classifiers.astype(np.int64)*N + np.arange(N))
+            order = keys % N
+            ranked = keys // N
+            first = np.flatnonzero(np.r_[True,ranked[1:] != ranked[:-1]])
+            seen = np.empty(N,dtype=np.int64)
+            seen[order] = np.arange(N) - np.repeat(first,np.diff(np.r_[first,N]))
+
+            j = seen + 1
+            level = (j/20.0).astype(int) + 1
             alpha = self.difficulty
-            
+
             training_rate = 2.0 / (5.0*2.0**(alpha*(level - 1)))
-            
-            if np.random.rand() < training_rate:
-                j = int(len(self.trainingset)*np.random.rand())
-                something = self.trainingset[j]
-            else:
-                j = int(len(self.testset)*np.random.rand())
-                something = self.testset[j]
-                
+
+            Ntraining = len(self.trainingset)
+            training = (np.random.rand(N) < training_rate)
+            something = np.where(training,
+                                 (Ntraining*np.random.rand(N)).astype(int),
+                                 Ntraining + (len(self.testset)*np.random.rand(N)).astype(int))
+
         elif things == 'epochs':
 
-            day = int(14*np.random.rand()) + 1
-            hour = int(24*np.random.rand())
-            minute = int(60*np.random.rand())
-            second = int(60*np.random.rand())
-            something = datetime.datetime(2013, 4, day, hour, minute, second, 0)
-                
+            day = np.random.randint(14,size=N) + 1
+            hour = np.random.randint(24,size=N)
+            minute = np.random.randint(60,size=N)
+            second = np.random.randint(60,size=N)
+            something = START + (((day - 1)*24 + hour)*60 + minute)*60 + second
+            something = something.astype(np.int64)
+
         return something
-        
+
 # ----------------------------------------------------------------------------
-# Use the hidden confusion matrix of each toy classifier to classify 
-# the subject provided:
+# Use the hidden confusion matrix of each toy classifier to classify
+# the subjects provided (index arrays), returning indices into RESULT:
 
-    def make_classification(self,subject=None,classifier=None):
-    
-        # If all toy classifiers were equally skilled, we could ignore them, 
+    def make_classifications(self,subjects,classifiers):
+
+        # If all toy classifiers were equally skilled, we could ignore them,
         # and just use constant P values:
         # PL = 0.9
         # PD = 0.8
-        # Instead, we use the classifier's own PD and PL:
-        
-        if subject['category'] == 'training':
-            truth = subject['truth']
-        elif subject['category'] == 'test':
-            truth = subject['strewth']
-                
-        if truth == 'LENS':
-            if np.random.rand() < classifier['truePL']: word = 'LENS'
-            else: word = 'NOT'
-        
-        elif truth == 'NOT':
-            if np.random.rand() < classifier['truePD']: word = 'NOT'
-            else: word = 'LENS'
-                
-        return word
+        # Instead, we use the classifier's own PD and PL - and the test
+        # subjects' strewth:
+
+        lens = np.array([(subject.get('strewth',subject['truth']) == 'LENS') for subject in self.subjects])[subjects]
+
+        draw = np.random.rand(len(subjects))
+        word = np.where(lens,
+                        draw < self.truePL[classifiers],
+                        draw >= self.truePD[classifiers])
+
+        return word.astype(np.int8)
 
 # ----------------------------------------------------------------------------
-# Return a tuple of the key quantities:
+# Place markers for the LENS classifications - one or more each, close
+# to the lens if there is one, and anywhere if not. Returns the offsets
+# of each classification's markers (one more than the number of
+# classifications), and all the markers' positions, end to end:
+
+    def make_markers(self,subjects,results):
 
-    def digest(self,C):
-                
-        return str(C['updated_at']),C['Name'],C['ID'],C['ZooID'],C['category'],C['kind'],C['result'],C['truth'],C['location']
+        N = len(results)
+        Nmarkers = np.where(results == 1,1 + np.random.poisson(0.5,size=N),0)
+        markers = np.zeros(N+1,dtype=np.int64)
+        markers[1:] = np.cumsum(Nmarkers)
+
+        subject = np.repeat(subjects,Nmarkers)
+        M = len(subject)
+
+        lensx = np.array([thing.get('x',np.nan) for thing in self.subjects])[subject]
+        lensy = np.array([thing.get('y',np.nan) for thing in self.subjects])[subject]
+        near = np.isfinite(lensx)
+
+        x = np.where(near,lensx + 10.0*np.random.randn(M),IMAGESIZE*np.random.rand(M))
+        y = np.where(near,lensy + 10.0*np.random.randn(M),IMAGESIZE*np.random.rand(M))
+
+        return markers,np.clip(x,0.0,IMAGESIZE),np.clip(y,0.0,IMAGESIZE)
 
 # ----------------------------------------------------------------------------
-# Return a batch of classifications, defined by a time range - either 
-# claasifications made 'since' t, or classifications made 'before' t:
-
-    def find(self,word,t):
-
-       batch = []
-       
-       if word == 'since':
-            
-            for classification in self.classifications:
-                if classification['updated_at'] > t: 
-                    batch.append(classification)
-       
+# Return a tuple of the key quantities, just as MongoDB.digest does
+# (there is only one survey, and sims are found when they are marked):
+
+    def digest(self,row,survey=None,method=False):
+
+        # Rows past the end are repeats, one fortnight later each time:
+        repeat,row = divmod(row,self.size())
+
+        classifications = self.classifications
+        subject = self.subjects[classifications['subject'][row]]
+        t = datetime.datetime.utcfromtimestamp(classifications['time'][row] + repeat*PERIOD)
+        Name = self.classifiers[classifications['classifier'][row]]['Name']
+        result = swap.RESULT[classifications['result'][row]]
+        start,end = classifications['markers'][row],classifications['markers'][row+1]
+
+        items = t.strftime('%Y-%m-%d_%H:%M:%S'),Name,subject['ID'],subject['ZooID'], \
+                subject['category'],subject['kind'],subject['flavor'],result,subject['truth'], \
+                subject['location'],str(classifications['stage'][row]), \
+                classifications['x'][start:end].tolist(),classifications['y'][start:end].tolist()
+
+        return items
+
+# ----------------------------------------------------------------------------
+# Return a batch of classifications (an iterator over row numbers),
+# defined by a time range - either claasifications made 'since' t, or
+# classifications made 'before' t. With endless=True, a 'since' batch
+# goes on for ever:
+
+    def find(self,word,t,endless=False):
+
+       seconds = calendar.timegm(t.timetuple())
+       times = self.classifications['time']
+
+       if word == 'since' and endless:
+            # Which repeat of the fortnight are we in?
+            repeat = max(0,(seconds - START)/PERIOD)
+            first = repeat*self.size() + np.searchsorted(times,seconds - repeat*PERIOD,side='right')
+            batch = itertools.count(int(first))
+
+       elif word == 'since':
+            batch = iter(xrange(np.searchsorted(times,seconds,side='right'),self.size()))
+
        elif word == 'before':
-            
-            for classification in self.classifications:
-                if classification['updated_at'] < t: 
-                    batch.append(classification)
-       
+            batch = iter(xrange(0,np.searchsorted(times,seconds,side='left')))
+
        else:
            print "ToyDB: error, cannot find classifications '"+word+"' "+str(t)
+           batch = iter([])
 
        return batch
 
@@ -302,33 +408,39 @@ class ToyDB(object):
 # Return the size of the classification table:
 
     def size(self):
-        
-        return len(self.classifications)
-        
+
+        return len(self.classifications['time'])
+
 # ----------------------------------------------------------------------------
-# Draw a PL,PD pair from circular beta PDF:
+# Draw a PL,PD pair from circular beta PDF - or, given a size, arrays
+# of them:
+
+    def draw_from_Beta2D(self,size=None):
 
-    def draw_from_Beta2D(self):
+        N = 1 if size is None else size
 
         # First draw a radius:
         alpha = 1.0/0.25
         beta = 1.0/0.8
-        R = 0.48*np.random.beta(alpha,beta,size=1)
+        R = 0.48*np.random.beta(alpha,beta,size=N)
 
         # Now draw an azimuthal angle:
         alpha = 1.0/0.25
         beta = 1.0/0.3
-        phi = -0.5*np.pi + 1.5*np.pi*np.random.beta(alpha,beta,size=1)
+        phi = -0.5*np.pi + 1.5*np.pi*np.random.beta(alpha,beta,size=N)
 
         # Convert to PL and PD, fuzzy up, and truncate:
         Pmax = 0.99
-        PL = 0.5 + R*np.cos(phi) + 0.03*np.random.randn()
+        PL = 0.5 + R*np.cos(phi) + 0.03*np.random.randn(N)
         PL[np.where(PL > Pmax)] = Pmax
-        PD = 0.5 + R*np.sin(phi) + 0.03*np.random.randn()
+        PD = 0.5 + R*np.sin(phi) + 0.03*np.random.randn(N)
         PD[np.where(PD > Pmax)] = Pmax
 
-        return PL[0],PD[0]
-        
+        if size is None:
+            return PL[0],PD[0]
+
+        return PL,PD
+
 # ======================================================================
 
 if __name__ == '__main__':
@@ -351,9 +463,9 @@ if __name__ == '__main__':
                         
         items = db.digest(classification)
         
-        # Check we got all 7 items:            
+        # Check we got all 13 items:
         if items is not None:
-            if len(items) != 7: 
+            if len(items) != 13: 
                 print "oops! ",items[:]
             else:    
                 # Count classifications
@@ -0,0 +1,293 @@
+# ===========================================================================
+
+import swap
+
+import numpy as np
+import os,shutil,array,cPickle
+
+# ======================================================================
+
+"""
+    NAME
+        votefile
+
+    PURPOSE
+        Keep the offline analysis's votes on disk, as columns, and run
+        the offline EM over them a chunk at a time - so that a whole
+        survey (or several) can be analysed without holding the
+        bureau_offline dictionaries, or even the vote matrix, in memory.
+
+    COMMENTS
+        A vote file is a directory of raw binary columns, with one row
+        per vote - one agent's last word on one subject:
+
+            agent.dat   int32   index into the agent names
+            subject.dat int32   index into the subject IDs
+            said.dat    int8    1 for LENS, 0 for NOT
+
+        and, one row per agent or per subject, the parameters the EM
+        works on, as numpy arrays:
+
+            PL.npy, PD.npy, Pi.npy      float64 per agent
+            tau.npy                     float64 per subject
+            truth.npy                   float64 per subject: the true
+                                        value of a training subject
+                                        (1 or 0), -1 to leave it out of
+                                        the M step, NaN for the rest
+
+        with an index.pickle holding the names and IDs, the number of
+        votes, and pi. The columns are written a block at a time, and
+        read back through memory maps, a chunk at a time, on every E
+        and M step (see VoteFile): only the per-agent and per-subject
+        arrays are kept in memory. When the EM is done, its PL, PD, Pi,
+        taus and pi are saved back into the file - so the next run
+        carries on from them.
+
+        Use make_vote_file.py to export the votes in a digested cache
+        (see swap/digested.py) to a vote file, and to run the EM on it.
+
+    FUNCTIONS
+        write_vote_file(directory,votes,training_IDs={},initialPL=0.5,initialPD=0.5,prior=2e-4)
+        EM_algorithm_streaming(directory,...)
+
+    CLASSES
+        VoteFile(directory,chunksize=1000000)
+
+    BUGS
+        A vote file is not appended to, and its votes are not checked
+        for repeats: give each agent's vote on a subject once.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+"""
+
+VOTE_COLUMNS = {'agent':np.int32,
+                'subject':np.int32,
+                'said':np.int8}
+
+# ======================================================================
+# Write a vote file, given an iterable of (Name, ID, xij) votes, with
+# xij 1 for LENS and 0 for NOT, and the training subjects' true values
+# (as for EM_algorithm). The agents start with initialPL and initialPD,
+# and the subjects with the prior. The file is written alongside, and
+# then moved into place. Returns the number of votes written:
+
+def write_vote_file(directory,votes,training_IDs={},initialPL=0.5,initialPD=0.5,prior=2e-4,block=1000000):
+
+    scratch = directory.rstrip('/')+'.tmp'
+    if os.path.exists(scratch): shutil.rmtree(scratch)
+    os.makedirs(scratch)
+
+    names,IDs = [],[]
+    rows,columns = {},{}
+    for name in ['agent','subject']:
+        rows[name] = {}
+        columns[name] = array.array('i')
+    columns['said'] = array.array('b')
+
+    files = {}
+    for name in VOTE_COLUMNS.keys():
+        files[name] = open(scratch+'/'+name+'.dat','wb')
+
+    def intern(name,word,words):
+        try:
+            return rows[name][word]
+        except KeyError:
+            row = len(words)
+            words.append(word)
+            rows[name][word] = row
+            return row
+
+    count = 0
+    for Name,ID,xij in votes:
+
+        columns['agent'].append(intern('agent',Name,names))
+        columns['subject'].append(intern('subject',ID,IDs))
+        columns['said'].append(int(xij))
+        count += 1
+
+        if len(columns['said']) == block:
+            for name in VOTE_COLUMNS.keys():
+                columns[name].tofile(files[name])
+                del columns[name][:]
+
+    for name in VOTE_COLUMNS.keys():
+        columns[name].tofile(files[name])
+        files[name].close()
+
+    truth = np.empty(len(IDs))
+    truth.fill(np.nan)
+    for ID,value in training_IDs.items():
+        if ID in rows['subject']:
+            truth[rows['subject'][ID]] = value
+
+    np.save(scratch+'/truth.npy',truth)
+    np.save(scratch+'/PL.npy',initialPL*np.ones(len(names)))
+    np.save(scratch+'/PD.npy',initialPD*np.ones(len(names)))
+    np.save(scratch+'/Pi.npy',prior*np.ones(len(names)))
+    np.save(scratch+'/tau.npy',prior*np.ones(len(IDs)))
+
+    index = {'names':names,
+             'IDs':IDs,
+             'count':count,
+             'pi':prior}
+    F = open(scratch+'/index.pickle','wb')
+    cPickle.dump(index,F,protocol=2)
+    F.close()
+
+    if os.path.exists(directory): shutil.rmtree(directory)
+    os.rename(scratch,directory)
+
+    return count
+
+# ======================================================================
+
+class VoteFile(swap.VoteMatrix):
+    """
+    NAME
+        VoteFile
+
+    PURPOSE
+        Serve up the votes in a vote file to the offline EM, a chunk at
+        a time, just as a VoteMatrix does from memory.
+
+    COMMENTS
+        The vote columns are memory-mapped, read-only; the E and M
+        steps' sums over them are taken chunksize votes at a time, so
+        the memory they need does not grow with the number of votes.
+        Everything else - the steps themselves, and the pool of
+        processes (each of which reads its own shard of the file, a
+        chunk at a time) - is VoteMatrix's. The agents' and subjects'
+        parameters start from those saved in the file.
+
+    INITIALISATION
+        directory     The vote file, as written by write_vote_file
+        chunksize     No. of votes to read at a time [1000000]
+
+    METHODS AND VARIABLES
+        VoteFile.save(PL,PD,Pi,tau,pi)      Write them into the file
+        VoteFile.pi                         pi, as saved in the file
+        (and VoteMatrix's estep, mstep and taus)
+
+    BUGS
+        restrict() would read all the votes into memory.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,directory,chunksize=1000000):
+
+        self.directory = directory
+        self.chunksize = chunksize
+        self.bureau_offline = None
+
+        F = open(directory+'/index.pickle','rb')
+        index = cPickle.load(F)
+        F.close()
+        self.names, self.IDs, self.count, self.pi = index['names'], index['IDs'], index['count'], index['pi']
+
+        for name,dtype in VOTE_COLUMNS.items():
+            if self.count > 0:
+                column = np.memmap(directory+'/'+name+'.dat',dtype=dtype,mode='r')
+            else:
+                column = np.zeros(0,dtype=dtype)
+            self.__dict__[name] = column
+
+        for name in ['PL','PD','Pi','tau','truth']:
+            self.__dict__[name] = np.load(directory+'/'+name+'.npy')
+
+        # Number of votes on each subject:
+        self.N = np.zeros(len(self.IDs),dtype=np.int64)
+        for start in xrange(0,self.count,self.chunksize):
+            self.N += np.bincount(self.subject[start:start+self.chunksize],minlength=len(self.IDs))
+
+        self.held_agents = None
+        self.held_subjects = None
+        self.base = None
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'file of %d votes, by %d agents on %d subjects, in %s' % (self.count,len(self.names),len(self.IDs),self.directory)
+
+# ----------------------------------------------------------------------
+# The sums over the votes given (all of them, or one process's shard)
+# are taken a chunk at a time:
+
+    def posteriors(self,PL,PD,tau,agent,subject,said):
+
+        total = np.zeros(len(tau))
+        for start in xrange(0,len(said),self.chunksize):
+            chunk = slice(start,start+self.chunksize)
+            total += swap.VoteMatrix.posteriors(self,PL,PD,tau,np.asarray(agent[chunk]),
+                                                np.asarray(subject[chunk]),np.asarray(said[chunk],dtype=bool))
+
+        return total
+
+    def sums(self,tau,agent,subject,said):
+
+        total = np.zeros((5,len(self.names)))
+        for start in xrange(0,len(said),self.chunksize):
+            chunk = slice(start,start+self.chunksize)
+            total += swap.VoteMatrix.sums(self,tau,np.asarray(agent[chunk]),
+                                          np.asarray(subject[chunk]),np.asarray(said[chunk],dtype=bool))
+
+        return total
+
+# ----------------------------------------------------------------------
+# Save the fitted parameters back into the file:
+
+    def save(self,PL,PD,Pi,tau,pi):
+
+        for name,values in [('PL',PL),('PD',PD),('Pi',Pi),('tau',tau)]:
+            np.save(self.directory+'/'+name+'.npy',values)
+            self.__dict__[name] = values
+
+        self.pi = pi
+        index = {'names':self.names,
+                 'IDs':self.IDs,
+                 'count':self.count,
+                 'pi':pi}
+        F = open(self.directory+'/index.pickle','wb')
+        cPickle.dump(index,F,protocol=2)
+        F.close()
+
+        return
+
+# ======================================================================
+# Expectation Maximization algorithm, out of core: run the EM on a vote
+# file, reading its votes chunksize at a time on every step, plain or
+# accelerated, here or in a pool of processes (as EM_algorithm_sparse
+# does), starting from the parameters saved in it. The fitted ones are
+# saved back into it. Returns the VoteFile (holding them) and pi, and
+# the information_dict if asked:
+
+def EM_algorithm_streaming(directory, N_min=10, N_max=50, epsilon_min=1e-5,
+                           return_information=False, accelerate=None,
+                           processes=1, chunksize=1000000):
+
+    votes = VoteFile(directory, chunksize)
+
+    PL, PD, Pi, tau, pi, information_dict \
+        = swap.fit_votes(votes, N_min, N_max, epsilon_min, accelerate, processes)
+
+    if information_dict['N_try'] > 0:
+        votes.save(PL, PD, Pi, tau, pi)
+
+    if return_information:
+        return votes, votes.pi, information_dict
+    else:
+        return votes, votes.pi
+
+# ======================================================================
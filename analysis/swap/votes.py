@@ -0,0 +1,656 @@
+# ======================================================================
+
+import numpy as np
+import copy,time,multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+# ======================================================================
+
+class VoteMatrix(object):
+    """
+    NAME
+        VoteMatrix
+
+    PURPOSE
+        Hold the offline bureau's classifications as a sparse
+        volunteer x subject matrix, so that the steps of the offline EM
+        algorithm (see swap/offline.py) can be done with numpy, all at
+        once, rather than by walking the nested dictionaries.
+
+    COMMENTS
+        The matrix is kept in coordinate form: three parallel arrays,
+        with one entry per classification - the agent's row, the
+        subject's column, and what the agent said (1 for LENS, 0 for
+        NOT). Only subjects with a tau are included, as in Estep and
+        Mstep. Sums over an agent's (or a subject's) classifications
+        are then np.bincount's over the rows (or columns), weighted by
+        whatever is being summed.
+
+        The agents' PL and PD, and the subjects' taus, are numpy arrays
+        in the order of the matrix's rows and columns; the training
+        subjects' true values are too (NaN for the rest). bureau() and
+        taus() put them back into dictionaries, as EM_algorithm
+        returns them.
+
+    INITIALISATION
+        bureau_offline  Dictionary of offline agents (see swap/offline.py)
+        taus            Dictionary of subjects' probabilities
+        training_IDs    Dictionary of training subjects' true values
+
+    METHODS AND VARIABLES
+        VoteMatrix.estep(PL,PD,tau)     New taus
+        VoteMatrix.mstep(tau,laplace=1) New PL, PD, Pi, pi
+        VoteMatrix.bureau(PL,PD,Pi)     Offline bureau dictionary
+        VoteMatrix.taus(tau)            Taus dictionary
+        VoteMatrix.restrict(names,IDs)  Copy that only updates these
+        VoteMatrix.PL, .PD, .Pi, .tau   Starting values
+        VoteMatrix.names, .IDs          Rows' and columns' keys
+
+        EM_algorithm_sparse(...) runs the EM on one, as plain fixed-point
+        iterations or, with accelerate='squarem', extrapolated ones.
+
+    BUGS
+        Summing in a different order to the dictionaries means that the
+        results can differ from theirs in the last decimal place.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,bureau_offline,taus,training_IDs={}):
+
+        self.bureau_offline = bureau_offline
+
+        self.IDs = taus.keys()
+        column = dict([(ID,j) for j,ID in enumerate(self.IDs)])
+        self.tau = np.array([taus[ID] for ID in self.IDs],dtype=np.float64)
+
+        self.truth = np.empty(len(self.IDs))
+        self.truth.fill(np.nan)
+        for ID,truth in training_IDs.items():
+            if ID in column:
+                self.truth[column[ID]] = truth
+
+        self.names = bureau_offline.keys()
+        self.PL = np.array([bureau_offline[name]['PL'] for name in self.names],dtype=np.float64)
+        self.PD = np.array([bureau_offline[name]['PD'] for name in self.names],dtype=np.float64)
+        self.Pi = np.array([bureau_offline[name]['Pi'] for name in self.names],dtype=np.float64)
+
+        agents,subjects,said = [],[],[]
+        for i,name in enumerate(self.names):
+            for ID,xij in bureau_offline[name]['Subjects'].items():
+                if ID in column:
+                    agents.append(i)
+                    subjects.append(column[ID])
+                    said.append(xij)
+
+        self.agent = np.array(agents,dtype=np.int64)
+        self.subject = np.array(subjects,dtype=np.int64)
+        self.said = np.array(said,dtype=bool)
+
+        # Number of classifications of each subject:
+        self.N = np.bincount(self.subject,minlength=len(self.IDs))
+
+        # Agents and subjects whose values are held fixed, and the sums
+        # over the votes left out (see restrict):
+        self.held_agents = None
+        self.held_subjects = None
+        self.base = None
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'matrix of %d votes, by %d agents on %d subjects' % (len(self.said),len(self.names),len(self.IDs))
+
+# ----------------------------------------------------------------------
+# Expectation step: each subject's new tau is the mean, over its
+# classifications, of the posterior given that classification alone
+# (and its old tau). Subjects with no classifications keep theirs:
+
+    def estep(self,PL,PD,tau):
+
+        total = self.posteriors(PL,PD,tau,self.agent,self.subject,self.said)
+
+        return self.expect(total,tau)
+
+# ----------------------------------------------------------------------
+# Each subject's sum of posteriors, over the votes given:
+
+    def posteriors(self,PL,PD,tau,agent,subject,said):
+
+        pi_ij = tau[subject]
+        pos = np.where(said,PL[agent],1 - PL[agent]) * pi_ij
+        neg = np.where(said,1 - PD[agent],PD[agent]) * (1 - pi_ij)
+
+        return np.bincount(subject,weights=pos / (pos + neg),minlength=len(tau))
+
+# ----------------------------------------------------------------------
+# New taus, from the subjects' sums of posteriors over all their votes:
+
+    def expect(self,total,tau):
+
+        seen = (self.N > 0)
+        tau_prime = tau.copy()
+        tau_prime[seen] = total[seen] / self.N[seen]
+
+        if self.held_subjects is not None:
+            tau_prime[self.held_subjects] = tau[self.held_subjects]
+
+        return tau_prime
+
+# ----------------------------------------------------------------------
+# Maximization step, with Laplace smoothing: the training subjects'
+# true values stand in for their taus, and those set aside (true value
+# < 0) are left out (see sums). Any sums over votes left out of a
+# restricted matrix are added back in:
+
+    def mstep(self,tau,laplace=1):
+
+        sums = self.sums(tau,self.agent,self.subject,self.said)
+
+        return self.maximize(sums,laplace)
+
+# ----------------------------------------------------------------------
+# New PL, PD, Pi and pi, from the agents' sums over their votes:
+
+    def maximize(self,sums,laplace=1):
+
+        if self.base is not None:
+            sums += self.base
+
+        PL_num = laplace + sums[0]
+        PL_den = 2 * laplace + sums[1]
+        PD_num = laplace + sums[2]
+        PD_den = 2 * laplace + sums[3]
+        pi_den = laplace + sums[4]
+
+        PL_den[PL_den == 0] = 1
+        PD_den[PD_den == 0] = 1
+        pi_den[pi_den == 0] = 1
+
+        PL = PL_num * 1. / PL_den
+        PD = PD_num * 1. / PD_den
+        Pi = PL_den * 1. / pi_den
+        pi = np.sum(PL_den) * 1. / np.sum(pi_den)
+
+        if self.held_agents is not None:
+            PL[self.held_agents] = self.PL[self.held_agents]
+            PD[self.held_agents] = self.PD[self.held_agents]
+            Pi[self.held_agents] = self.Pi[self.held_agents]
+
+        return PL,PD,Pi,pi
+
+# ----------------------------------------------------------------------
+# Each agent's sums, over the votes given, of x tau, tau, (1-x)(1-tau),
+# (1-tau) and 1, as rows of an array:
+
+    def sums(self,tau,agent,subject,said):
+
+        tauj = np.where(np.isnan(self.truth),tau,self.truth)[subject]
+        used = (tauj >= 0)
+        agent = agent[used]
+        said = said[used]
+        tauj = tauj[used]
+
+        M = len(self.names)
+        return np.array([np.bincount(agent,weights=said * tauj,minlength=M),
+                         np.bincount(agent,weights=tauj,minlength=M),
+                         np.bincount(agent,weights=(1 - said) * (1 - tauj),minlength=M),
+                         np.bincount(agent,weights=1 - tauj,minlength=M),
+                         np.bincount(agent,minlength=M)])
+
+# ----------------------------------------------------------------------
+# Return a copy of the matrix that only updates the agents and subjects
+# given (eg those with new votes), holding all the others at their
+# current values. It keeps just the votes on those subjects: the
+# agents' votes on the others only enter the M step through sums that
+# cannot change, so they are summed here, once. Its steps then cost in
+# proportion to the votes on the subjects given, not to the whole
+# matrix. Its pi is not the whole bureau's:
+
+    def restrict(self,names,IDs):
+
+        names,IDs = set(names),set(IDs)
+        free_agents = np.array([name in names for name in self.names],dtype=bool)
+        free_subjects = np.array([ID in IDs for ID in self.IDs],dtype=bool)
+        used = free_subjects[self.subject]
+        held = ~used & free_agents[self.agent]
+
+        local = copy.copy(self)
+        local.agent = self.agent[used]
+        local.subject = self.subject[used]
+        local.said = self.said[used]
+        local.N = np.bincount(local.subject,minlength=len(self.IDs))
+        local.held_agents = ~free_agents
+        local.held_subjects = ~free_subjects
+        local.base = self.sums(self.tau,self.agent[held],self.subject[held],self.said[held])
+
+        return local
+
+# ----------------------------------------------------------------------
+# Put the agents' new values back into a copy of the offline bureau,
+# just as Mstep does:
+
+    def bureau(self,PL,PD,Pi):
+
+        bureau_offline = self.bureau_offline.copy()
+        for i,name in enumerate(self.names):
+            agent = bureau_offline[name].copy()
+            agent.update({'PD': PD[i], 'PL': PL[i], 'Pi': Pi[i]})
+            bureau_offline[name] = agent
+
+        return bureau_offline
+
+# ----------------------------------------------------------------------
+
+    def taus(self,tau):
+
+        return dict(zip(self.IDs,tau.tolist()))
+
+# ======================================================================
+
+class VotePool(object):
+    """
+    NAME
+        VotePool
+
+    PURPOSE
+        Do the E and M steps of a VoteMatrix in a pool of processes, so
+        that the offline EM can use all the cores of a machine.
+
+    COMMENTS
+        Both steps are sums over the votes: per subject in the E step,
+        and per agent in the M step. So the votes are cut into one
+        shard per process, each process sums over its shard, and the
+        partial sums are added up here, before the step is finished off
+        just as VoteMatrix would (see VoteMatrix.expect and maximize).
+
+        The matrix is shared with the workers when they are forked, and
+        not copied. The parameters (PL, PD and tau) are broadcast to
+        them through shared memory at each step, and their partial sums
+        come back the same way, one row per shard - so nothing bigger
+        than a shard number is pickled, at any step.
+
+        A VotePool has the same estep and mstep as a VoteMatrix, and the
+        same PL, PD, Pi, tau, names and IDs, so EM_algorithm_sparse's
+        loops run on either. Close it when done.
+
+    INITIALISATION
+        votes         VoteMatrix (or a restricted one)
+        processes     No. of processes [one per core]
+
+    METHODS AND VARIABLES
+        VotePool.estep(PL,PD,tau)
+        VotePool.mstep(tau,laplace=1)
+        VotePool.close()
+
+    BUGS
+        Adding up the partial sums in a different order means that the
+        results can differ from VoteMatrix's in the last decimal place.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the GPL v2 by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,votes,processes=None):
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = max(1,processes)
+
+        self.votes = votes
+        self.names, self.IDs = votes.names, votes.IDs
+        self.PL, self.PD, self.Pi, self.tau = votes.PL, votes.PD, votes.Pi, votes.tau
+
+        M, S = len(votes.names), len(votes.IDs)
+        bounds = np.linspace(0,len(votes.said),self.processes+1).astype(np.int64)
+        self.shards = zip(bounds[:-1],bounds[1:])
+
+        # Parameters in, and partial sums out:
+        self.shared = {'PL': RawArray('d',max(1,M)),
+                       'PD': RawArray('d',max(1,M)),
+                       'tau': RawArray('d',max(1,S)),
+                       'E': RawArray('d',max(1,self.processes*S)),
+                       'M': RawArray('d',max(1,self.processes*5*M))}
+        self.PLs, self.PDs, self.taus, self.E, self.M = shared_arrays(self.shared,M,S,self.processes)
+
+        self.pool = multiprocessing.Pool(self.processes,initializer=share_votes,
+                                         initargs=(votes,self.shared,self.shards))
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'pool of %d processes, sharing the %s' % (self.processes,str(self.votes))
+
+# ----------------------------------------------------------------------
+
+    def estep(self,PL,PD,tau):
+
+        self.PLs[:] = PL
+        self.PDs[:] = PD
+        self.taus[:] = tau
+        self.pool.map(estep_job,range(len(self.shards)),chunksize=1)
+
+        return self.votes.expect(self.E.sum(axis=0),tau)
+
+# ----------------------------------------------------------------------
+
+    def mstep(self,tau,laplace=1):
+
+        self.taus[:] = tau
+        self.pool.map(mstep_job,range(len(self.shards)),chunksize=1)
+
+        return self.votes.maximize(self.M.sum(axis=0),laplace)
+
+# ----------------------------------------------------------------------
+
+    def close(self):
+
+        self.pool.close()
+        self.pool.join()
+
+        return
+
+# ======================================================================
+# The workers' side of a VotePool: each one keeps the matrix, and numpy
+# views of the shared memory, and sums over one shard of the votes at a
+# time, into that shard's row.
+
+_votes, _shards, _arrays = None, None, None
+
+def shared_arrays(shared,nagents,nsubjects,nshards):
+
+    PL = np.frombuffer(shared['PL'])[:nagents]
+    PD = np.frombuffer(shared['PD'])[:nagents]
+    tau = np.frombuffer(shared['tau'])[:nsubjects]
+    E = np.frombuffer(shared['E'])[:nshards*nsubjects].reshape(nshards,nsubjects)
+    M = np.frombuffer(shared['M'])[:nshards*5*nagents].reshape(nshards,5,nagents)
+
+    return PL,PD,tau,E,M
+
+def share_votes(votes,shared,shards):
+    global _votes, _shards, _arrays
+    _votes, _shards = votes, shards
+    _arrays = shared_arrays(shared,len(votes.names),len(votes.IDs),len(shards))
+    return
+
+def estep_job(k):
+    PL, PD, tau, E, M = _arrays
+    start, stop = _shards[k]
+    E[k] = _votes.posteriors(PL, PD, tau, _votes.agent[start:stop],
+                             _votes.subject[start:stop], _votes.said[start:stop])
+    return
+
+def mstep_job(k):
+    PL, PD, tau, E, M = _arrays
+    start, stop = _shards[k]
+    M[k] = _votes.sums(tau, _votes.agent[start:stop],
+                       _votes.subject[start:stop], _votes.said[start:stop])
+    return
+
+# ======================================================================
+# Expectation Maximization algorithm, on a VoteMatrix: takes and returns
+# the same as offline.EM_algorithm. With accelerate='squarem', the EM
+# steps are extrapolated (see squarem below), and N_min and N_max count
+# EM steps, not cycles.
+#
+# Given the agents and subjects with new votes, as updated=(names,IDs),
+# the EM is warm-started: it starts from the bureau's PL and PD and the
+# taus as they are (eg from the last batch's offline pickle), iterates
+# on the updated agents and subjects only (see VoteMatrix.restrict),
+# until they settle, and then sweeps over everything, from there, once
+# (the rest having settled last time). The first phase's
+# information_dict is kept in the second's, as 'local'.
+#
+# With processes other than 1, the steps are done in a VotePool of that
+# many processes (None for one per core). Either way, information_dict
+# has the time taken by each step (or SQUAREM cycle), as 'time_list'.
+
+def EM_algorithm_sparse(bureau_offline, pi, taus, training_IDs={},
+                        N_min=10, N_max=50, epsilon_min=1e-5,
+                        return_information=False, accelerate=None,
+                        updated=None, processes=1):
+
+    votes = VoteMatrix(bureau_offline, taus, training_IDs)
+
+    if updated is not None:
+        local = votes.restrict(*updated)
+        votes.PL, votes.PD, votes.Pi, votes.tau, pi_local, information_local \
+            = fit_votes(local, N_min, N_max, epsilon_min, accelerate, processes)
+        N_min, N_max = 1, 1
+
+    PL, PD, Pi, tau, pi_prime, information_dict \
+        = fit_votes(votes, N_min, N_max, epsilon_min, accelerate, processes)
+
+    if information_dict['N_try'] > 0:
+        bureau_offline = votes.bureau(PL, PD, Pi)
+        taus = votes.taus(tau)
+        pi = pi_prime
+
+    if updated is not None:
+        information_dict['local'] = information_local
+
+    if return_information:
+        return bureau_offline, pi, taus, information_dict
+    else:
+        return bureau_offline, pi, taus
+
+# ----------------------------------------------------------------------
+# Run the EM on a VoteMatrix (or anything with its estep and mstep),
+# plain or accelerated, here or in a VotePool. Returns the same as
+# iterate:
+
+def fit_votes(votes, N_min, N_max, epsilon_min, accelerate=None, processes=1):
+
+    if accelerate == 'squarem':
+        fit = squarem
+    elif accelerate is None:
+        fit = iterate
+    else:
+        raise ValueError("fit_votes: unknown accelerator "+str(accelerate))
+
+    if processes == 1:
+        return fit(votes, N_min, N_max, epsilon_min)
+
+    pool = VotePool(votes, processes)
+    try:
+        return fit(pool, N_min, N_max, epsilon_min)
+    finally:
+        pool.close()
+
+# ----------------------------------------------------------------------
+# Plain EM: alternate E and M steps until the taus settle. Returns the
+# new PL, PD, Pi, taus and pi (None if no steps were taken), and the
+# information_dict:
+
+def iterate(votes, N_min, N_max, epsilon_min):
+
+    PL, PD, Pi, tau = votes.PL, votes.PD, votes.Pi, votes.tau
+    pi = None
+
+    epsilon_taus = 10
+
+    N_try = 0
+
+    epsilon_list = []
+    time_list = []
+
+    while (epsilon_taus > epsilon_min) * (N_try < N_max) + (N_try < N_min):
+
+        started = time.time()
+
+        # E step
+        tau_prime = votes.estep(PL, PD, tau)
+        epsilon_taus = np.sum(np.square(tau - tau_prime))
+        tau = tau_prime
+
+        # M step
+        PL, PD, Pi, pi = votes.mstep(tau)
+
+        # divide epsilon_taus by the number of taus
+        epsilon_taus = np.sqrt(epsilon_taus) * 1. / len(tau)
+        epsilon_list.append(epsilon_taus)
+        time_list.append(time.time() - started)
+        N_try += 1
+
+    information_dict = {'N_try': N_try,
+                        'epsilon_list': epsilon_list,
+                        'time_list': time_list,
+                        'epsilon_taus': epsilon_taus,
+                        'epsilon_min': epsilon_min,
+                        'N_max': N_max,
+                        'N_min': N_min}
+
+    return PL, PD, Pi, tau, pi, information_dict
+
+# ----------------------------------------------------------------------
+# SQUAREM (Varadhan & Roland 2008, scheme S3): the EM step is a map F on
+# theta = (PL, PD, tau). Each cycle takes two EM steps from theta0,
+#   r = F(theta0) - theta0,  v = F(F(theta0)) - F(theta0) - r,
+# jumps to theta0 - 2 alpha r + alpha^2 v, with alpha = -|r|/|v|, and
+# takes one more EM step from there to stabilise. alpha = -1 is just
+# three plain EM steps. There is no likelihood to watch here (the E
+# step averages the posteriors from single votes), so the safeguard is
+# on the residual |F(theta) - theta|: a jump that leaves more than 3
+# times the residual theta0 had (or a NaN) is not taken, and the cycle
+# falls back to plain EM steps. PL, PD and the taus are all kept inside
+# (0,1): a tau of exactly 0 or 1 is its own prior in the E step, so would
+# never move again. The convergence test is on the taus' change in the
+# stabilising step, as for plain EM. A cycle takes up to four EM steps,
+# so when fewer than that are left before N_max (or N_min), single
+# plain EM steps are taken instead (alpha = 0, in step_list), and N_try
+# never passes N_max. Returns the same as iterate.
+#
+# Where the EM has more than one fixed point, a jump can carry the taus
+# to a different one from that plain EM would settle on, from the same
+# start: compare_accelerated (below) checks.
+
+def squarem(votes, N_min, N_max, epsilon_min):
+
+    M = len(votes.names)
+    ceiling = np.ones(2*M + len(votes.tau)) - 1e-12
+    floor = 1 - ceiling
+
+    def em(theta):
+        tau = votes.estep(theta[:M], theta[M:2*M], theta[2*M:])
+        PL, PD, Pi, pi = votes.mstep(tau)
+        return np.concatenate([PL, PD, tau]), Pi, pi
+
+    def epsilon(theta, theta_prime):
+        return np.sqrt(np.sum(np.square(theta[2*M:] - theta_prime[2*M:]))) * 1. / len(votes.tau)
+
+    theta = np.concatenate([votes.PL, votes.PD, votes.tau])
+    Pi, pi = votes.Pi, None
+
+    epsilon_taus = 10
+
+    N_try = 0
+    N_cycles = 0
+    N_rejected = 0
+
+    epsilon_list = []
+    residual_list = []
+    step_list = []
+    time_list = []
+
+    limit = max(N_min, N_max)
+
+    while (epsilon_taus > epsilon_min) * (N_try < N_max) + (N_try < N_min):
+
+        started = time.time()
+
+        if limit - N_try < 4:
+            # No room for a whole cycle: one plain EM step.
+            alpha = 0.0
+            jump = theta
+            theta_prime, Pi_prime, pi_prime = em(jump)
+            N_try += 1
+            residual_list.append(np.sqrt(np.sum(np.square(theta_prime - theta))))
+
+        else:
+            theta1, Pi, pi = em(theta)
+            theta2, Pi, pi = em(theta1)
+            N_try += 2
+            r = theta1 - theta
+            v = theta2 - theta1 - r
+            residual = np.sqrt(np.sum(np.square(r)))
+            residual_list.append(residual)
+
+            if np.sum(np.square(v)) > 0:
+                alpha = min(-1.0, -residual / np.sqrt(np.sum(np.square(v))))
+            else:
+                alpha = -1.0
+
+            if alpha == -1.0:
+                jump = theta2
+            else:
+                jump = np.clip(theta - 2*alpha*r + alpha**2*v, floor, ceiling)
+            theta_prime, Pi_prime, pi_prime = em(jump)
+            N_try += 1
+
+            # Safeguard: fall back to plain EM steps if the jump went wrong:
+            if alpha != -1.0 and not np.sqrt(np.sum(np.square(theta_prime - jump))) <= 3 * residual:
+                N_rejected += 1
+                alpha = -1.0
+                jump = theta2
+                theta_prime, Pi_prime, pi_prime = em(jump)
+                N_try += 1
+
+        step_list.append(alpha)
+        epsilon_taus = epsilon(jump, theta_prime)
+        epsilon_list.append(epsilon_taus)
+        theta, Pi, pi = theta_prime, Pi_prime, pi_prime
+        time_list.append(time.time() - started)
+        N_cycles += 1
+
+    information_dict = {'N_try': N_try,
+                        'N_cycles': N_cycles,
+                        'N_rejected': N_rejected,
+                        'epsilon_list': epsilon_list,
+                        'epsilon_taus': epsilon_taus,
+                        'epsilon_min': epsilon_min,
+                        'residual_list': residual_list,
+                        'step_list': step_list,
+                        'time_list': time_list,
+                        'accelerate': 'squarem',
+                        'N_max': N_max,
+                        'N_min': N_min}
+
+    return theta[:M], theta[M:2*M], Pi, theta[2*M:], pi, information_dict
+
+
+# ----------------------------------------------------------------------
+# Check an accelerated fit against plain EM: fit the votes both ways,
+# from their starting values, and count the taus that end up more than
+# tolerance apart. Returns that count, the largest difference, and both
+# fits' information_dicts:
+
+def compare_accelerated(votes, N_min=10, N_max=50, epsilon_min=1e-5,
+                        accelerate='squarem', processes=1, tolerance=0.01):
+
+    PL, PD, Pi, tau, pi, information_plain \
+        = fit_votes(votes, N_min, N_max, epsilon_min, None, processes)
+    PL, PD, Pi, tau_fast, pi, information_fast \
+        = fit_votes(votes, N_min, N_max, epsilon_min, accelerate, processes)
+
+    difference = np.abs(tau - tau_fast)
+    if len(difference) == 0:
+        return 0, 0.0, information_plain, information_fast
+
+    return np.sum(difference > tolerance), np.max(difference), information_plain, information_fast
+
+# ======================================================================